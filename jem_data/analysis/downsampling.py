@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reducing a time series to few enough points to plot, whilst keeping its
+shape.
+
+Both algorithms take a list of (time, value) points, sorted by time, and
+return at most `max_points` of them.
+
+    - `min_max` splits the series into equal time intervals, and keeps the
+      lowest and highest point of each.  Every peak survives, which makes it
+      the right choice for spotting spikes.
+    - `lttb` ("largest triangle three buckets", from Sveinn Steinarsson's
+      thesis "Downsampling Time Series for Visual Representation") splits the
+      series into equal-sized buckets, and keeps the one point of each which
+      forms the largest triangle with the points kept either side of it.  This
+      follows the visual shape of the series closely, with half as many points
+      as `min_max`.
+"""
+
+METHODS = ('lttb', 'min_max')
+
+def downsample(points, max_points, method='lttb'):
+    '''Downsample the points using the named method.'''
+    if method == 'lttb':
+        return lttb(points, max_points)
+    elif method == 'min_max':
+        return min_max(points, max_points)
+    else:
+        raise ValueError("Unknown downsampling method: %s" % method)
+
+def lttb(points, max_points):
+    '''Largest triangle three buckets.
+
+    The first and last points are always kept, and the rest are split into
+    `max_points - 2` buckets, keeping one point from each.
+    '''
+    if max_points < 3:
+        raise ValueError("Expected at least 3 points, not %d" % max_points)
+
+    n = len(points)
+    if n <= max_points:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = float(n - 2) / (max_points - 2)
+
+    a_t, a_v = points[0]
+    for i in xrange(max_points - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # The third point of the triangle is the average of the next bucket.
+        next_start = end
+        next_end = max(min(int((i + 2) * bucket_size) + 1, n),
+                       next_start + 1)
+        next_count = next_end - next_start
+        c_t = sum( p[0] for p in points[next_start:next_end] ) / \
+                float(next_count)
+        c_v = sum( p[1] for p in points[next_start:next_end] ) / \
+                float(next_count)
+
+        # Twice the triangle's area, which is just as good to compare by.
+        best_area = -1
+        best = None
+        for j in xrange(start, end):
+            b_t, b_v = points[j]
+            area = abs((a_t - c_t) * (b_v - a_v) - (a_t - b_t) * (c_v - a_v))
+            if area > best_area:
+                best_area = area
+                best = points[j]
+
+        sampled.append(best)
+        a_t, a_v = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def min_max(points, max_points):
+    '''The minimum and maximum points of each of `max_points / 2` equal time
+    intervals, in time order.
+    '''
+    if max_points < 2:
+        raise ValueError("Expected at least 2 points, not %d" % max_points)
+
+    n = len(points)
+    if n <= max_points:
+        return list(points)
+
+    buckets = max_points // 2
+    first_t = points[0][0]
+    interval = float(points[-1][0] - first_t) / buckets or 1.0
+
+    sampled = []
+    low = high = None
+    bucket = 0
+    for point in points:
+        b = min(int((point[0] - first_t) / interval), buckets - 1)
+        if b != bucket and low is not None:
+            sampled.extend(_in_order(low, high))
+            low = high = None
+        bucket = b
+
+        if low is None:
+            low = high = point
+        elif point[1] < low[1]:
+            low = point
+        elif point[1] > high[1]:
+            high = point
+
+    sampled.extend(_in_order(low, high))
+    return sampled
+
+def _in_order(low, high):
+    if low is high:
+        return [low]
+    elif low[0] <= high[0]:
+        return [low, high]
+    else:
+        return [high, low]
@@ -0,0 +1,174 @@
+'''
+A latency histogram in the style of HdrHistogram.
+
+Rather than keeping every measurement, each is counted in a bucket whose
+width grows with the value, so that every value is recorded to within a
+fixed relative precision (by default, 3 significant figures).  So the memory
+used depends only on the range of the values, not on how many there are; and
+histograms of the same precision can be merged, by adding their counts.
+
+Values are recorded in seconds, and counted in whole `unit`s (by default,
+microseconds).  Values below `sub_bucket_count` units are counted exactly.
+Above that, each doubling of the value is split into `sub_bucket_count / 2`
+equal buckets.
+'''
+
+import math
+
+DEFAULT_UNIT = 1e-6                 # seconds
+DEFAULT_SIGNIFICANT_FIGURES = 3
+
+# The fewest values either histogram must be expected to have on each side of
+# a percentile for `moods_quantile` to test it.
+MIN_EXPECTED_COUNT = 5
+
+class LatencyHistogram(object):
+
+    def __init__(self, unit=DEFAULT_UNIT,
+                 significant_figures=DEFAULT_SIGNIFICANT_FIGURES):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError("Expected 1 to 5 significant figures")
+        self.unit = unit
+        self.significant_figures = significant_figures
+
+        # The smallest power of two that gives the required precision.
+        self._magnitude = int(math.ceil(
+                math.log(2 * 10 ** significant_figures, 2)))
+        self._sub_bucket_count = 1 << self._magnitude
+        self._half_count = self._sub_bucket_count >> 1
+
+        self._counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value, count=1):
+        '''Record `count` occurrences of the value (in seconds).'''
+        index = self._index(int(value / self.unit))
+        self._counts[index] = self._counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        '''Add the other histogram's counts to this one's.'''
+        if (other.unit, other.significant_figures) != \
+                (self.unit, self.significant_figures):
+            raise ValueError("Can't merge histograms of different precisions")
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percentile):
+        '''The value (in seconds) at or below which the given percentage of
+        the recorded values lie, to within the histogram's precision.  Or None
+        if nothing's been recorded.
+        '''
+        if not self.count:
+            return None
+        threshold = max(1, int(math.ceil(self.count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= threshold:
+                return min(self.max, self._highest_equivalent(index) * self.unit)
+        return self.max
+
+    def asdict(self):
+        return {
+            'unit': self.unit,
+            'significant_figures': self.significant_figures,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            # JSON objects' keys must be strings, so as pairs.
+            'counts': sorted(self._counts.items()),
+        }
+
+    @classmethod
+    def fromdict(cls, d):
+        histogram = cls(d['unit'], d['significant_figures'])
+        histogram._counts = dict( (int(index), count) \
+                                    for index, count in d['counts'] )
+        histogram.count = d['count']
+        histogram.total = d['total']
+        histogram.min = d['min']
+        histogram.max = d['max']
+        return histogram
+
+    def _index(self, units):
+        if units < self._sub_bucket_count:
+            return max(0, units)
+        shift = units.bit_length() - self._magnitude
+        sub_bucket = units >> shift
+        return (self._sub_bucket_count + (shift - 1) * self._half_count +
+                (sub_bucket - self._half_count))
+
+    def _highest_equivalent(self, index):
+        '''The largest number of units counted in the bucket.'''
+        if index < self._sub_bucket_count:
+            return index
+        shift, sub_bucket = divmod(index - self._sub_bucket_count,
+                                   self._half_count)
+        shift += 1
+        sub_bucket += self._half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+def moods_quantile(a, b, percentile):
+    '''The two-sided p-value of the test of whether the given percentile of
+    the values recorded in histograms `a` and `b` is the same.  Or None if
+    there are too few values to tell: if either histogram would be expected
+    to have fewer than `MIN_EXPECTED_COUNT` values above (or below) the
+    percentile, as the normal approximation is then unreliable.
+
+    Which is Mood's median test, at the percentile rather than the median:
+    if the percentile's the same, each histogram should have the same
+    proportion of its values above the percentile of both combined.  Those
+    proportions are compared by the normal approximation to the binomial.
+    Unlike a test of the whole distribution, that tells apart histograms
+    whose tails differ, even if the bulk of their values don't.
+    '''
+    if (a.unit, a.significant_figures) != (b.unit, b.significant_figures):
+        raise ValueError("Can't compare histograms of different precisions")
+    n_a, n_b = a.count, b.count
+    n = n_a + n_b
+    if not n_a or not n_b:
+        return None
+
+    # The bucket of the combined percentile, and how many values of each
+    # histogram lie above it.
+    threshold = max(1, int(math.ceil(n * percentile / 100.0)))
+    seen = 0
+    above_a, above_b = n_a, n_b
+    for index in sorted(set(a._counts) | set(b._counts)):
+        count_a, count_b = a._counts.get(index, 0), b._counts.get(index, 0)
+        seen += count_a + count_b
+        above_a -= count_a
+        above_b -= count_b
+        if seen >= threshold:
+            break
+
+    above = float(above_a + above_b) / n
+    if min(n_a, n_b) * min(above, 1 - above) < MIN_EXPECTED_COUNT:
+        return None
+    variance = above * (1 - above) * (1.0 / n_a + 1.0 / n_b)
+    z = (float(above_b) / n_b - float(above_a) / n_a) / math.sqrt(variance)
+    return math.erfc(abs(z) / math.sqrt(2))
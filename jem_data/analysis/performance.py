@@ -1,5 +1,8 @@
 """Measure performance characteristics of a given Dirus gateway.
 
+Or, `compare` the results of one or more runs with those of a baseline run,
+and exit with a non-zero status if any is a significant regression.
+
 Usage:
     performance.py [--host=<host>]
                    [--port=<port>]
@@ -10,6 +13,10 @@ Usage:
                    [--target-dir=<target-dir>]
                    [--table=<table>]...
                    [--concurrency=<concurrency>]
+                   [--gap-tolerance=<gap-tolerance>]
+    performance.py compare <baseline> <results>...
+                   [--threshold=<threshold>]
+                   [--significance=<significance>]
 
 Options
     --host=<host>                server host [default: 127.0.0.1]
@@ -24,15 +31,36 @@ Options
                                  [default: 0]
     --target-dir=<target-dir>    directory to write result files to
                                  [default: ./results]
-    --table=<table>...           register tables to test against
-                                 [default: 1]
+    --table=<table>...           register tables to test against.  A
+                                 comma-separated group of tables (e.g.
+                                 1,2,3) is planned as one union, and
+                                 benchmarked together.  [default: 1]
     --concurrency=<concurrency>  The maximum concurrency level to run.
                                  [default: 4]
-
+    --gap-tolerance=<gap-tolerance>
+                                 the number of unused registers a request
+                                 may span in order to save another request.
+                                 Unlimited if not given.
+    --threshold=<threshold>      the percentage by which a latency percentile
+                                 may rise, or the throughput fall, before
+                                 it's a regression [default: 10]
+    --significance=<significance>
+                                 the p-value below which a difference in
+                                 a latency percentile is significant.  The
+                                 percentiles of each configuration are
+                                 tested as a family (by Holm's method), so
+                                 this is the chance of any of them being
+                                 reported by chance, per configuration
+                                 [default: 0.05]
+
+Results are either the JSON files written by a run, or the "response_times"
+CSV files written by older versions (with their "throughput" CSV files
+alongside).  Configurations which aren't in both the baseline and the results
+are ignored.
 """
-import csv
 import collections
-import itertools
+import csv
+import json
 import logging
 import os
 import Queue
@@ -45,6 +73,7 @@ import docopt
 
 from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 
+from jem_data.analysis.histogram import LatencyHistogram, moods_quantile
 from jem_data.core import modbus
 import jem_data.core.exceptions as jem_exceptions
 from jem_data.diris import registers
@@ -53,54 +82,44 @@ logging.basicConfig()
 _log = logging.getLogger()
 _log.setLevel(logging.INFO)
 
+## `latencies` is a `LatencyHistogram` of the client's response times, and
+## `errors` the number of error responses it received.
 ClientMeasurements = collections.namedtuple(
-    'ClientMeasurements', 'client_id measurements errors')
+    'ClientMeasurements', 'client_id latencies errors')
         
 BenchmarkResult = collections.namedtuple(
     'BenchmarkResult', 'concurrency delay table client_measurements total_time')
 
-def _choose_random_registers(table):
-    '''
-    Choose a (maximum) random range from the given table.
-    '''
-    addresses = sorted(table.keys())
-    max_start_address = max(addresses[0], addresses[-1] + table[addresses[-1]] - 120)
-    start_address = random.sample(
-            list(itertools.takewhile(lambda x: x <= max_start_address,
-                                     addresses)),
-            1)[0]
-    end_address = min(start_address + 120, addresses[-1])
-    return dict( (addr,table[addr]) for addr in xrange(start_address, end_address+1) \
-                                        if addr in table )
-
-def _make_random_request(client, units, table):
+PERCENTILES = (50, 90, 99, 99.9)
+
+def _make_random_request(client, units, table_requests):
     unit = random.sample(units, 1)[0]
-    registers = _choose_random_registers(table)
+    registers = random.choice(table_requests)
     start = time.time()
     response = modbus.read_registers(client, registers=registers, unit=unit)
     elapsed_time = time.time() - start
     return elapsed_time
 
-def _run_single_client(client_id, host, port, units, results, N, delay, warmup, table):
+def _run_single_client(client_id, host, port, units, results, N, delay, warmup, table_requests):
     _log.info('Client %d connecting to %s (%s)', client_id, host, port)
     client = ModbusClient(host, port=port)
     client.connect()
 
     _log.info('Client %d connected to %s (%s)', client_id, host, port)
 
-    measurements = []
-    errors = []
+    latencies = LatencyHistogram()
+    errors = 0
     for i in xrange(N):
         if N >= 1000 and i % (N/10) == 0 and i > 0:
             _log.info('Client %d %.0f%% complete', client_id, 100.0*i/N)
         try:
-            m = _make_random_request(client, units, table)
+            m = _make_random_request(client, units, table_requests)
             if i >= warmup or N <= warmup:
                 if i == warmup:
                     _log.info('Client %d warmup complete.', client_id)
-                measurements.append(m)
+                latencies.record(m)
         except jem_exceptions.JemException, e:
-            errors.append(e)
+            errors += 1
             _log.warn('Client %d received error response: %s', client_id, e)
         except Exception, e:
             from pymodbus import exceptions as es
@@ -112,12 +131,15 @@ def _run_single_client(client_id, host, port, units, results, N, delay, warmup,
     client.close()
     _log.info('Client %d closed connection', client_id)
     results.put(ClientMeasurements(client_id=client_id,
-                                   measurements=measurements,
+                                   latencies=latencies,
                                    errors=errors))
 
-def _benchmark_server(host, port, units, requests, delays, warmup, tables, concurrency):
+def _benchmark_server(host, port, units, requests, delays, warmup, tables, concurrency, gap_tolerance):
     results = []
-    for table in tables:
+    for table_ids in tables:
+        table_requests = modbus.plan_requests(
+                [ registers.TABLES[table_id - 1] for table_id in table_ids ],
+                gap_tolerance=gap_tolerance)
         for concurrency in xrange(1,concurrency+1):
             _log.info('Starting benchmarking at concurrency level %d', concurrency)
 
@@ -135,7 +157,7 @@ def _benchmark_server(host, port, units, requests, delays, warmup, tables, concu
                             requests,
                             delay,
                             warmup,
-                            registers.TABLES[table])
+                            table_requests)
                     p = multiprocessing.Process(target=_run_single_client,
                                                 args = args)
                     ps.append(p)
@@ -151,7 +173,7 @@ def _benchmark_server(host, port, units, requests, delays, warmup, tables, concu
                 total_time = time.time() - start
 
                 results.append(BenchmarkResult(
-                    table = table + 1,
+                    table = _table_label(table_ids),
                     concurrency = concurrency,
                     delay = delay,
                     client_measurements = client_measurements,
@@ -159,71 +181,259 @@ def _benchmark_server(host, port, units, requests, delays, warmup, tables, concu
 
     return results
 
+def _summarise(result):
+    '''A JSON-friendly summary of the result, with its merged latency
+    histogram.
+    '''
+    latencies = _get_all_latencies(result)
+    errors = _get_all_errors(result)
+    return {
+        'table': result.table,
+        'concurrency': result.concurrency,
+        'delay': result.delay,
+        'total_time': result.total_time,
+        'requests': latencies.count,
+        'errors': errors,
+        'throughput': (latencies.count + errors) / result.total_time,
+        'mean': latencies.mean,
+        'percentiles': [ [p, latencies.percentile(p)] for p in PERCENTILES ],
+        'max': latencies.max,
+        'histogram': latencies.asdict(),
+    }
+
 def _write_results(results, target_dir):
 
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
-    time_string = time.strftime("%Y-%m-%d %H:%M:%S.csv", time.localtime())
-    filename = "response_times " + time_string
-    filepath = os.path.join(target_dir, filename)
-    f_out = open(filepath, 'wb')
-    csv_out = csv.writer(f_out)
-    _log.info("Writing results to %s", filepath)
-    csv_out.writerow(['table', 'delay', 'concurrency level', 'response time']) # header
-    for result in results:
-        ms = _get_all_measurements(result)
-        for m in ms:
-            row = [result.table, result.delay, result.concurrency, m]
-            csv_out.writerow(row)
-    f_out.flush()
-    f_out.close()
-
-    filename = "throughput " + time_string
-    filepath = os.path.join(target_dir, filename)
-    f_out = open(filepath, 'wb')
-    csv_out = csv.writer(f_out)
+    time_string = time.strftime("%Y%m%dT%H%M%S", time.localtime())
+    filepath = os.path.join(target_dir, "performance-%s.json" % time_string)
     _log.info("Writing results to %s", filepath)
-    csv_out.writerow(['delay', 'concurrency level', 'throughput']) # header
-    for result in results:
-        ms = _get_all_measurements(result)
-        errors = _get_all_errors(result)
-        throughput = (len(ms) + len(errors)) / result.total_time
-        row = [result.delay, result.concurrency, throughput]
-        csv_out.writerow(row)
-    f_out.flush()
-    f_out.close()
-
-def _get_all_measurements(result):
-    measurements = []
+    with open(filepath, 'wb') as f_out:
+        json.dump({'results': map(_summarise, results)}, f_out, indent=2)
+
+def _get_all_latencies(result):
+    latencies = LatencyHistogram()
     for m in result.client_measurements:
-        measurements.extend(m.measurements)
-    return measurements
+        latencies.merge(m.latencies)
+    return latencies
 
 def _get_all_errors(result):
-    errors = []
-    for m in result.client_measurements:
-        errors.extend(m.errors)
-    return errors
+    return sum(m.errors for m in result.client_measurements)
 
 def _print_results(results):
     print "******* RESULTS ********"
     for result in results:
-
-        measurements = _get_all_measurements(result)
-        errors = _get_all_errors(result)
-
-        print('Table: %d; Concurrency: %d; delay: %f; Avg response time: %f, Throughput: %f/sec, Number of errors: %d' % (
-                result.table,
-                result.concurrency,
-                result.delay,
-                sum(measurements) / len(measurements),
-                (len(measurements) + len(errors)) / result.total_time,
-                len(errors)))
+        summary = _summarise(result)
+        print('Table: %s; Concurrency: %d; delay: %f; Throughput: %f/sec, '
+              'Number of errors: %d' % (
+                summary['table'],
+                summary['concurrency'],
+                summary['delay'],
+                summary['throughput'],
+                summary['errors']))
+        print('    Response times: mean %s, %s, max %s' % (
+                _format_latency(summary['mean']),
+                ', '.join('p%g %s' % (p, _format_latency(latency)) \
+                            for p, latency in summary['percentiles']),
+                _format_latency(summary['max'])))
+
+def _format_latency(latency):
+    if latency is None:
+        return '-'
+    return '%.2fms' % (latency * 1000)
+
+def _load_results(path):
+    '''The results of a run, as an ordered dict of (table, concurrency, delay)
+    to its throughput (or None, if unknown) and its `LatencyHistogram`.  The
+    table is labelled as by `_table_label`, whether the results are of a
+    single table or a union of them.
+    '''
+    if path.endswith('.json'):
+        with open(path, 'rb') as f:
+            summaries = json.load(f)['results']
+        return collections.OrderedDict(
+                ( (str(s['table']), s['concurrency'], s['delay']),
+                  (s['throughput'], LatencyHistogram.fromdict(s['histogram'])) ) \
+                    for s in summaries )
+    return _load_csv_results(path)
+
+def _load_csv_results(path):
+    '''Loads results from an older version's response times CSV, and the
+    throughput CSV alongside it (if any).  The earliest CSVs have no table
+    column, as they're all of the first table.
+    '''
+    latencies = collections.OrderedDict()
+    with open(path, 'rb') as f:
+        for row in csv.DictReader(f):
+            key = (str(int(row.get('table', 1))),
+                   int(row['concurrency level']),
+                   float(row['delay']))
+            if key not in latencies:
+                latencies[key] = LatencyHistogram()
+            latencies[key].record(float(row['response time']))
+
+    # Which has a row for each configuration, in the same order, but with no
+    # table column.
+    directory, filename = os.path.split(path)
+    throughput_path = os.path.join(
+            directory, filename.replace('response_times', 'throughput', 1))
+    throughputs = [None] * len(latencies)
+    if throughput_path != path and os.path.exists(throughput_path):
+        with open(throughput_path, 'rb') as f:
+            throughputs = [ float(row['throughput']) \
+                                for row in csv.DictReader(f) ]
+    else:
+        _log.warn("No throughputs for %s", path)
+
+    return collections.OrderedDict(
+            (key, (throughput, histogram)) \
+                for (key, histogram), throughput in \
+                    zip(latencies.items(), throughputs) )
+
+def _change(baseline, value):
+    '''The percentage change from the baseline, or None if either is unknown.
+    '''
+    if baseline is None or value is None or baseline == 0:
+        return None
+    return 100.0 * (value - baseline) / baseline
+
+def _compare_results(baseline, results, threshold, significance):
+    '''Compares each configuration in both the baseline and the results.
+
+    Returns a list of (configuration, comparison, regressions), where the
+    comparison is a dict of "throughput", each of the percentiles and "max" to
+    (baseline value, value, percentage change), with the percentiles' also
+    having the p-value of their `moods_quantile` (adjusted by `_holm`, or None
+    if there are too few values to test); and the regressions name which of
+    them have regressed.
+
+    A regression is a fall in throughput of more than `threshold` percent, or
+    a rise of more than `threshold` percent in a percentile which is
+    significantly different (at the given p-value).  Each percentile is tested
+    on its own, so a regression in the tail isn't lost in an unchanged bulk.
+    The max is reported, but too noisy to count as a regression.
+    '''
+    compared = []
+    for key, (throughput, latencies) in results.items():
+        if key not in baseline:
+            _log.warn("No baseline for table %s, concurrency %d, delay %f",
+                      *key)
+            continue
+        baseline_throughput, baseline_latencies = baseline[key]
+
+        comparison = {'throughput': (baseline_throughput, throughput,
+                                     _change(baseline_throughput, throughput))}
+        p_values = _holm([ moods_quantile(baseline_latencies, latencies, p) \
+                                for p in PERCENTILES ])
+        for p, p_value in zip(PERCENTILES, p_values):
+            before = baseline_latencies.percentile(p)
+            after = latencies.percentile(p)
+            comparison['p%g' % p] = (before, after, _change(before, after),
+                                     p_value)
+        comparison['max'] = (baseline_latencies.max, latencies.max,
+                             _change(baseline_latencies.max, latencies.max))
+
+        regressions = []
+        change = comparison['throughput'][2]
+        if change is not None and change < -threshold:
+            regressions.append('throughput')
+        for p in PERCENTILES:
+            _, _, change, p_value = comparison['p%g' % p]
+            if change is not None and change > threshold and \
+                    p_value is not None and p_value < significance:
+                regressions.append('p%g' % p)
+
+        compared.append((key, comparison, regressions))
+    return compared
+
+def _holm(p_values):
+    '''Adjusts the p-values of a family of tests by Holm's method, so that
+    comparing each with the significance level bounds the chance of any of
+    them being significant by chance.  Tests without a p-value (None) aren't
+    counted.
+    '''
+    tested = sorted( (p_value, i) for i, p_value in enumerate(p_values) \
+                        if p_value is not None )
+    adjusted = list(p_values)
+    running_max = 0.0
+    for rank, (p_value, i) in enumerate(tested):
+        running_max = max(running_max,
+                          min(1.0, (len(tested) - rank) * p_value))
+        adjusted[i] = running_max
+    return adjusted
+
+def _print_comparison(path, compared):
+    print "******* %s ********" % path
+    for (table, concurrency, delay), comparison, regressions in compared:
+        print('Table: %s; Concurrency: %d; delay: %f; %s' % (
+                table, concurrency, delay,
+                'REGRESSED: ' + ', '.join(regressions) if regressions else 'OK'))
+
+        before, after, change = comparison['throughput']
+        print('    Throughput: %s -> %s/sec (%s)' % (
+                _format_throughput(before),
+                _format_throughput(after),
+                _format_change(change)))
+
+        print('    Response times: %s' % ', '.join(
+                '%s %s -> %s (%s%s)' % (
+                        name,
+                        _format_latency(comparison[name][0]),
+                        _format_latency(comparison[name][1]),
+                        _format_change(comparison[name][2]),
+                        _format_p_value(comparison[name])) \
+                    for name in [ 'p%g' % p for p in PERCENTILES ] + ['max']))
+
+def _format_throughput(throughput):
+    if throughput is None:
+        return '-'
+    return '%.1f' % throughput
+
+def _format_p_value(compared):
+    '''The p-value of a compared percentile, to follow its change.  (The max
+    has none.)
+    '''
+    if len(compared) < 4 or compared[3] is None:
+        return ''
+    return ', p=%.3g' % compared[3]
+
+def _format_change(change):
+    if change is None:
+        return '-'
+    return '%+.1f%%' % change
+
+def compare(baseline, results, threshold, significance):
+    '''Compares each of the results with the baseline, and returns the exit
+    status: 1 if any has regressed, otherwise 0.
+    '''
+    baseline_results = _load_results(baseline)
+    regressed = False
+    for path in results:
+        compared = _compare_results(baseline_results, _load_results(path),
+                                    threshold, significance)
+        _print_comparison(path, compared)
+        regressed = regressed or any( regressions \
+                                        for _, _, regressions in compared )
+    return 1 if regressed else 0
 
 def _from_hex_string(s):
     return int(s, 16)
 
+def _parse_table_ids(s):
+    '''The (1-indexed) ids of a comma-separated group of tables.'''
+    table_ids = tuple(sorted(set( int(n) for n in s.split(',') )))
+    for table_id in table_ids:
+        if not 1 <= table_id <= len(registers.TABLES):
+            raise docopt.DocoptExit("Unknown table: %d" % table_id)
+    return table_ids
+
+def _table_label(table_ids):
+    '''How a (group of) tables is labelled in the results: "1", or "1,2,3"
+    for a union.
+    '''
+    return ','.join(map(str, table_ids))
+
 def _validate_args(raw_args):
     args = {}
     args['host'] = raw_args['--host']
@@ -233,15 +443,26 @@ def _validate_args(raw_args):
     args['delays'] = map(float, raw_args['--delay'])
     args['warmup'] = int(raw_args['--warmup'])
     args['target_dir'] = raw_args['--target-dir']
-    args['tables'] = map(lambda n: int(n) - 1, raw_args['--table'])
+    args['tables'] = map(_parse_table_ids, raw_args['--table'])
     args['concurrency'] = int(raw_args['--concurrency'])
+    args['gap_tolerance'] = raw_args['--gap-tolerance'] and int(raw_args['--gap-tolerance'])
+    return args
+
+def _validate_compare_args(raw_args):
+    args = {}
+    args['baseline'] = raw_args['<baseline>']
+    args['results'] = raw_args['<results>']
+    args['threshold'] = float(raw_args['--threshold'])
+    args['significance'] = float(raw_args['--significance'])
     return args
 
-def main(host, port, units, requests, delays, warmup, target_dir, tables, concurrency):
-    results = _benchmark_server(host, port, units, requests, delays, warmup, tables, concurrency)
+def main(host, port, units, requests, delays, warmup, target_dir, tables, concurrency, gap_tolerance):
+    results = _benchmark_server(host, port, units, requests, delays, warmup, tables, concurrency, gap_tolerance)
     _print_results(results)
     _write_results(results, target_dir)
 
 if __name__ == '__main__':
-    args = _validate_args(docopt.docopt(__doc__))
-    main(**args)
+    raw_args = docopt.docopt(__doc__)
+    if raw_args['compare']:
+        sys.exit(compare(**_validate_compare_args(raw_args)))
+    main(**_validate_args(raw_args))
@@ -0,0 +1,467 @@
+"""Benchmark the whole acquisition pipeline, against a farm of simulated
+gateways.
+
+For each number of devices, a farm of simulated gateways is started (see
+`server_sim.farm`), and a `SystemControlService` records from every device:
+the table request manager schedules the reads, the readers make them, and the
+mongo sink writes the responses, either to a local mongod or to an in-memory
+stand-in (which encodes each document as pymongo would, and then discards it).
+
+Once warmed up, the pipeline is measured for the given duration:
+
+  * the configured rate of table polls, and the rates achieved: polls sent
+    by the manager, polls completed by the readers, and responses persisted
+    by the sink;
+  * the latency from the start of each response's read until it was
+    persisted, as percentiles;
+  * the depths of the request queues, the requests in flight, and the depth
+    of the results queue, as means and maxima;
+  * the CPU used by each stage, as a percentage of one core.
+
+Usage:
+    pipeline_benchmark.py [--devices=<devices>]...
+                          [--units-per-gateway=<units>]
+                          [--table=<table>]...
+                          [--interval=<interval>]
+                          [--warmup=<warmup>]
+                          [--duration=<duration>]
+                          [--readers=<readers>]
+                          [--latency=<latency>]
+                          [--serial]
+                          [--base-port=<port>]
+                          [--mongo=<host:port>]
+                          [--target-dir=<target-dir>]
+                          [--verbose]
+
+Options
+    --devices=<devices>...         the numbers of devices to benchmark with
+                                   [default: 1 10 50]
+    --units-per-gateway=<units>    the most devices on each gateway
+                                   [default: 10]
+    --table=<table>...             the tables recorded from each device
+                                   [default: 1]
+    --interval=<interval>          the interval between polls of each table,
+                                   in seconds [default: 1.0]
+    --warmup=<warmup>              seconds to run before measuring
+                                   [default: 5]
+    --duration=<duration>          seconds to measure for [default: 20]
+    --readers=<readers>            reader processes per gateway [default: 2]
+    --latency=<latency>            the simulated gateways' latency (see
+                                   `server_sim.farm`) [default: constant:0]
+    --serial                       simulate each gateway's serial bus
+    --base-port=<port>             the first simulated gateway's port
+                                   [default: 5020]
+    --mongo=<host:port>            write to this mongod (into the
+                                   "jem-data-benchmark" database), rather
+                                   than the in-memory stand-in
+    --target-dir=<target-dir>      directory to write result files to
+                                   [default: ./results]
+    --verbose                      show the output of the system's processes
+"""
+import csv
+import collections
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+import bson
+import docopt
+
+import jem_data.core.domain as domain
+import jem_data.core.mongo_sink as mongo_sink
+import jem_data.dal as dal
+import jem_data.diris.devices as devices
+import jem_data.server_sim.farm as farm
+import jem_data.services.system_control as system_control
+
+logging.basicConfig()
+_log = logging.getLogger()
+_log.setLevel(logging.INFO)
+
+_BENCHMARK_DATABASE = 'jem-data-benchmark'
+
+# How often queue depths are sampled.
+_SAMPLE_INTERVAL = 0.5  # seconds
+
+_PERCENTILES = (50, 90, 99)
+
+_STAGES = ('manager', 'readers', 'sink', 'farm')
+
+PipelineResult = collections.namedtuple(
+    'PipelineResult',
+    'devices gateways configured_rate sent_rate completed_rate '
+    'persisted_rate skipped_rate latency_percentiles queue_depths cpu')
+
+def _benchmark(device_counts, units_per_gateway, tables, interval, warmup,
+               duration, readers, farm_defaults, base_port, mongo):
+    results = []
+    for device_count in device_counts:
+        _log.info("Benchmarking %d devices", device_count)
+        fixtures = _fixtures(device_count, units_per_gateway, base_port)
+
+        farm_process = multiprocessing.Process(
+                target=farm.start,
+                args=(fixtures, farm_defaults))
+        farm_process.start()
+        # Give the farm a moment to start listening.
+        time.sleep(1.0)
+
+        service = _service(fixtures, readers, mongo)
+        try:
+            service.setup()
+            results.append(_measure(service, farm_process, fixtures, tables,
+                                    interval, warmup, duration))
+        finally:
+            service.shutdown()
+            farm_process.terminate()
+            farm_process.join()
+
+    return results
+
+def _fixtures(device_count, units_per_gateway, base_port):
+    gateway_count = int(math.ceil(float(device_count) / units_per_gateway))
+    fixtures = farm.generate(gateway_count, units_per_gateway,
+                             '127.0.0.1', base_port)
+    last = fixtures[-1]
+    last['devices'] = last['devices'][:device_count -
+                                      units_per_gateway * (gateway_count - 1)]
+    return fixtures
+
+def _service(fixtures, readers, mongo):
+    gateways = [ domain.Gateway(
+                    host=g['host'],
+                    port=g['port'],
+                    label=g['label'],
+                    devices=[ domain.Device(unit=d['unit'],
+                                            label=d['label'],
+                                            type=d['type'],
+                                            tables=devices.ALL[d['type']]) \
+                                for d in g['devices'] ]) \
+                    for g in fixtures ]
+    reader_processes = dict( (domain.GatewayAddr(g.host, g.port), readers) \
+                                for g in gateways )
+
+    # Don't leave benchmark responses behind in the spool.
+    system_control.spool_directory = None
+
+    if mongo is None:
+        service = system_control.SystemControlService(
+                db=_MemoryDataAccessLayer(gateways),
+                reader_processes=reader_processes,
+                connect_sink=_connect_memory_database)
+    else:
+        host, port = mongo
+        system_control.mongo_config = mongo_sink.MongoConfig(
+                host=host, port=port, database=_BENCHMARK_DATABASE)
+        service = system_control.SystemControlService(
+                db=dal.DataAccessLayer(system_control.mongo_config),
+                reader_processes=reader_processes)
+        service.update_gateways(gateways)
+    return service
+
+def _measure(service, farm_process, fixtures, tables, interval, warmup,
+             duration):
+    config = domain.RecordingConfig(gateway_recording_configs=[
+        domain.GatewayRecordingConfig(
+            host=g['host'],
+            port=g['port'],
+            device_recording_configs=[
+                domain.DeviceRecordingConfig(
+                    unit=d['unit'],
+                    table_ids=tables,
+                    polling=dict( (t, domain.Polling(interval, False)) \
+                                    for t in tables )) \
+                for d in g['devices'] ]) \
+        for g in fixtures ])
+    device_count = sum( len(g['devices']) for g in fixtures )
+
+    recording = service.start_recording(config)
+    try:
+        time.sleep(warmup)
+
+        processes = dict(service.stage_processes)
+        processes['farm'] = [farm_process]
+
+        start = time.time()
+        start_status = service.status
+        start_cpu = _cpu_seconds(processes)
+
+        samples = collections.defaultdict(list)
+        while time.time() - start < duration:
+            time.sleep(_SAMPLE_INTERVAL)
+            for name, depth in _queue_depths(service.status).items():
+                samples[name].append(depth)
+
+        elapsed = time.time() - start
+        end_status = service.status
+        end_cpu = _cpu_seconds(processes)
+    finally:
+        service.stop_recording(recording.id)
+
+    def rate(before, after):
+        return (after - before) / elapsed
+
+    start_counts = _gateway_totals(start_status)
+    end_counts = _gateway_totals(end_status)
+    sent = end_counts['sent'] - start_counts['sent']
+    completed = (sent -
+                 (end_counts['in_flight'] - start_counts['in_flight']) -
+                 (end_counts['expired'] - start_counts['expired']))
+
+    latency = [ after - before for before, after in zip(
+                                        start_status['sink']['latency'],
+                                        end_status['sink']['latency']) ]
+
+    return PipelineResult(
+            devices=device_count,
+            gateways=len(fixtures),
+            configured_rate=device_count * len(tables) / interval,
+            sent_rate=sent / elapsed,
+            completed_rate=completed / elapsed,
+            persisted_rate=rate(start_status['sink']['written'],
+                                end_status['sink']['written']),
+            skipped_rate=rate(start_counts['skipped'],
+                              end_counts['skipped']),
+            latency_percentiles=[ _histogram_percentile(latency, p) \
+                                    for p in _PERCENTILES ],
+            queue_depths=dict( (name, (float(sum(depths)) / len(depths),
+                                       max(depths))) \
+                                for name, depths in samples.items() ),
+            cpu=dict( (stage, 100.0 * rate(start_cpu[stage],
+                                           end_cpu[stage])) \
+                        for stage in _STAGES ))
+
+def _gateway_totals(status):
+    totals = collections.defaultdict(int)
+    for counters in status.get('gateways', {}).values():
+        for name, value in counters.items():
+            totals[name] += value
+    return totals
+
+def _queue_depths(status):
+    totals = _gateway_totals(status)
+    depths = {'requests': totals['queue_depth'],
+              'in_flight': totals['in_flight']}
+    if 'results_queue_depth' in status:
+        depths['results'] = status['results_queue_depth']
+    return depths
+
+def _histogram_percentile(histogram, percentile):
+    '''The upper bound of the `SinkStats` latency bucket holding the given
+    percentile, or None if it's beyond the last bound (or there's nothing in
+    the histogram).
+    '''
+    total = sum(histogram)
+    if total == 0:
+        return None
+    threshold = total * percentile / 100.0
+    seen = 0
+    for bound, count in zip(mongo_sink.SinkStats.LATENCY_BOUNDS, histogram):
+        seen += count
+        if seen >= threshold:
+            return bound
+    return None
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def _cpu_seconds(processes):
+    '''The CPU time (user and system) used so far by each stage's processes.
+    '''
+    return dict( (stage, sum(_process_cpu_seconds(p.pid) \
+                                for p in processes.get(stage, []))) \
+                    for stage in _STAGES )
+
+def _process_cpu_seconds(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The command may contain spaces, so count fields from after it.
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (IOError, TypeError):
+        return 0.0
+    utime, stime = int(fields[11]), int(fields[12])
+    return float(utime + stime) / _CLOCK_TICKS
+
+class _MemoryDataAccessLayer(object):
+    '''Stands in for the `dal.DataAccessLayer` used by the service.'''
+
+    def __init__(self, gateways):
+        self.gateways = _MemoryGatewayRepository(gateways)
+        self.recordings = _MemoryRecordingsRepository()
+
+    def ensure_indexes(self):
+        return []
+
+class _MemoryGatewayRepository(object):
+
+    def __init__(self, gateways):
+        self._gateways = list(gateways)
+
+    def all(self):
+        return list(self._gateways)
+
+    def etag(self):
+        return str(len(self._gateways))
+
+class _MemoryRecordingsRepository(object):
+
+    def __init__(self):
+        self._recordings = {}
+
+    def create(self, recording):
+        recording = recording._replace(id=uuid.uuid4().hex)
+        self._recordings[recording.id] = recording
+        return recording
+
+    def by_id(self, recording_id):
+        return self._recordings.get(recording_id)
+
+    def end_recording(self, recording_id):
+        recording = self._recordings[recording_id]._replace(
+                status='ended', end_time=time.time())
+        self._recordings[recording_id] = recording
+        return recording
+
+    def cleanup_recordings(self):
+        pass
+
+def _connect_memory_database(mongo_config):
+    return _MemoryDatabase()
+
+class _MemoryDatabase(object):
+    '''Stands in for the database written to by the mongo sink.
+
+    Documents are encoded as pymongo would encode them, but then discarded.
+    '''
+
+    def __getitem__(self, collection_name):
+        return _MemoryCollection()
+
+    def collection_names(self):
+        return []
+
+    def create_collection(self, name, **kwargs):
+        pass
+
+class _MemoryCollection(object):
+
+    def insert(self, docs):
+        for doc in docs:
+            bson.BSON.encode(doc)
+
+    def update(self, spec, document, upsert=False):
+        bson.BSON.encode(document)
+
+    def find_one(self, spec):
+        return None
+
+    def ensure_index(self, keys, **kwargs):
+        pass
+
+def _print_results(results, out):
+    for result in results:
+        out.write(
+            'Devices: %d; Gateways: %d; '
+            'Polls/sec configured: %.1f, sent: %.1f, completed: %.1f, '
+            'skipped: %.1f; Responses persisted/sec: %.1f\n' % (
+                result.devices,
+                result.gateways,
+                result.configured_rate,
+                result.sent_rate,
+                result.completed_rate,
+                result.skipped_rate,
+                result.persisted_rate))
+        out.write('    Latency: %s\n' % ', '.join(
+                'p%d <= %s' % (p, _format_latency(latency)) \
+                    for p, latency in zip(_PERCENTILES,
+                                          result.latency_percentiles)))
+        out.write('    Queue depths (mean/max): %s\n' % ', '.join(
+                '%s %.1f/%d' % (name, mean, maximum) \
+                    for name, (mean, maximum) in \
+                        sorted(result.queue_depths.items())))
+        out.write('    CPU: %s\n' % ', '.join(
+                '%s %.0f%%' % (stage, result.cpu[stage]) \
+                    for stage in _STAGES))
+
+def _format_latency(latency):
+    if latency is None:
+        return '?'
+    return '%gms' % (latency * 1000)
+
+def _write_results(results, target_dir):
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+
+    time_string = time.strftime("%Y%m%dT%H%M%S", time.localtime())
+    filepath = os.path.join(target_dir, "pipeline-%s.csv" % time_string)
+    _log.info("Writing results to %s", filepath)
+
+    with open(filepath, 'wb') as f_out:
+        csv_out = csv.writer(f_out)
+        depth_names = sorted(set( name for result in results \
+                                    for name in result.queue_depths ))
+        csv_out.writerow(
+            ['devices', 'gateways', 'configured rate', 'sent rate',
+             'completed rate', 'skipped rate', 'persisted rate'] +
+            [ 'latency p%d' % p for p in _PERCENTILES ] +
+            [ '%s depth %s' % (name, stat) for name in depth_names \
+                                          for stat in ('mean', 'max') ] +
+            [ '%s cpu' % stage for stage in _STAGES ])
+        for result in results:
+            csv_out.writerow(
+                [result.devices, result.gateways, result.configured_rate,
+                 result.sent_rate, result.completed_rate,
+                 result.skipped_rate, result.persisted_rate] +
+                result.latency_percentiles +
+                [ depth for name in depth_names \
+                        for depth in result.queue_depths.get(name,
+                                                             (None, None)) ] +
+                [ result.cpu[stage] for stage in _STAGES ])
+
+def _validate_args(raw_args):
+    args = {}
+    args['device_counts'] = map(int, ' '.join(raw_args['--devices']).split())
+    args['units_per_gateway'] = int(raw_args['--units-per-gateway'])
+    args['tables'] = map(int, ' '.join(raw_args['--table']).split())
+    args['interval'] = float(raw_args['--interval'])
+    args['warmup'] = float(raw_args['--warmup'])
+    args['duration'] = float(raw_args['--duration'])
+    args['readers'] = int(raw_args['--readers'])
+    args['farm_defaults'] = {
+        'latency': raw_args['--latency'],
+        'serial': raw_args['--serial'],
+        'timeout_rate': 0,
+        'timeout': 1.0,
+        'exception_rate': 0,
+        'exception_code': 6,
+    }
+    # Fail early on a bad latency.
+    farm.behaviour(args['farm_defaults'])
+    args['base_port'] = int(raw_args['--base-port'])
+    args['mongo'] = None
+    if raw_args['--mongo']:
+        host, port = raw_args['--mongo'].rsplit(':', 1)
+        args['mongo'] = (host, int(port))
+    args['target_dir'] = raw_args['--target-dir']
+    args['verbose'] = raw_args['--verbose']
+    return args
+
+def main(target_dir, verbose, **kwargs):
+    out = sys.stdout
+    if not verbose:
+        # The readers and manager print every request they make.
+        out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+    results = _benchmark(**kwargs)
+    _print_results(results, out)
+    out.flush()
+    _write_results(results, target_dir)
+
+if __name__ == '__main__':
+    args = _validate_args(docopt.docopt(__doc__))
+    main(**args)
@@ -5,4 +5,5 @@ if __name__ == '__main__':
     from jem_data.api import app_factory
     import jem_data.services.system_control as system_control
     app = app_factory(system_control.SystemControlService())
-    app.run()
+    # Threaded, so that event streams don't hold up other requests.
+    app.run(threaded=True)
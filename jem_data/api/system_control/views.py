@@ -4,6 +4,7 @@ import time
 import flask
 
 import jem_data
+import jem_data.analysis.downsampling as downsampling
 import jem_data.core.domain as domain
 import jem_data.util as util
 import jem_data.core.exceptions as jem_exceptions
@@ -22,9 +23,39 @@ def index():
 
 @system_control.route('/recordings', methods=['GET'])
 def list_recordings():
-    recordings = flask.current_app.system_control_service.all_recordings()
-    recordings = map(util.deep_asdict, recordings)
-    return flask.jsonify(recordings=recordings)
+    '''Lists recordings, most recently started first.
+
+    Given a `limit`, returns at most that many recordings, along with the
+    `before` and `before_id` parameters which fetch the next page (or nulls
+    on the last page).  Given `summary=true`, omits each recording's gateways.
+    '''
+    try:
+        args = flask.request.args
+        limit = _int_arg(args, 'limit')
+        if limit is not None and limit <= 0:
+            raise ValidationException("Limit out of range: %d" % limit)
+        before = _float_arg(args, 'before')
+        before_id = args.get('before_id')
+        summary = args.get('summary', 'false').lower() == 'true'
+
+        recordings = flask.current_app.system_control_service.all_recordings(
+                limit=limit,
+                before_start_time=before,
+                before_id=before_id,
+                summary=summary)
+    except (ValueError, ValidationException), e:
+        flask.abort(400)
+
+    if limit is not None and len(recordings) == limit:
+        next_before = recordings[-1].start_time
+        next_before_id = recordings[-1].id
+    else:
+        next_before = None
+        next_before_id = None
+
+    return flask.jsonify(recordings=map(util.deep_asdict, recordings),
+                         before=next_before,
+                         before_id=next_before_id)
 
 @system_control.route('/recordings', methods=['POST'])
 def start_recording():
@@ -48,6 +79,93 @@ def recording_details(recording_id):
     else:
         flask.abort(404)
 
+@system_control.route('/recordings/<recording_id>/data', methods=['GET'])
+def recording_data(recording_id):
+    '''Streams the recorded responses as newline-delimited json.
+
+    Each line holds a response, along with the token to resume after it.  The
+    last line holds the token to resume from, and whether or not the end of
+    the (filtered) responses was reached.  At most `limit` responses are
+    returned at once.
+    '''
+    try:
+        args = flask.request.args
+        limit = _int_arg(args, 'limit', DEFAULT_DATA_LIMIT)
+        if not (0 < limit <= MAX_DATA_LIMIT):
+            raise ValidationException("Limit out of range: %d" % limit)
+
+        registers = map(int, args.getlist('register')) or None
+        responses = flask.current_app.system_control_service.recording_data(
+                recording_id,
+                resume_token=args.get('resume'),
+                start_time=_float_arg(args, 'start'),
+                end_time=_float_arg(args, 'end'),
+                host=args.get('host'),
+                port=_int_arg(args, 'port'),
+                unit=_int_arg(args, 'unit'),
+                table_id=_int_arg(args, 'table'),
+                registers=registers and set(registers))
+    except (ValueError, ValidationException), e:
+        flask.abort(400)
+
+    if responses is None:
+        flask.abort(404)
+
+    return flask.Response(
+            _stream_responses(responses, limit, args.get('resume')),
+            mimetype='application/x-ndjson')
+
+@system_control.route('/recordings/<recording_id>/series', methods=['GET'])
+def register_series(recording_id):
+    '''A recorded register's series, downsampled for plotting.
+
+    The `register` and the device's `host`, `port` and `unit` are required,
+    as units are only unique to their gateway.  Returns at most `points`
+    points (default 1000), chosen using `method` ('lttb' or 'min_max').
+    '''
+    try:
+        args = flask.request.args
+        register = _int_arg(args, 'register')
+        host = args.get('host')
+        port = _int_arg(args, 'port')
+        unit = _int_arg(args, 'unit')
+        if None in (register, host, port, unit):
+            raise ValidationException(
+                    "Expected register, host, port and unit")
+        method = args.get('method', 'lttb')
+        if method not in downsampling.METHODS:
+            raise ValidationException("Unknown method: %s" % method)
+        max_points = _int_arg(args, 'points', DEFAULT_SERIES_POINTS)
+        if not (3 <= max_points <= MAX_SERIES_POINTS):
+            raise ValidationException(
+                    "Points out of range: %d" % max_points)
+
+        result = flask.current_app.system_control_service.register_series(
+                recording_id,
+                register=register,
+                host=host,
+                port=port,
+                unit=unit,
+                max_points=max_points,
+                method=method,
+                start_time=_float_arg(args, 'start'),
+                end_time=_float_arg(args, 'end'),
+                table_id=_int_arg(args, 'table'))
+    except (ValueError, ValidationException), e:
+        flask.abort(400)
+
+    if result is None:
+        flask.abort(404)
+
+    points, recorded = result
+    return flask.jsonify(register=register,
+                         host=host,
+                         port=port,
+                         unit=unit,
+                         method=method,
+                         recorded_points=recorded,
+                         points=points)
+
 @system_control.route('/recordings/<recording_id>/stop', methods=['PUT'])
 def stop_recording(recording_id):
     updated_recording = flask.current_app.system_control_service.stop_recording(recording_id)
@@ -60,8 +178,15 @@ def stop_recording(recording_id):
 
 @system_control.route('/attached-devices', methods=['GET'])
 def attached_devices():
-    gateways = flask.current_app.system_control_service.attached_gateways()
-    return flask.jsonify(gateways=_marshall_gateways(gateways))
+    service = flask.current_app.system_control_service
+    etag = service.attached_gateways_etag()
+    if etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+    else:
+        gateways = service.attached_gateways()
+        response = flask.jsonify(gateways=_marshall_gateways(gateways))
+    response.set_etag(etag)
+    return response
 
 @system_control.route('/attached-devices', methods=['PUT'])
 def configure_attached_devices():
@@ -78,6 +203,34 @@ def configure_attached_devices():
     except ValidationException, e:
         flask.abort(400)
 
+@system_control.route('/realtime', methods=['GET'])
+def realtime_values():
+    '''The latest value of every register read (with when it was last
+    read), and the sequence number to stream changes from.
+    '''
+    seq, values = flask.current_app.system_control_service.latest_values()
+    return flask.jsonify(seq=seq, values=map(_marshall_latest_value, values))
+
+@system_control.route('/realtime/stream', methods=['GET'])
+def realtime_stream():
+    '''A server-sent event stream of the changes to the latest values.
+
+    The first event holds every value changed since the `Last-Event-ID`
+    header (or the `since` parameter); or, without either, every value.  Each
+    event's id is the sequence number to resume from.
+    '''
+    try:
+        since = flask.request.headers.get('Last-Event-ID',
+                                          flask.request.args.get('since'))
+        since = 0 if since is None else int(since)
+    except ValueError, e:
+        flask.abort(400)
+
+    service = flask.current_app.system_control_service
+    return flask.Response(_stream_changes(service, since),
+                          mimetype='text/event-stream',
+                          headers={'Cache-Control': 'no-cache'})
+
 @system_control.route('/status', methods=['GET'])
 def system_status():
     status = flask.current_app.system_control_service.status
@@ -87,6 +240,71 @@ def system_status():
 def setup_system():
     flask.current_app.system_control_service.setup()
 
+SSE_KEEPALIVE = 15.0     # seconds
+
+def _stream_changes(service, seq):
+    '''Generates the server-sent events of `realtime_stream`.'''
+    while True:
+        seq, changes = service.latest_value_changes(seq,
+                                                    timeout=SSE_KEEPALIVE)
+        if changes:
+            yield 'id: %d\ndata: %s\n\n' % (
+                    seq, json.dumps(map(_marshall_latest_value, changes)))
+        else:
+            # Lets proxies (and us) notice the connection's still there.
+            yield ': keepalive\n\n'
+
+def _marshall_latest_value(latest):
+    return {
+        'device': {
+            'gateway': {'host': latest.key.host, 'port': latest.key.port},
+            'unit': latest.key.unit,
+        },
+        'table_id': latest.key.table_id,
+        'register': latest.key.register,
+        'value': latest.value,
+        'timestamp': latest.timestamp,
+    }
+
+DEFAULT_SERIES_POINTS = 1000
+MAX_SERIES_POINTS = 10000
+
+DEFAULT_DATA_LIMIT = 10000
+MAX_DATA_LIMIT = 100000
+
+def _stream_responses(responses, limit, resume_token):
+    '''Generates the lines of a `recording_data` response.'''
+    complete = True
+    for i, (resume_token, msg) in enumerate(responses):
+        yield json.dumps({'resume_token': resume_token,
+                          'response': _marshall_response(msg)}) + '\n'
+        if i + 1 == limit:
+            complete = False
+            break
+
+    yield json.dumps({'resume_token': resume_token,
+                      'complete': complete}) + '\n'
+
+def _marshall_response(msg):
+    device_addr = msg.table_addr.device_addr
+    return {
+        'device': {
+            'gateway': util.deep_asdict(device_addr.gateway_addr),
+            'unit': device_addr.unit,
+        },
+        'table_id': msg.table_addr.id,
+        'timing_info': util.deep_asdict(msg.timing_info),
+        'values': msg.values,
+    }
+
+def _int_arg(args, name, default=None):
+    value = args.get(name)
+    return default if value is None else int(value)
+
+def _float_arg(args, name, default=None):
+    value = args.get(name)
+    return default if value is None else float(value)
+
 def _marshall_gateways(gateways):
     return map(util.deep_asdict, gateways)
 
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+A compact alternative to storing one archive document per response.
+
+Rather than a document per response, each repeating the device, timing and
+request info, responses are grouped into time buckets (by default one per
+minute).  A bucket holds the responses of a single request made to a single
+table of a single device, and so always the same registers.  The device and
+register addresses are stored once, and the timings and values are stored as
+columns: one array of start times, one of end times, and one array of values
+per register, all of the same length.
+
+    {
+        '_id': '127.0.0.1:502/2/3/50512-50590/1370000040',
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'start': 1370000040,
+        'end': 1370000100,
+        'addresses': [50512, ..., 50590],
+        'count': 120,
+        'start_times': [1370000040.01, ...],
+        'end_times': [1370000040.02, ...],
+        'columns': {'50512': [5001, ...], ..., '50590': [22, ...]}
+    }
+
+Use `jem_data.dal.ArchiveRepository` to read the responses back.
+"""
+
+import collections
+
+import pymongo
+
+DEFAULT_COLLECTION_NAME = 'archive-buckets-{recording_id}'
+DEFAULT_BUCKET_SECONDS = 60
+
+INDEXES = [
+    [('device.unit', pymongo.ASCENDING),
+     ('device.gateway.host', pymongo.ASCENDING),
+     ('device.gateway.port', pymongo.ASCENDING),
+     ('table_id', pymongo.ASCENDING),
+     ('start', pymongo.ASCENDING)],
+    [('start', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)],
+]
+
+def insert(msgs, mongo_collection, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    '''Append the given `ResponseMsg`s to their buckets, with one upsert per
+    bucket.
+
+    Responses without any values (ie - failed reads) aren't stored.
+    '''
+    buckets = collections.OrderedDict()
+    for msg in msgs:
+        if not msg.values:
+            continue
+        start = msg.timing_info.end - (msg.timing_info.end % bucket_seconds)
+        addresses = tuple( addr for addr, _ in msg.values )
+        key = (msg.table_addr, addresses, start)
+        buckets.setdefault(key, []).append(msg)
+
+    if buckets:
+        # pymongo remembers which indexes it's ensured, so this is cheap.
+        for keys in INDEXES:
+            mongo_collection.ensure_index(keys, background=True)
+
+    for (table_addr, addresses, start), group in buckets.items():
+        device_addr = table_addr.device_addr
+        bucket_id = '%s:%d/%d/%d/%d-%d/%d' % (device_addr.gateway_addr.host,
+                                             device_addr.gateway_addr.port,
+                                             device_addr.unit,
+                                             table_addr.id,
+                                             addresses[0],
+                                             addresses[-1],
+                                             start)
+
+        columns = zip(*( [ value for _, value in msg.values ] \
+                              for msg in group ))
+        pushes = {
+            'start_times': {'$each': [ m.timing_info.start for m in group ]},
+            'end_times': {'$each': [ m.timing_info.end for m in group ]},
+        }
+        for addr, column in zip(addresses, columns):
+            pushes['columns.%d' % addr] = {'$each': list(column)}
+
+        mongo_collection.update(
+            {'_id': bucket_id},
+            {
+                '$set': {
+                    'device': {
+                        'gateway': {
+                            'host': device_addr.gateway_addr.host,
+                            'port': device_addr.gateway_addr.port,
+                        },
+                        'unit': device_addr.unit,
+                    },
+                    'table_id': table_addr.id,
+                    'start': start,
+                    'end': start + bucket_seconds,
+                    'addresses': list(addresses),
+                },
+                '$inc': {'count': len(group)},
+                '$push': pushes,
+            },
+            upsert=True)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Connections to a gateway, shared out amongst its reader processes.
+
+Gateways only accept a handful of simultaneous connections (our simulated
+gateway accepts 4), and refuse any more.  A `ConnectionPool` keeps the number
+of connections opened by all the processes sharing it within that limit.  It
+also keeps connections open between requests, checks them before handing them
+out again, and backs off exponentially when the gateway can't be reached.
+"""
+
+import contextlib
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import socket
+import time
+
+from pymodbus.client.sync import ModbusTcpClient
+import pymodbus.exceptions
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_MIN_BACKOFF = 0.5       # seconds
+DEFAULT_MAX_BACKOFF = 30.0      # seconds
+
+# How often to look for a free connection slot whilst the limit's reached.
+_SLOT_POLL_INTERVAL = 0.05      # seconds
+
+class ConnectionPool(object):
+    '''A pool of blocking modbus client connections to a single gateway.
+
+    The limit on the number of connections is kept in a table of slots
+    shared between processes, so a pool created before starting the reader
+    processes limits their connections in total.  Each slot records the pid
+    of the process holding it, so that the slots of a process which dies
+    without giving them back are reclaimed.  The idle connections themselves
+    are local to each process.
+
+    The table of slots is freed along with the pool, so the process creating
+    the pool must keep it for as long as the processes sharing it run.
+
+    Use `connection()` to borrow a connection for the duration of a `with`
+    block.
+    '''
+
+    def __init__(self, host, port,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 min_backoff=DEFAULT_MIN_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF,
+                 client_factory=ModbusTcpClient):
+        if max_connections < 1:
+            raise ValueError("Invalid connection limit: %d" % max_connections)
+
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._client_factory = client_factory
+        # The pid of the process holding each slot, or 0 if it's free.
+        self._slots = multiprocessing.Array('i', max_connections)
+        self._idle = []
+        self._backoff = 0
+        self._retry_at = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Borrow a connection, opening a new one if there's no healthy idle
+        connection to hand.
+
+        Raises a `ConnectionException` if the gateway can't be connected to,
+        or if its connection limit stays reached.  A connection raising a
+        `ConnectionException` (or `socket.error`) whilst borrowed is closed
+        rather than being returned to the pool.
+        '''
+        client = self._borrow()
+        healthy = True
+        try:
+            yield client
+        except (pymodbus.exceptions.ConnectionException, socket.error):
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self._idle.append(client)
+            else:
+                self._discard(client)
+
+    def reserve_connection(self):
+        '''Reserve one of the gateway's connections for the caller's own
+        client, for the rest of the process' life.
+
+        This is for asynchronous clients, which manage their own connection.
+        '''
+        self._acquire_slot()
+
+    def close(self):
+        '''Close this process' idle connections.'''
+        while self._idle:
+            self._discard(self._idle.pop())
+
+    def _borrow(self):
+        while self._idle:
+            client = self._idle.pop()
+            if _is_healthy(client):
+                return client
+            _log.info("Discarding broken connection to %s:%d",
+                      self.host, self.port)
+            self._discard(client)
+
+        return self._connect()
+
+    def _connect(self):
+        delay = self._retry_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        if not self._acquire_slot(timeout=self._max_backoff):
+            raise pymodbus.exceptions.ConnectionException(
+                    'Connection limit (%d) reached for %s:%d' % (
+                        self.max_connections, self.host, self.port))
+
+        client = self._client_factory(self.host, port=self.port)
+        if not client.connect():
+            client.close()
+            self._release_slot()
+            self._backoff = min(max(2 * self._backoff, self._min_backoff),
+                                self._max_backoff)
+            self._retry_at = time.time() + self._backoff
+            _log.warn("Unable to connect to %s:%d, retrying in %.1fs",
+                      self.host, self.port, self._backoff)
+            raise pymodbus.exceptions.ConnectionException(
+                    'Unable to connect to %s:%d' % (self.host, self.port))
+
+        self._backoff = 0
+        self._retry_at = 0
+        return client
+
+    def _discard(self, client):
+        try:
+            client.close()
+        finally:
+            self._release_slot()
+
+    def _acquire_slot(self, timeout=None):
+        '''Take a free connection slot, waiting up to `timeout` seconds (or
+        forever) for one.  Returns whether a slot was taken.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        pid = os.getpid()
+        while True:
+            with self._slots.get_lock():
+                for i, holder in enumerate(self._slots):
+                    if holder and _is_alive(holder):
+                        continue
+                    if holder:
+                        _log.warn("Reclaiming connection to %s:%d held by "
+                                  "dead process %d",
+                                  self.host, self.port, holder)
+                    self._slots[i] = pid
+                    return True
+
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(_SLOT_POLL_INTERVAL)
+
+    def _release_slot(self):
+        pid = os.getpid()
+        with self._slots.get_lock():
+            for i, holder in enumerate(self._slots):
+                if holder == pid:
+                    self._slots[i] = 0
+                    return
+
+def _is_alive(pid):
+    '''Is the process still running?  A zombie (a dead child process which
+    hasn't been waited for yet) isn't.
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The state follows the command, which is in parentheses.
+            return f.read().rpartition(')')[2].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return True
+
+def _is_healthy(client):
+    '''An idle connection is healthy if its socket is still open and has
+    nothing to read.  There's nothing to read on an idle modbus connection,
+    unless the gateway has closed it (or sent an unexpected response).
+    '''
+    sock = getattr(client, 'socket', None)
+    if sock is None:
+        return False
+
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
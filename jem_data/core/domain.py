@@ -41,9 +41,18 @@ Register = collections.namedtuple(
         'Register',
         'address label range unit_of_measurement')
 
-Table = collections.namedtuple(
-        'Table',
-        'id label registers')
+class Table(collections.namedtuple('Table', 'id label registers polling')):
+    '''`polling` is an optional `Polling`, overriding the default rate at
+    which the table is read during a recording.
+    '''
+    __slots__ = ()
+
+    def __new__(cls, id, label, registers, polling=None):
+        return super(Table, cls).__new__(cls, id, label, registers, polling)
+
+Polling = collections.namedtuple(
+        'Polling',
+        'interval adaptive')
 
 Device = collections.namedtuple(
         'Device',
@@ -57,11 +66,17 @@ Recording = collections.namedtuple(
         'Recording',
         'id status gateways start_time end_time')
 
+# A Recording, without the configuration of what was recorded.
+RecordingSummary = collections.namedtuple(
+        'RecordingSummary',
+        'id status start_time end_time')
+
 #-----------------------------------------------------------------------------
 # These domain models represent the configuration required to start a new
 # Recording.
 #
-# Essentially, the user selects the tables she wishes to record.
+# Essentially, the user selects the tables she wishes to record, and
+# optionally how often each table should be read.
 #-----------------------------------------------------------------------------
 
 RecordingConfig = collections.namedtuple(
@@ -74,7 +89,20 @@ GatewayRecordingConfig = collections.namedtuple(
 
 DeviceRecordingConfig = collections.namedtuple(
         'DeviceRecordingConfig',
-        'unit table_ids')
+        'unit table_ids polling')
+
+#-----------------------------------------------------------------------------
+# Rollups summarise a recording's archived values over fixed intervals (eg -
+# per-minute, or per-hour), for each table of each device.
+#-----------------------------------------------------------------------------
+
+RollupBucket = collections.namedtuple(
+        'RollupBucket',
+        'table_addr resolution start end registers')
+
+RegisterStats = collections.namedtuple(
+        'RegisterStats',
+        'min max mean count last')
 
 class TimingInfo(collections.namedtuple('TimingInfo', 'start end')):
     __slots__ = ()
@@ -11,6 +11,9 @@ class ModbusEmptyResponse(JemException):
     def __init__(self):
         super(ModbusEmptyResponse, self).__init__("No response from server")
 
+class ModbusInvalidResponse(JemException):
+    pass
+
 class ValidationException(JemException):
     pass
 
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+The latest value read from every register, held in memory.
+
+The mongo writer coalesces each batch of responses it writes into the latest
+value of each register, and sends those on to a `LatestValues` store in the
+api's process.  So live views of the current values are served from memory,
+rather than by polling mongo.
+"""
+
+import collections
+import logging
+import threading
+
+_log = logging.getLogger(__name__)
+
+# Identifies a single register of a single device.
+ValueKey = collections.namedtuple(
+        'ValueKey',
+        'host port unit table_id register')
+
+# `timestamp` is when the register was last read, whether or not its value
+# changed; and `seq` the sequence number of its last change of value.
+LatestValue = collections.namedtuple(
+        'LatestValue',
+        'key value timestamp seq')
+
+class LatestValues(object):
+    '''The latest value of each register.
+
+    Every change of value is given an increasing sequence number, so that
+    clients can ask for just the values that have changed since they last
+    looked.  Thread-safe.
+    '''
+
+    def __init__(self):
+        self._values = {}
+        self._seq = 0
+        self._changed = threading.Condition()
+
+    def update(self, updates):
+        '''Records the given (`ValueKey`, value, timestamp) updates.
+
+        Updates which don't change the register's value only refresh when it
+        was last read: they aren't sequenced, so aren't waited for by
+        `changes_since`.
+        '''
+        with self._changed:
+            seq = self._seq
+            for key, value, timestamp in updates:
+                latest = self._values.get(key)
+                if latest is not None and latest.value == value:
+                    if timestamp > latest.timestamp:
+                        self._values[key] = latest._replace(
+                                timestamp=timestamp)
+                    continue
+                seq += 1
+                self._values[key] = LatestValue(key, value, timestamp, seq)
+
+            if seq != self._seq:
+                self._seq = seq
+                self._changed.notify_all()
+
+    def snapshot(self):
+        '''Returns the current sequence number, and list of `LatestValue`s.'''
+        with self._changed:
+            return self._seq, self._values.values()
+
+    def changes_since(self, seq, timeout=None):
+        '''Waits up to `timeout` seconds for any values to change after the
+        given sequence number.
+
+        Returns the current sequence number, and the list of `LatestValue`s
+        changed since `seq` (which is empty on timing out).
+
+        A `seq` ahead of the current sequence number must be from before a
+        restart (which starts the numbering again), so is treated as 0: all
+        the values are returned.
+        '''
+        with self._changed:
+            if seq > self._seq:
+                seq = 0
+            if self._seq <= seq:
+                self._changed.wait(timeout)
+            return self._seq, [ latest for latest in self._values.values() \
+                                    if latest.seq > seq ]
+
+def coalesce(msgs):
+    '''The latest (`ValueKey`, value, timestamp) of each register read by the
+    given `ResponseMsg`s.
+    '''
+    latest = {}
+    for msg in msgs:
+        if not msg.values:
+            continue
+        device_addr = msg.table_addr.device_addr
+        timestamp = msg.timing_info.end
+        for register, value in msg.values:
+            key = ValueKey(device_addr.gateway_addr.host,
+                           device_addr.gateway_addr.port,
+                           device_addr.unit,
+                           msg.table_addr.id,
+                           register)
+            previous = latest.get(key)
+            if previous is None or previous[1] <= timestamp:
+                latest[key] = (value, timestamp)
+    return [ (key, value, timestamp) \
+                for key, (value, timestamp) in latest.items() ]
+
+def start_consumer(q, latest_values):
+    '''Starts a daemon thread feeding the lists of updates put on `q` into
+    the `LatestValues` store.
+    '''
+    def consume():
+        while True:
+            try:
+                latest_values.update(q.get())
+            except Exception, e:
+                _log.error(e)
+
+    t = threading.Thread(target=consume)
+    t.daemon = True
+    t.start()
+    return t
@@ -6,10 +6,17 @@ Definitions of messages passed around the system.
 
 import collections
 
+# `sent_at` is when the request was sent, which identifies it amongst the
+# requests for the same table.  It's handed back in the `TableReadMsg`
+# reporting the table read.
 ReadTableMsg = collections.namedtuple(
         'ReadTableMsg',
-        'table_addr recording_id')
+        'table_addr recording_id sent_at')
 
 ResponseMsg = collections.namedtuple(
         'ResponseMsg',
         'table_addr values timing_info error request_info')
+
+TableReadMsg = collections.namedtuple(
+        'TableReadMsg',
+        'table_addr values_digest error sent_at')
@@ -53,24 +53,45 @@ def read_registers(client, unit, registers):
     if register_range > _VALID_REGISTER_RANGE:
         raise InvalidModbusRangeException(register_range)
 
+    return _read_range(client, unit, min_register, register_range,
+                       lambda data: RegisterResponse(data,
+                                                     registers,
+                                                     min_addr=min_register))
+
+def read_planned(client, unit, planned_request):
+    '''Make the request described by a `read_plan.PlannedRequest`.
+
+    :return: a tuple of (address, value) pairs; or a `Deferred` firing with
+             one if the client is asynchronous.
+    '''
+    return _read_range(client, unit,
+                       planned_request.start,
+                       planned_request.count,
+                       planned_request.decode)
+
+def _read_range(client, unit, start, count, decode):
+    '''Request `count` registers from `start`, and pass a successful response
+    through `decode`.
+    '''
+
     # NOTE - the modbus PDU expects that requests for registers addressed as
     #        1 - 16 to be requested as 0 - 15.  This means that the first
-    #        address below *should* be `min_register - 1`.  However, the
+    #        address below *should* be `start - 1`.  However, the
     #        Dirus A40 still expects the addresses 1 - 15.  This means that
     #        the following request is incorrect for any device that is not
     #        a Dirus A40.
     _log.debug('read_holding_registers: %x -> %x from %s [unit: %x]',
-               min_register,
-               min_register - 1 + register_range,
+               start,
+               start - 1 + count,
                str(client),
                unit)
-    response = client.read_holding_registers(min_register,
-                                             register_range,
-                                             unit=unit)
+    response = client.read_holding_registers(start, count, unit=unit)
 
     if isinstance(response, defer.Deferred):
         def callback(data):
-            return RegisterResponse(data, registers)
+            if isinstance(data, pdu.ExceptionResponse):
+                raise jem_exceptions.wrap_exception_response(data)
+            return decode(data)
         response.addCallback(callback)
 
     elif isinstance(response, pdu.ExceptionResponse):
@@ -80,43 +101,65 @@ def read_registers(client, unit, registers):
         raise jem_exceptions.ModbusEmptyResponse()
 
     else:
-        response = RegisterResponse(response, registers)
-    
+        response = decode(response)
+
     return response
 
-def split_registers(registers):
+def split_registers(registers, gap_tolerance=None):
     """
     Splits the given registers into multiple register dicts which all have
     a valid modbus register range (of <= 125).
+
+    The registers are packed greedily in address order, which gives the
+    smallest number of requests.
+
+    :param gap_tolerance: the largest number of unused registers allowed
+                          between two consecutive requested registers of the
+                          same request.  Reading a few unused registers is
+                          usually cheaper than making another round trip.
+                          `None` (the default) places no limit on the gap
+                          other than the modbus range limit itself.
     """
 
     for width in registers.values():
         if width > _VALID_REGISTER_RANGE:
             raise ValueError("Invalid register width: %d" % width)
 
-    working_copy = registers.copy()
     valid_registers = []
+    current_range = None
 
-    current_range_start = min(working_copy.keys())
-    current_range_end   = current_range_start + _VALID_REGISTER_RANGE
-
-    while working_copy:
-        current_range = dict(
-            (addr, width) for addr, width in working_copy.items() \
-                if current_range_start <= addr and \
-                   addr + width <= current_range_end
-        )
+    for addr in sorted(registers):
+        width = registers[addr]
 
-        valid_registers.append(current_range)
-        for addr in current_range:
-            working_copy.pop(addr)
+        if current_range is None or \
+                addr + width > current_range_start + _VALID_REGISTER_RANGE or \
+                (gap_tolerance is not None and
+                 addr - current_range_end > gap_tolerance):
+            current_range = {}
+            current_range_start = addr
+            valid_registers.append(current_range)
 
-        if working_copy:
-            current_range_start = min(working_copy.keys())
-            current_range_end   = current_range_start + _VALID_REGISTER_RANGE
+        current_range[addr] = width
+        current_range_end = addr + width
 
     return valid_registers
 
+def plan_requests(register_tables, gap_tolerance=None):
+    """
+    Plans the requests needed to read all the given register tables.
+
+    The union of the tables' registers is split into as few valid requests as
+    possible, so tables lying close together may share a request.
+
+    :param register_tables: an iterable of dicts of register address to
+                            register width.
+    :param gap_tolerance: see `split_registers`
+    """
+    registers = {}
+    for table in register_tables:
+        registers.update(table)
+    return split_registers(registers, gap_tolerance=gap_tolerance)
+
 
 class RegisterResponse(object):
     '''Wraps a pymodbus response object to provide access to the registers
@@ -131,10 +174,12 @@ class RegisterResponse(object):
     and the value as a whole is assumed to be stored in 2's complement.
     '''
 
-    def __init__(self, pymodbus_response, requested_registers):
+    def __init__(self, pymodbus_response, requested_registers, min_addr=None):
         self._requested_registers = requested_registers
         self._response = pymodbus_response
-        self._min_addr = min(self._requested_registers.keys())
+        if min_addr is None:
+            min_addr = min(self._requested_registers.keys())
+        self._min_addr = min_addr
 
     def read_register(self, addr):
         if addr not in self._requested_registers:
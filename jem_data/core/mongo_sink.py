@@ -2,11 +2,18 @@
 Where all the data ends up -- in mongodb.
 '''
 
+import bisect
 import collections
 import logging
+import multiprocessing
+import Queue
+import time
 
 import pymongo
 
+import jem_data.core.bucketed_archive as bucketed_archive
+import jem_data.core.latest_values as latest_values
+import jem_data.core.rollup as rollup
 import jem_data.util as util
 
 MongoConfig = collections.namedtuple('MongoConfig',
@@ -15,25 +22,278 @@ MongoConfig = collections.namedtuple('MongoConfig',
 logging.basicConfig()
 _log=logging.getLogger(__name__)
 
-def mongo_writer(q, collection_names, mongo_config):
-    '''Endlessly reads data from a Queue, and writes it to mongo.'''
+DEFAULT_REPLAY_RATE = 1000      # messages per second
+DEFAULT_RETRY_INTERVAL = 5.0    # seconds
 
+def connect(mongo_config):
+    '''Returns the configured mongo database.'''
     connection = pymongo.MongoClient(mongo_config.host, mongo_config.port)
-    db = connection[mongo_config.database]
+    return connection[mongo_config.database]
+
+def mongo_writer(q, collection_names, mongo_config,
+                 batch_size=100, max_wait=0.1, rollups=None,
+                 bucketed_collection_names=(), latest_q=None,
+                 spool=None, replay_rate=DEFAULT_REPLAY_RATE,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, sink_stats=None,
+                 connect=connect):
+    '''Endlessly reads data from a Queue, and writes it to mongo.
+
+    Messages are written in batches: once a message arrives, the writer
+    waits up to `max_wait` seconds for up to `batch_size` messages in total,
+    and then writes them with a single insert per collection.
+
+    Collections named in `bucketed_collection_names` store the messages
+    grouped into time buckets instead (see `bucketed_archive`).
+
+    If given a `rollup.Rollup`, each batch is also folded into its rollup
+    buckets, which are periodically written out.
+
+    If given a `latest_q`, the latest value of each register read in each
+    batch is put on it (see `latest_values.coalesce`), ahead of writing the
+    batch to mongo.
+
+    If given a `spool.Spool`, batches which can't be written because mongo
+    is unreachable are spooled, as is every batch after them until mongo is
+    reached again (which is retried every `retry_interval` seconds).  The
+    spooled messages are then replayed into mongo alongside the live ones, at
+    up to `replay_rate` messages a second.  Without a spool, those batches
+    are dropped.
+
+    If given `SinkStats`, the messages written, spooled and dropped are
+    counted in them.
+
+    The database is connected to with `connect(mongo_config)`, by default a
+    pymongo connection.  (Benchmarks may substitute a stand-in.)
+    '''
+
+    db = None
+    stats = _FlushStats()
+    if sink_stats is None:
+        sink_stats = _NO_SINK_STATS
+
+    # Without a rollup to flush, there's no need to wake up when idle.
+    idle_timeout = None if rollups is None else rollup.DEFAULT_FLUSH_INTERVAL
+
+    # Whilst mongo's unreachable, when to next try it.
+    retry_at = None
+
+    replay_interval = float(batch_size) / replay_rate
+    next_replay = time.time()
 
     while True:
+        msgs = []
         try:
-            msg = q.get()
-            for collection_name_fmt in collection_names:
-                collection_name = collection_name_fmt.format(
-                        recording_id=msg.request_info['recording_id'])
-                _insert_into_collection([msg], db[collection_name])
-        except pymongo.errors.AutoReconnect, e:
-            _log.error("Connection to mongo lost.  Auto-reconnect will be attempted")
+            timeout = idle_timeout
+            if spool is not None and (spool.pending or retry_at is not None):
+                timeout = min(timeout or replay_interval, replay_interval)
+
+            msgs = _drain(q, batch_size, max_wait, timeout=timeout)
+            if msgs and latest_q is not None:
+                latest_q.put(latest_values.coalesce(msgs))
+            if rollups is not None:
+                rollups.add(msgs)
+
+            if retry_at is not None and time.time() < retry_at:
+                spool.append(msgs)
+                spool.sync()
+                sink_stats.increment('spooled', len(msgs))
+                continue
+
+            if db is None:
+                db = connect(mongo_config)
+            if msgs:
+                start = time.time()
+                _write_batch(msgs, collection_names, db,
+                             bucketed_collection_names)
+                end = time.time()
+                stats.record(len(msgs), end - start)
+                sink_stats.written(msgs, end)
+            elif retry_at is not None:
+                # Nothing was written to show that mongo's back, so check.
+                db.command('ping')
+            msgs = []
+
+            if retry_at is not None:
+                _log.info("Reconnected to mongo")
+                retry_at = None
+            if rollups is not None:
+                rollups.flush(db)
+            if spool is not None and spool.pending and \
+                    time.time() >= next_replay:
+                def write(replay_msgs):
+                    _write_batch(replay_msgs, collection_names, db,
+                                 bucketed_collection_names)
+                    sink_stats.written(replay_msgs, time.time())
+                replayed = spool.replay(write, batch_size)
+                next_replay = time.time() + replayed / float(replay_rate)
         except pymongo.errors.ConnectionFailure, e:
-            _log.error("Connection failure")
+            # (Which includes `AutoReconnect`.)
+            if spool is None:
+                _log.error("Connection to mongo lost, dropping %d messages: "
+                           "%s", len(msgs), e)
+                sink_stats.increment('dropped', len(msgs))
+                continue
+            if retry_at is None:
+                _log.error("Connection to mongo lost, spooling messages "
+                           "until it's back: %s", e)
+            retry_at = time.time() + retry_interval
+            try:
+                spool.append(msgs)
+                sink_stats.increment('spooled', len(msgs))
+            except Exception, e:
+                _log.error("Failed to spool %d messages: %s", len(msgs), e)
+                sink_stats.increment('dropped', len(msgs))
         except Exception, e:
-            _log.error(e)
+            _log.error("Failed to write %d messages: %s", len(msgs), e)
+            sink_stats.increment('dropped', len(msgs))
+
+def _drain(q, batch_size, max_wait, timeout=None):
+    '''Block until a message arrives, and then collect any more that arrive
+    within `max_wait` seconds, up to `batch_size` messages in total.
+
+    Returns an empty list if no message arrives within `timeout` seconds.
+    '''
+    try:
+        msgs = [q.get(timeout=timeout)]
+    except Queue.Empty:
+        return []
+    deadline = time.time() + max_wait
+    while len(msgs) < batch_size:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            msgs.append(q.get(timeout=remaining))
+        except Queue.Empty:
+            break
+    return msgs
+
+def _write_batch(msgs, collection_names, db, bucketed_collection_names=()):
+    '''Write the messages with one insert per target collection (or one
+    upsert per bucket, for bucketed collections).
+    '''
+    for collection_name, group in _group_by_collection(
+                                        msgs, collection_names).items():
+        _insert_into_collection(group, db[collection_name])
+
+    for collection_name, group in _group_by_collection(
+                                msgs, bucketed_collection_names).items():
+        bucketed_archive.insert(group, db[collection_name])
+
+def _group_by_collection(msgs, collection_names):
+    '''Returns a mapping of collection name to the messages destined for
+    that collection.
+    '''
+    groups = collections.OrderedDict()
+    for msg in msgs:
+        for collection_name_fmt in collection_names:
+            collection_name = collection_name_fmt.format(
+                    recording_id=msg.request_info['recording_id'])
+            groups.setdefault(collection_name, []).append(msg)
+    return groups
+
+class _FlushStats(object):
+    '''Keeps track of batch sizes and flush latencies, and periodically logs
+    a summary of them.
+    '''
+
+    def __init__(self, report_interval=60.0):
+        self._report_interval = report_interval
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self._since = now
+        self._flushes = 0
+        self._msgs = 0
+        self._max_batch = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    def record(self, batch_size, latency):
+        _log.debug("Flushed %d messages in %.1fms", batch_size, latency * 1000)
+
+        self._flushes += 1
+        self._msgs += batch_size
+        self._max_batch = max(self._max_batch, batch_size)
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+        now = time.time()
+        if now - self._since >= self._report_interval:
+            _log.info("%d flushes in %.0fs: "
+                      "avg batch %.1f, max batch %d, "
+                      "avg latency %.1fms, max latency %.1fms",
+                      self._flushes,
+                      now - self._since,
+                      float(self._msgs) / self._flushes,
+                      self._max_batch,
+                      1000 * self._total_latency / self._flushes,
+                      1000 * self._max_latency)
+            self._reset(now)
+
+class SinkStats(object):
+    '''Counters of the messages handled by the mongo writer.
+
+    The counters live in shared memory, so they can be updated by the
+    writer's process and read from any other.
+
+    * `written`: messages written to mongo (including those replayed from the
+      spool).
+    * `spooled`: messages spooled whilst mongo was unreachable.
+    * `dropped`: messages which couldn't be written or spooled.
+
+    Along with a histogram of the latency of the messages written: the time
+    from the start of each message's read until it was written.  Bucket `i`
+    counts the latencies up to `LATENCY_BOUNDS[i]` seconds, with a final
+    bucket for any longer.
+    '''
+
+    COUNTERS = ('written', 'spooled', 'dropped')
+
+    LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                      1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._values = multiprocessing.Array(
+                'l', len(self.COUNTERS) + len(self.LATENCY_BOUNDS) + 1)
+
+    def increment(self, counter, n=1):
+        with self._values.get_lock():
+            self._values[self.COUNTERS.index(counter)] += n
+
+    def written(self, msgs, now):
+        histogram = [0] * (len(self.LATENCY_BOUNDS) + 1)
+        for msg in msgs:
+            histogram[bisect.bisect_left(
+                    self.LATENCY_BOUNDS, now - msg.timing_info.start)] += 1
+
+        offset = len(self.COUNTERS)
+        with self._values.get_lock():
+            self._values[self.COUNTERS.index('written')] += len(msgs)
+            for i, n in enumerate(histogram):
+                if n:
+                    self._values[offset + i] += n
+
+    def snapshot(self):
+        '''Returns a dict of the counter values, and the latency histogram
+        (as a list of counts).
+        '''
+        with self._values.get_lock():
+            values = self._values[:]
+        n = len(self.COUNTERS)
+        d = dict(zip(self.COUNTERS, values[:n]))
+        d['latency'] = values[n:]
+        return d
+
+class _NoSinkStats(object):
+
+    def increment(self, counter, n=1):
+        pass
+
+    def written(self, msgs, now):
+        pass
+
+_NO_SINK_STATS = _NoSinkStats()
 
 def _insert_into_collection(msgs, mongo_collection):
     '''Write a bunch of messages to the given collection.
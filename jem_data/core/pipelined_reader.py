@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+An event-loop based alternative to the blocking readers in `table_reader`.
+
+Rather than waiting for each response before sending the next request, a
+pipelined reader keeps up to `pipeline_depth` modbus transactions in flight on
+a single connection to the gateway.  Responses are matched back up with their
+requests using the modbus/TCP transaction id, which pymodbus' twisted client
+protocol takes care of for us.
+
+The reader consumes the same `ReadTableMsg`s, and produces the same
+`ResponseMsg`s as the blocking reader, so the two are interchangeable.
+"""
+
+import logging
+import time
+
+from twisted.internet import defer, protocol, threads
+from pymodbus.client.async import ModbusClientProtocol
+import pymodbus.exceptions
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.modbus as modbus
+import jem_data.core.table_reader as table_reader
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_PIPELINE_DEPTH = 4
+DEFAULT_REQUEST_TIMEOUT = 5.0   # seconds
+
+def run(in_q, out_q, pool,
+        pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        feedback_q=None, gap_tolerance=None):
+    """
+    Connects to the gateway of the given `ConnectionPool` and endlessly reads
+    tables requested on `in_q`, writing the results out to `out_q`.
+
+    The process keeps one of the pool's connections reserved for its own
+    (reconnecting) connection.
+
+    This runs the twisted reactor, and so never returns.  It's intended to be
+    the target of a `multiprocessing.Process`.
+    """
+    from twisted.internet import reactor
+
+    pool.reserve_connection()
+
+    reader = PipelinedReader(in_q, out_q,
+                             pipeline_depth=pipeline_depth,
+                             request_timeout=request_timeout,
+                             clock=reactor,
+                             feedback_q=feedback_q,
+                             gap_tolerance=gap_tolerance)
+    reactor.connectTCP(pool.host, pool.port, _ReaderFactory(reader))
+    reactor.run()
+
+class PipelinedReader(object):
+    '''Reads tables over a single modbus client connection, keeping up to
+    `pipeline_depth` requests outstanding at any one time.
+
+    The connection is handed to the reader through `connected()` and taken
+    away again through `disconnected()`.  No new tables are taken off the
+    input queue whilst disconnected.
+    '''
+
+    def __init__(self, in_q, out_q, pipeline_depth, request_timeout, clock,
+                 feedback_q=None, gap_tolerance=None):
+        if pipeline_depth < 1:
+            raise ValueError("Invalid pipeline depth: %d" % pipeline_depth)
+
+        self._in_q = in_q
+        self._out_q = out_q
+        self._feedback_q = feedback_q
+        self._gap_tolerance = gap_tolerance
+        self._slots = defer.DeferredSemaphore(pipeline_depth)
+        self._request_timeout = request_timeout
+        self._clock = clock
+        self._client = None
+        self._reading = False
+
+    def connected(self, client):
+        self._client = client
+        if not self._reading:
+            self._reading = True
+            self._next_table()
+
+    def disconnected(self, client):
+        if self._client is client:
+            self._client = None
+
+    def _next_table(self):
+        '''Wait for a free slot, and then for the next table to read.'''
+        if self._client is None:
+            self._reading = False
+            return
+
+        d = self._slots.acquire()
+        d.addCallback(lambda _: self._fetch_msg())
+        d.addCallback(self._read_table)
+        d.addErrback(self._table_failed)
+
+    def _table_failed(self, failure):
+        '''Give back the slot held by a table that couldn't be read.'''
+        _log.error("ERROR: %s", failure.getErrorMessage())
+        self._slots.release()
+        self._next_table()
+
+    def _fetch_msg(self):
+        return threads.deferToThread(self._in_q.get)
+
+    def _read_table(self, msg):
+        '''Issue all the requests required to read the given table.
+
+        This is called whilst holding a slot, which is handed over to the
+        table's first request.  The remaining requests queue up for slots
+        ahead of the next table.
+        '''
+        requests = table_reader._table_plan(msg.table_addr.id,
+                                            self._gap_tolerance).requests
+
+        ds = [self._read_request(msg, requests[0])]
+        for request in requests[1:]:
+            d = self._slots.acquire()
+            d.addCallback(lambda _, request=request:
+                                self._read_request(msg, request))
+            ds.append(d)
+
+        done = defer.gatherResults(ds, consumeErrors=True)
+        done.addCallbacks(
+            lambda values: table_reader._report_read(
+                                self._feedback_q, msg, values=sum(values, ())),
+            lambda failure: table_reader._report_read(
+                                self._feedback_q, msg,
+                                error=failure.value.subFailure.getErrorMessage()))
+
+        self._next_table()
+
+    def _read_request(self, msg, request):
+        '''Make a single request, and release its slot once it's complete.
+
+        Returns a `Deferred` firing with the values read.
+        '''
+
+        start_time = time.time()
+        client = self._client
+        transaction_id = None
+        if client is None:
+            d = defer.fail(pymodbus.exceptions.ConnectionException(
+                    'Not connected'))
+        else:
+            d = defer.maybeDeferred(modbus.read_planned,
+                                    client,
+                                    unit=msg.table_addr.device_addr.unit,
+                                    planned_request=request)
+            # The request's just been sent, with the latest transaction id.
+            transaction_id = client.transaction.tid
+
+        def time_out():
+            # Otherwise the transaction is only forgotten if the gateway does
+            # eventually respond, or the connection is lost.
+            if transaction_id is not None:
+                client.transaction.delTransaction(transaction_id)
+            d.cancel()
+
+        timeout = self._clock.callLater(self._request_timeout, time_out)
+
+        def on_response(values):
+            end_time = time.time()
+            self._out_q.put(messages.ResponseMsg(
+                    table_addr = msg.table_addr,
+                    values = values,
+                    timing_info = domain.TimingInfo(start_time, end_time),
+                    error = None,
+                    request_info = {'recording_id': msg.recording_id}))
+            return values
+
+        def on_failure(failure):
+            _log.error("ERROR: %s : %s", msg, failure.getErrorMessage())
+            return failure
+
+        def release(result):
+            if timeout.active():
+                timeout.cancel()
+            self._slots.release()
+            return result
+
+        d.addCallback(on_response)
+        d.addErrback(on_failure)
+        d.addBoth(release)
+        return d
+
+class _ReaderProtocol(ModbusClientProtocol):
+    '''Lets the reader know when the connection comes and goes.'''
+
+    def connectionMade(self):
+        ModbusClientProtocol.connectionMade(self)
+        self.factory.reader.connected(self)
+
+    def connectionLost(self, reason):
+        ModbusClientProtocol.connectionLost(self, reason)
+        self.factory.reader.disconnected(self)
+
+class _ReaderFactory(protocol.ReconnectingClientFactory):
+
+    protocol = _ReaderProtocol
+    maxDelay = 30   # seconds
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return protocol.ReconnectingClientFactory.buildProtocol(self, addr)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Precompiled plans for reading a set of tables from a device.
+
+Working out which requests to make in order to read a set of tables, and
+where each register's value lies within each response, only depends upon the
+type of device and the tables being read.  So rather than repeat that work on
+every poll, it is done once, and the resulting (immutable) `ReadPlan` is
+cached.
+"""
+
+import collections
+import itertools
+
+import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.modbus as modbus
+import jem_data.diris.registers as diris_registers
+import jem_data.util as util
+
+DEVICE_REGISTER_TABLES = {
+    'diris.a40': diris_registers.TABLES,
+}
+
+ReadPlan = collections.namedtuple(
+        'ReadPlan',
+        'device_type table_ids requests')
+
+class PlannedRequest(collections.namedtuple(
+        'PlannedRequest',
+        'start count addresses offsets widths formats table_ids decoder')):
+    '''A single modbus request of a `ReadPlan`.
+
+    `start` and `count` give the range of registers requested.  The remaining
+    fields are parallel tuples describing each register read by the request:
+    its address, its offset within the response, its width (in 16-bit
+    registers), the `struct` format character its value is decoded with, and
+    the id of the table it belongs to.  `decoder` is a `util.RegisterDecoder`
+    compiled for that layout.
+    '''
+    __slots__ = ()
+
+    def decode(self, response):
+        '''Returns a tuple of (address, value) pairs read from the given
+        pymodbus response.
+        '''
+        register_values = response.registers
+        if len(register_values) != self.count:
+            raise jem_exceptions.ModbusInvalidResponse(
+                    "Expected %d registers, received %d" % (
+                        self.count, len(register_values)))
+
+        return tuple(itertools.izip(self.addresses,
+                                    self.decoder.decode(register_values)))
+
+def for_tables(device_type, table_ids, gap_tolerance=None):
+    '''Returns the `ReadPlan` for reading the given tables from a device of
+    the given type.
+
+    :param table_ids: an iterable of (1-indexed) table ids.
+    :param gap_tolerance: see `modbus.split_registers`.
+    '''
+    return _compile(device_type,
+                    tuple(sorted(set(table_ids))),
+                    gap_tolerance)
+
+@util.lru_cache(maxsize=256)
+def _compile(device_type, table_ids, gap_tolerance):
+    try:
+        register_tables = DEVICE_REGISTER_TABLES[device_type]
+    except KeyError:
+        raise ValueError("Unknown device type: %s" % device_type)
+
+    table_of = {}
+    for table_id in table_ids:
+        if not (1 <= table_id <= len(register_tables)):
+            raise ValueError("Unknown table for %s: %r" % (device_type,
+                                                           table_id))
+        for addr in register_tables[table_id - 1]:
+            table_of[addr] = table_id
+
+    requests = modbus.plan_requests(
+            [ register_tables[table_id - 1] for table_id in table_ids ],
+            gap_tolerance=gap_tolerance)
+
+    return ReadPlan(
+            device_type=device_type,
+            table_ids=table_ids,
+            requests=tuple(_compile_request(r, table_of) for r in requests))
+
+def _compile_request(registers, table_of):
+    addresses = tuple(sorted(registers))
+    start = addresses[0]
+    count = addresses[-1] + registers[addresses[-1]] - start
+    offsets = tuple( addr - start for addr in addresses )
+    widths = tuple( registers[addr] for addr in addresses )
+
+    return PlannedRequest(
+            start=start,
+            count=count,
+            addresses=addresses,
+            offsets=offsets,
+            widths=widths,
+            formats=''.join( util.register_format(w) for w in widths ),
+            table_ids=tuple( table_of[addr] for addr in addresses ),
+            decoder=util.RegisterDecoder(count, offsets, widths))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pre-aggregated summaries of the archived register values.
+
+Alongside the raw responses, the mongo writer folds every response into
+per-minute and per-hour buckets, one bucket per (device, table, interval),
+holding the min, max, mean, count and last value of each of the table's
+registers.  The buckets live in their own collections (by default
+"rollup-minute-<recording_id>" and "rollup-hour-<recording_id>"), so that
+queries over long time ranges read a handful of buckets instead of every raw
+poll.
+
+The buckets are accumulated in memory, and the open ones are written out
+(upserted) every `flush_interval` seconds.  A bucket is dropped from memory
+once its interval has passed and it has been written.
+"""
+
+import collections
+import logging
+import time
+
+import pymongo
+
+_log = logging.getLogger(__name__)
+
+Resolution = collections.namedtuple('Resolution', 'name seconds')
+
+MINUTE = Resolution('minute', 60)
+HOUR = Resolution('hour', 60 * 60)
+
+RESOLUTIONS = (MINUTE, HOUR)
+
+DEFAULT_COLLECTION_NAME = 'rollup-{resolution}-{recording_id}'
+DEFAULT_FLUSH_INTERVAL = 5.0    # seconds
+
+INDEXES = [
+    [('start', pymongo.ASCENDING)],
+]
+
+class Rollup(object):
+    '''Incrementally builds the rollup buckets of the responses it's given.
+
+    Call `add()` with each batch of `ResponseMsg`s, and `flush()` to write
+    the buckets out.
+    '''
+
+    def __init__(self,
+                 collection_name=DEFAULT_COLLECTION_NAME,
+                 resolutions=RESOLUTIONS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 clock=time.time):
+        self._collection_name = collection_name
+        self._resolutions = resolutions
+        self._flush_interval = flush_interval
+        self._clock = clock
+        self._buckets = {}
+        self._last_flush = clock()
+
+    def add(self, msgs):
+        '''Fold the values of the given `ResponseMsg`s into their buckets.
+
+        Responses without any values (ie - failed reads) are ignored.
+        '''
+        for msg in msgs:
+            if not msg.values:
+                continue
+
+            timestamp = msg.timing_info.end
+            for resolution in self._resolutions:
+                start = timestamp - (timestamp % resolution.seconds)
+                key = (self._collection_name.format(
+                            resolution=resolution.name,
+                            recording_id=msg.request_info['recording_id']),
+                       _bucket_id(msg.table_addr, start))
+
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = _Bucket(msg.table_addr,
+                                     resolution,
+                                     start)
+                    self._buckets[key] = bucket
+                bucket.add(timestamp, msg.values)
+
+    def flush(self, db, force=False):
+        '''Write out the buckets updated since the last flush.
+
+        Unless `force` is given, this only happens every `flush_interval`
+        seconds.
+        '''
+        now = self._clock()
+        if not force and now - self._last_flush < self._flush_interval:
+            return
+        self._last_flush = now
+
+        for key, bucket in self._buckets.items():
+            collection_name, bucket_id = key
+            if bucket.dirty:
+                _write_bucket(db[collection_name], bucket_id, bucket)
+            if bucket.end <= now:
+                del self._buckets[key]
+
+class _RegisterStats(object):
+
+    __slots__ = ('min', 'max', 'sum', 'count', 'last', 'last_time')
+
+    def __init__(self, min, max, sum, count, last, last_time):
+        self.min = min
+        self.max = max
+        self.sum = sum
+        self.count = count
+        self.last = last
+        self.last_time = last_time
+
+    def add(self, timestamp, value):
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.sum += value
+        self.count += 1
+        if timestamp >= self.last_time:
+            self.last = value
+            self.last_time = timestamp
+
+    def merge(self, other):
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        self.count += other.count
+        if other.last_time > self.last_time:
+            self.last = other.last
+            self.last_time = other.last_time
+
+    def asdict(self):
+        return {
+            'min': self.min,
+            'max': self.max,
+            'sum': self.sum,
+            'count': self.count,
+            'mean': float(self.sum) / self.count,
+            'last': self.last,
+            'last_time': self.last_time,
+        }
+
+    @classmethod
+    def fromdict(cls, d):
+        return cls(d['min'], d['max'], d['sum'], d['count'],
+                   d['last'], d['last_time'])
+
+class _Bucket(object):
+    '''The stats of one table's registers over one interval.'''
+
+    def __init__(self, table_addr, resolution, start):
+        self.table_addr = table_addr
+        self.resolution = resolution
+        self.start = start
+        self.end = start + resolution.seconds
+        self.registers = {}
+        self.dirty = False
+
+        # Whether the stored copy of this bucket has been merged in yet.  It
+        # won't have been if it was written before this process started.
+        self.merged = False
+
+    def add(self, timestamp, values):
+        registers = self.registers
+        for addr, value in values:
+            stats = registers.get(addr)
+            if stats is None:
+                registers[addr] = _RegisterStats(
+                        value, value, value, 1, value, timestamp)
+            else:
+                stats.add(timestamp, value)
+        self.dirty = True
+
+    def merge_stored(self, doc):
+        for addr, d in doc['registers'].items():
+            stored = _RegisterStats.fromdict(d)
+            stats = self.registers.get(int(addr))
+            if stats is None:
+                self.registers[int(addr)] = stored
+            else:
+                stats.merge(stored)
+        self.merged = True
+
+    def asdict(self):
+        device_addr = self.table_addr.device_addr
+        return {
+            'device': {
+                'gateway': {
+                    'host': device_addr.gateway_addr.host,
+                    'port': device_addr.gateway_addr.port,
+                },
+                'unit': device_addr.unit,
+            },
+            'table_id': self.table_addr.id,
+            'resolution': self.resolution.name,
+            'start': self.start,
+            'end': self.end,
+            # Mongo's keys must be strings.
+            'registers': dict( (str(addr), stats.asdict()) \
+                                for addr, stats in self.registers.items() ),
+        }
+
+def _bucket_id(table_addr, start):
+    device_addr = table_addr.device_addr
+    return '%s:%d/%d/%d/%d' % (device_addr.gateway_addr.host,
+                               device_addr.gateway_addr.port,
+                               device_addr.unit,
+                               table_addr.id,
+                               start)
+
+def _write_bucket(mongo_collection, bucket_id, bucket):
+    '''Upsert the bucket, taking into account any stored copy written by a
+    previous writer process.
+    '''
+    if not bucket.merged:
+        for keys in INDEXES:
+            mongo_collection.ensure_index(keys, background=True)
+        stored = mongo_collection.find_one(bucket_id)
+        if stored is not None:
+            _log.info("Merging with stored rollup bucket %s", bucket_id)
+            bucket.merge_stored(stored)
+        bucket.merged = True
+
+    mongo_collection.update({'_id': bucket_id},
+                            {'$set': bucket.asdict()},
+                            upsert=True)
+    bucket.dirty = False
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local write-ahead spool of the responses the mongo writer couldn't write.
+
+While mongo is unreachable, the writer appends each batch of responses to
+the spool rather than dropping them.  Once mongo is back, the spooled
+responses are replayed into it a batch at a time, alongside the live ones.
+
+The spool is a directory of append-only segment files, each a series of JSON
+lines, one response per line.  Appends are flushed to the file straight away,
+but only fsync'd every `fsync_interval` seconds (and whenever a segment is
+closed), so that spooling doesn't cost a disk sync per batch.  A segment is
+closed once it reaches `segment_bytes`, and deleted once it's been replayed.
+How far the replay has got through the oldest segment is kept in a cursor
+file, so that a restarted writer picks up where the last one left off.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.util as util
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 1.0    # seconds
+
+_SEGMENT_NAME = 'segment-%012d.jsonl'
+_SEGMENT_RE = re.compile(r'^segment-(\d{12})\.jsonl$')
+_CURSOR_NAME = 'cursor'
+
+class Spool(object):
+    '''A spool of `ResponseMsg`s, kept in the given directory.
+
+    Not thread-safe, and only one process may use a directory at a time.
+    '''
+
+    def __init__(self, directory,
+                 segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 clock=time.time):
+        self._directory = directory
+        self._segment_bytes = segment_bytes
+        self._fsync_interval = fsync_interval
+        self._clock = clock
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # The sequence numbers of the segments not yet replayed, oldest first.
+        self._segments = sorted(
+                int(m.group(1)) for m in (_SEGMENT_RE.match(name) \
+                                            for name in os.listdir(directory)) \
+                                if m is not None)
+        self._cursor = self._load_cursor()
+
+        # The segment being appended to, if any.
+        self._file = None
+        self._active = None
+        self._last_sync = clock()
+        self._unsynced = False
+
+        if self._segments:
+            _log.info("Found %d spooled segments in %s",
+                      len(self._segments), directory)
+
+    @property
+    def pending(self):
+        '''Whether there are any spooled responses left to replay.'''
+        return bool(self._segments)
+
+    def append(self, msgs):
+        '''Appends the `ResponseMsg`s to the spool.'''
+        if not msgs:
+            return
+        if self._file is None:
+            self._open_segment()
+
+        self._file.write(''.join(
+                json.dumps(util.deep_asdict(msg), separators=(',', ':')) + '\n'
+                    for msg in msgs))
+        self._file.flush()
+        self._unsynced = True
+
+        if self._file.tell() >= self._segment_bytes:
+            self._close_segment()
+        else:
+            self.sync()
+
+    def sync(self, force=False):
+        '''Fsyncs the segment being appended to, if it's been longer than
+        `fsync_interval` seconds since it was last synced (or if forced).
+        '''
+        if not self._unsynced:
+            return
+        now = self._clock()
+        if force or now - self._last_sync >= self._fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+            self._unsynced = False
+
+    def replay(self, write, limit):
+        '''Passes up to `limit` of the oldest spooled `ResponseMsg`s to
+        `write`, and then forgets them.  If `write` raises, they're kept, to
+        be replayed again later.
+
+        Returns the number of responses replayed.
+        '''
+        if not self._segments:
+            return 0
+
+        seq = self._segments[0]
+        if seq == self._active:
+            self._close_segment()
+        cursor_seq, offset = self._cursor
+        if cursor_seq != seq:
+            offset = 0
+
+        msgs = []
+        with open(self._path(seq), 'rb') as f:
+            f.seek(offset)
+            finished = False
+            while len(msgs) < limit:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    # Either the end of the segment, or a line left half
+                    # written by a crash.
+                    if line:
+                        _log.warn("Ignoring a truncated line at the end of "
+                                  "%s", self._path(seq))
+                    finished = True
+                    break
+                offset += len(line)
+                try:
+                    msgs.append(_unmarshall_response(json.loads(line)))
+                except (ValueError, KeyError, TypeError), e:
+                    _log.error("Skipping an unreadable line of %s: %s",
+                               self._path(seq), e)
+            else:
+                finished = offset >= os.fstat(f.fileno()).st_size
+
+        if msgs:
+            write(msgs)
+
+        if finished:
+            os.remove(self._path(seq))
+            self._segments.pop(0)
+            _log.info("Replayed spooled segment %s", self._path(seq))
+        else:
+            self._save_cursor(seq, offset)
+        return len(msgs)
+
+    def close(self):
+        if self._file is not None:
+            self._close_segment()
+
+    def _path(self, seq):
+        return os.path.join(self._directory, _SEGMENT_NAME % seq)
+
+    def _open_segment(self):
+        # Sequence numbers are never reused, so a cursor is never mistaken
+        # for one into a later segment.
+        seq = max(self._segments + [self._cursor[0]]) + 1
+        self._file = open(self._path(seq), 'ab')
+        self._active = seq
+        self._segments.append(seq)
+        _sync_directory(self._directory)
+        _log.info("Spooling responses to %s", self._path(seq))
+
+    def _close_segment(self):
+        self.sync(force=True)
+        self._file.close()
+        self._file = None
+        self._active = None
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self._directory, _CURSOR_NAME)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (IOError, ValueError):
+            return 0, 0
+
+    def _save_cursor(self, seq, offset):
+        '''Replaces the cursor file, atomically.'''
+        path = os.path.join(self._directory, _CURSOR_NAME)
+        with open(path + '.tmp', 'wb') as f:
+            f.write('%d %d\n' % (seq, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        self._cursor = (seq, offset)
+
+def _sync_directory(directory):
+    '''Fsyncs the directory, so that the files created in it survive a crash.
+    '''
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _unmarshall_response(d):
+    device_addr = d['table_addr']['device_addr']
+    return messages.ResponseMsg(
+            table_addr=domain.TableAddr(
+                device_addr=domain.DeviceAddr(
+                    gateway_addr=domain.GatewayAddr(
+                        **device_addr['gateway_addr']),
+                    unit=device_addr['unit']),
+                id=d['table_addr']['id']),
+            values=tuple(map(tuple, d['values'] or ())),
+            timing_info=domain.TimingInfo(**d['timing_info']),
+            error=d['error'],
+            request_info=d['request_info'])
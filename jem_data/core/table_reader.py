@@ -5,92 +5,214 @@
 """
 
 import contextlib
+import logging
 import multiprocessing
+import Queue
+import socket
 import time
 
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 import pymodbus.exceptions
 
-import jem_data.diris.registers as diris_registers
+import jem_data.core.connection_pool as connection_pool
 import jem_data.core.domain as domain
 import jem_data.core.exceptions as jem_exceptions
 import jem_data.core.messages as messages
 import jem_data.core.modbus as modbus
+import jem_data.core.read_plan as read_plan
 
-def start_readers(gateway, in_q, out_q, number_processes=4):
+_log = logging.getLogger(__name__)
+
+# Every device attached to the system is currently a Diris A40.
+_DEVICE_TYPE = 'diris.a40'
+
+def start_readers(gateway, out_q, number_processes=4,
+                  engine='blocking', pipeline_depth=None, feedback_q=None,
+                  max_connections=connection_pool.DEFAULT_MAX_CONNECTIONS,
+                  gap_tolerance=None):
     """
     Create and start a pool of `Process`s connecting to the `gateway` device.
-    """
-
-    even_q = multiprocessing.Queue()
-    odd_q = multiprocessing.Queue()
-    in_qs = [even_q, odd_q]
 
-    master = multiprocessing.Process(
-            target = _switch,
-            args = (in_q, even_q, odd_q))
-    master.start()
+    Returns a `UnitDispatcher`, upon which to `put` the `ReadTableMsg`s for
+    this gateway.
+
+    :param engine: how each process talks to the gateway.  Either
+                   `'blocking'`, making one request at a time; or
+                   `'pipelined'`, keeping up to `pipeline_depth` requests in
+                   flight on each process' connection.
+    :param feedback_q: an optional `Queue` upon which a `TableReadMsg` is put
+                       each time a whole table has been read (or failed to
+                       be read).
+    :param max_connections: the number of connections the gateway accepts.
+                            Each process uses a single connection, so no
+                            more than this many processes are started.
+    :param gap_tolerance: the largest number of unused registers a request
+                          may span (see `modbus.split_registers`).  Unlimited
+                          if None.
+    """
 
-    for i in xrange(number_processes):
+    if number_processes > max_connections:
+        _log.warn("Only starting %d readers for %s:%d (connection limit)",
+                  max_connections, gateway.host, gateway.port)
+        number_processes = max_connections
+
+    kwargs = {'feedback_q': feedback_q, 'gap_tolerance': gap_tolerance}
+    if engine == 'blocking':
+        target = _run
+    elif engine == 'pipelined':
+        import jem_data.core.pipelined_reader as pipelined_reader
+        target = pipelined_reader.run
+        kwargs['pipeline_depth'] = (pipeline_depth or
+                                    pipelined_reader.DEFAULT_PIPELINE_DEPTH)
+    else:
+        raise ValueError("Unknown reader engine: %s" % engine)
+
+    pool = connection_pool.ConnectionPool(gateway.host, gateway.port,
+                                          max_connections=max_connections)
+    in_qs = [ multiprocessing.Queue() for _ in xrange(number_processes) ]
+
+    processes = []
+    for i, in_q in enumerate(in_qs):
+        work_q = _WorkQueue(in_q, in_qs[i+1:] + in_qs[:i])
         p = multiprocessing.Process(
-                target = _run,
-                #args = (in_q, out_q, gateway.host, gateway.port))
-                args = (in_qs[i % 2], out_q, gateway.host, gateway.port))
+                target = target,
+                args = (work_q, out_q, pool),
+                kwargs = kwargs)
         p.start()
+        processes.append(p)
+
+    return UnitDispatcher(in_qs, processes, pool)
+
+class UnitDispatcher(object):
+    '''Spreads `ReadTableMsg`s across the queues of a pool of readers.
+
+    Each device unit is pinned to a single reader's queue, chosen as the
+    queue with the fewest units pinned to it at the time the unit is first
+    seen.  This balances the devices over the readers whatever their unit
+    ids are.  Readers which run out of work of their own take work from the
+    others' queues (see `_WorkQueue`), which evens out the remaining
+    imbalance.
+
+    Dispatching happens in the process putting the messages, so there's no
+    additional process between the producer and the readers.
+
+    `processes` are the readers' `Process`es, if known.  And `pool` is their
+    `ConnectionPool`, kept here so that its shared memory isn't freed (and
+    reused) while the readers are still using it.
+    '''
+
+    def __init__(self, queues, processes=(), pool=None):
+        if not queues:
+            raise ValueError("At least one queue is required")
+        self.processes = list(processes)
+        self.pool = pool
+        self._queues = list(queues)
+        self._units = {}
+        self._load = [0] * len(queues)
+
+    def put(self, msg):
+        self._queue_for(msg.table_addr.device_addr.unit).put(msg)
+
+    def qsize(self):
+        '''The approximate number of messages waiting across all the queues.'''
+        return sum( q.qsize() for q in self._queues )
+
+    def _queue_for(self, unit):
+        try:
+            i = self._units[unit]
+        except KeyError:
+            i = self._load.index(min(self._load))
+            self._units[unit] = i
+            self._load[i] += 1
+        return self._queues[i]
+
+class _WorkQueue(object):
+    '''A reader's view of its pool's queues.
+
+    Messages are taken from the reader's own queue, falling back to its
+    siblings' queues whenever its own queue is empty.
+    '''
+
+    def __init__(self, own_q, sibling_qs, steal_interval=0.05):
+        self._own_q = own_q
+        self._sibling_qs = sibling_qs
+        self._steal_interval = steal_interval
+
+    def get(self):
+        while True:
+            try:
+                return self._own_q.get(timeout=self._steal_interval)
+            except Queue.Empty:
+                pass
 
-def _switch(in_q, even_q, odd_q):
-    while True:
-        msg = in_q.get()
-        if msg.table_addr.device_addr.unit % 2 == 0:
-            even_q.put(msg)
-        else:
-            odd_q.put(msg)
+            for q in self._sibling_qs:
+                try:
+                    return q.get_nowait()
+                except Queue.Empty:
+                    pass
 
-def _run(in_q, out_q, host, port):
+def _run(in_q, out_q, pool, feedback_q=None, gap_tolerance=None):
     """
     Endlessly reads `ReadTableMsg` objects from a given `Queue`, performs the
     requests necessary to read the whole table, and writes the results back
     out to another (given) `Queue`.
+
+    Connections are borrowed from the given `ConnectionPool`.
     """
-    client = ModbusClient(host, port)
-    with contextlib.closing(client) as conn:
+    with contextlib.closing(pool):
 
         while True:
+            msg = in_q.get()
             try:
-                msg = in_q.get()
-                _read_table(msg, out_q, conn)
+                with pool.connection() as conn:
+                    values = _read_table(msg, out_q, conn, gap_tolerance)
+                _report_read(feedback_q, msg, values=values)
             except jem_exceptions.JemException, e:
                 print "ERROR: %s : %s" % (msg, e)
-            except pymodbus.exceptions.ConnectionException:
-                pass
+                _report_read(feedback_q, msg, error=str(e))
+            except (pymodbus.exceptions.ConnectionException,
+                    socket.error), e:
+                _log.error("Unable to read %s: %s", msg, e)
+                _report_read(feedback_q, msg, error=str(e))
 
-def _read_table(msg, out_q, conn):
-    #msg = in_q.get()
+def _read_table(msg, out_q, conn, gap_tolerance=None):
+    """
+    Reads the whole table, putting a `ResponseMsg` on `out_q` for each
+    request made.  Returns all the values read.
+    """
 
-    for registers in _table_requests(msg.table_addr.id):
+    all_values = ()
+    for request in _table_plan(msg.table_addr.id, gap_tolerance).requests:
         start_time = time.time()
-        response = modbus.read_registers(conn,
-                                         registers=registers,
-                                         unit=msg.table_addr.device_addr.unit)
+        values = modbus.read_planned(conn,
+                                     unit=msg.table_addr.device_addr.unit,
+                                     planned_request=request)
         end_time = time.time()
 
         result = messages.ResponseMsg(
                 table_addr = msg.table_addr,
-                values = _read_values_from_response(response, registers),
+                values = values,
                 timing_info = domain.TimingInfo(start_time, end_time),
                 error = None,
                 request_info = {'recording_id': msg.recording_id})
 
         print "SUCCESS: %s : %s" % (msg, result)
         out_q.put(result)
+        all_values += values
 
-def _table_requests(table_id):
-    registers = diris_registers.TABLES[table_id - 1]
-    return modbus.split_registers(registers)
+    return all_values
 
-def _read_values_from_response(response, requested_registers):
+def _report_read(feedback_q, msg, values=None, error=None):
     """
-    Returns a tuple of 2-tuples of (address, value) pairs.
+    Let whoever is scheduling the reads know that a table has been read.  The
+    values themselves aren't needed, only enough to tell if they've changed.
     """
-    return tuple( (addr, response.read_register(addr)) \
-                        for addr in requested_registers.keys() )
+    if feedback_q is not None:
+        feedback_q.put(messages.TableReadMsg(
+                table_addr = msg.table_addr,
+                values_digest = None if values is None else hash(values),
+                error = error,
+                sent_at = msg.sent_at))
+
+def _table_plan(table_id, gap_tolerance=None):
+    return read_plan.for_tables(_DEVICE_TYPE, [table_id],
+                                gap_tolerance=gap_tolerance)
@@ -13,12 +13,35 @@ import time
 import jem_data.core.domain as domain
 import jem_data.core.messages as messages
 
+# The interval between reads of a table, unless configured otherwise.
+DEFAULT_POLL_INTERVAL = 0.5     # seconds
+
+# When adaptively polling, a table whose values haven't changed is read
+# half as often, up to this multiple of its configured interval.
+MAX_BACKOFF = 16
+
+# A request that hasn't been reported as read after this long is assumed to
+# have been lost, and no longer holds back further reads of its table.
+IN_FLIGHT_TIMEOUT = 30.0        # seconds
+
 class TableRequestManager(multiprocessing.Process):
+    '''Schedules the reading of each table of the current recording.
+
+    If the readers report back on a `feedback` queue, the manager also keeps
+    track of the requests still in flight.  A table is never requested again
+    whilst its previous request is still outstanding: that poll is skipped
+    instead.  So when a gateway can't keep up, or is unreachable, its queue
+    holds at most one request per table rather than growing without bound.
+    '''
 
-    def __init__(self, queues, instructions):
+    def __init__(self, queues, instructions, feedback=None, stats=None):
         super(TableRequestManager, self).__init__()
         self._queues = queues.copy()
+        self._feedback = feedback
+        self.stats = stats
         self._config = {}
+        self._in_flight = {}
+        self._generation = 0
         self._recording_id = None
         self._instructions = instructions
         self._tasks = []
@@ -38,15 +61,20 @@ class TableRequestManager(multiprocessing.Process):
         '''Resets the current config to only request the given tables.
         '''
         tables = []
+        polling = {}
         for gateway in recording.gateways:
             gateway_addr = domain.GatewayAddr(gateway.host, gateway.port)
             for device in gateway.devices:
                 device_addr = domain.DeviceAddr(gateway_addr, device.unit)
                 for table in device.tables:
-                    tables.append(domain.TableAddr(device_addr, table.id))
+                    table_addr = domain.TableAddr(device_addr, table.id)
+                    tables.append(table_addr)
+                    if table.polling is not None:
+                        polling[table_addr] = table.polling
 
         self._instructions.put(_ResetRequests(tables=tables,
-                                              recording_id=recording.id))
+                                              recording_id=recording.id,
+                                              polling=polling))
 
     def stop_requests(self):
         self._instructions.put(_StopRequests())
@@ -64,13 +92,49 @@ class TableRequestManager(multiprocessing.Process):
 
     def _run_push_table_request_task(self, task):
         table = task.table
+        if task.generation != self._generation:
+            # Superseded by a later reset.
+            return
+
+        self._read_feedback()
         if self._sending_requests:
-            print "Making request to %r" % (table,)
-            q = self._queues[table.device_addr.gateway_addr]
-            req = messages.ReadTableMsg(table, self._recording_id)
-            q.put(req)
+            gateway = table.device_addr.gateway_addr
+            q = self._queues[gateway]
+            if self._awaiting_response(table):
+                self._count(gateway, 'skipped')
+            else:
+                print "Making request to %r" % (table,)
+                req = messages.ReadTableMsg(table, self._recording_id,
+                                            time.time())
+                q.put(req)
+                self._count(gateway, 'sent')
+                if self._feedback is not None:
+                    self._in_flight[table] = req.sent_at
+                    self._count(gateway, 'in_flight')
+
+            if self.stats is not None:
+                self.stats.set(gateway, 'queue_depth', q.qsize())
             self._enqueue_push_table_request_task(table)
 
+    def _awaiting_response(self, table):
+        '''Is the previous request for this table still outstanding?'''
+        sent_at = self._in_flight.get(table)
+        if sent_at is None:
+            return False
+
+        if time.time() - sent_at > IN_FLIGHT_TIMEOUT:
+            del self._in_flight[table]
+            gateway = table.device_addr.gateway_addr
+            self._count(gateway, 'in_flight', -1)
+            self._count(gateway, 'expired')
+            return False
+
+        return True
+
+    def _count(self, gateway, counter, n=1):
+        if self.stats is not None:
+            self.stats.increment(gateway, counter, n)
+
     def _run_read_instructions_task(self, task):
         try:
             while True:
@@ -100,17 +164,50 @@ class TableRequestManager(multiprocessing.Process):
             if gateway not in self._queues:
                 raise Exception("Uh oh: no queue for gateway: %s" % (gateway,))
 
-        self._config = dict( (t, 0.5) for t in instruction.tables )
+        self._config = dict(
+            (t, _PollSchedule(instruction.polling.get(t, _DEFAULT_POLLING))) \
+                for t in instruction.tables )
+        self._forget_dropped_tables()
+        self._generation += 1
         self._recording_id = instruction.recording_id
         now = time.time()
         for table in self._config:
             self._enqueue_push_table_request_task(table, now=now)
         self._sending_requests = True
 
+    def _forget_dropped_tables(self):
+        '''Stop awaiting responses for tables no longer being read, as they'll
+        never be polled again to expire them.
+        '''
+        for table in self._in_flight.keys():
+            if table not in self._config:
+                del self._in_flight[table]
+                self._count(table.device_addr.gateway_addr, 'in_flight', -1)
+
+    def _read_feedback(self):
+        '''Adapt the polling rates to the tables read since last time.'''
+        if self._feedback is None:
+            return
+
+        try:
+            while True:
+                msg = self._feedback.get(block=False)
+                # Unless it's late feedback from an expired request, in which
+                # case a later request is the one in flight.
+                if msg.sent_at is not None and \
+                        self._in_flight.get(msg.table_addr) == msg.sent_at:
+                    del self._in_flight[msg.table_addr]
+                    self._count(msg.table_addr.device_addr.gateway_addr,
+                                'in_flight', -1)
+                if msg.table_addr in self._config:
+                    self._config[msg.table_addr].table_read(msg)
+        except Queue.Empty:
+            pass
+
     def _enqueue_push_table_request_task(self, table, now=None):
         if table in self._config:
-            task = _PushTableRequestTask(table)
-            delay = self._config[table]
+            task = _PushTableRequestTask(table, self._generation)
+            delay = self._config[table].interval
             self._enqueue_task(task, delay, now)
 
     def _enqueue_read_instructions_task(self, delay=0.5, now=None):
@@ -121,16 +218,45 @@ class TableRequestManager(multiprocessing.Process):
         now = now or time.time()
         heapq.heappush(self._tasks, (now + delay, task))
 
+class _PollSchedule(object):
+    '''How often a single table is read.
+
+    If adaptive polling is enabled, the interval is doubled each time the
+    table's values are read unchanged (up to `MAX_BACKOFF` times the
+    configured interval), and reset as soon as they change.
+    '''
+
+    __slots__ = ('polling', 'interval', '_last_digest')
+
+    def __init__(self, polling):
+        self.polling = polling
+        self.interval = polling.interval
+        self._last_digest = None
+
+    def table_read(self, msg):
+        if not self.polling.adaptive or msg.values_digest is None:
+            return
+
+        if msg.values_digest == self._last_digest:
+            self.interval = min(self.interval * 2,
+                                self.polling.interval * MAX_BACKOFF)
+        else:
+            self.interval = self.polling.interval
+        self._last_digest = msg.values_digest
+
+_DEFAULT_POLLING = domain.Polling(interval=DEFAULT_POLL_INTERVAL,
+                                  adaptive=False)
+
 class _ReadInstructionsTask(object):
     __slots__ = ()
 
 _PushTableRequestTask = collections.namedtuple(
         '_PushTableRequestTask',
-        'table')
+        'table generation')
 
 _ResetRequests = collections.namedtuple(
         '_ResetRequests',
-        'tables recording_id')
+        'tables recording_id polling')
 
 class _StopRequests(object):
     __slots__ = ()
@@ -138,11 +264,55 @@ class _StopRequests(object):
 class _ResumeRequests(object):
     __slots__ = ()
 
-def start_manager(queues):
+class SchedulingStats(object):
+    '''Counters of how well the readers of each gateway are keeping up.
+
+    The counters live in shared memory, so they can be updated by the
+    manager's process and read from any other.
+
+    * `in_flight`: requests sent, but not yet reported as read.
+    * `queue_depth`: requests waiting in the gateway's queues.
+    * `sent`: the total number of requests sent.
+    * `skipped`: polls skipped because the previous request for the same
+      table was still in flight.
+    * `expired`: requests given up on after `IN_FLIGHT_TIMEOUT`.
+    '''
+
+    COUNTERS = ('in_flight', 'queue_depth', 'sent', 'skipped', 'expired')
+
+    def __init__(self, gateways):
+        self._index = dict( (g, i) for i, g in enumerate(gateways) )
+        self._values = multiprocessing.Array(
+                'l', len(self.COUNTERS) * len(self._index))
+
+    def increment(self, gateway, counter, n=1):
+        with self._values.get_lock():
+            self._values[self._offset(gateway, counter)] += n
+
+    def set(self, gateway, counter, value):
+        self._values[self._offset(gateway, counter)] = value
+
+    def snapshot(self):
+        '''Returns a dict of "host:port" to a dict of counter values.'''
+        with self._values.get_lock():
+            values = self._values[:]
+        n = len(self.COUNTERS)
+        return dict(
+            ('%s:%d' % (g.host, g.port),
+             dict(zip(self.COUNTERS, values[i*n : (i+1)*n]))) \
+                for g, i in self._index.items() )
+
+    def _offset(self, gateway, counter):
+        return (self._index[gateway] * len(self.COUNTERS) +
+                self.COUNTERS.index(counter))
+
+def start_manager(queues, feedback=None):
     """
     Create and start a new table request manager processes.
 
     :param queues: is a mapping from `GatewayAddr` to `Queue` objects.
+    :param feedback: an optional `Queue` of `TableReadMsg`s, written to by the
+                     readers, used to adapt the polling rates.
 
     The `queues` parameter holds the input queues for each `Gateway`.  These
     are used to write new requests to.
@@ -154,7 +324,8 @@ def start_manager(queues):
     process will listen to command messages upon.
     """
     instruction_queue = multiprocessing.Queue()
-    p = TableRequestManager(queues, instruction_queue)
+    stats = SchedulingStats(queues.keys())
+    p = TableRequestManager(queues, instruction_queue, feedback, stats)
     p.start()
     return p
 
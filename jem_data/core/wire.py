@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+A compact binary encoding of the `ResponseMsg`s passed from the readers to
+the mongo writer.
+
+Pickling a `ResponseMsg` pickles its chain of namedtuples, every register
+address alongside its value, and the request info dict.  Yet all that varies
+between two responses to the same request are the timings and the values.
+
+So an encoded response is a fixed header, followed by the recording id and
+then the values, packed as they were read:
+
+    gateway id      unsigned short      (index into the codec's gateways)
+    unit            unsigned char
+    table id        unsigned char
+    request index   unsigned char       (into the table's `ReadPlan`)
+    start time      double
+    end time        double
+    recording id    unsigned char length, followed by that many bytes
+    values          the request's `PlannedRequest.formats`
+
+The register addresses are implied by the request's place in the table's
+read plan, which both ends compile for themselves.
+
+`EncodingQueue` and `DecodingQueue` wrap the queue between the readers and the
+writer, encoding and decoding responses transparently.
+"""
+
+import struct
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.read_plan as read_plan
+
+_HEADER = struct.Struct('>HBBBddB')
+
+class ResponseCodec(object):
+    '''Encodes and decodes the `ResponseMsg`s of reads of the given
+    gateways' devices (all of the given device type).
+    '''
+
+    def __init__(self, gateways, device_type='diris.a40'):
+        self._gateways = [ domain.GatewayAddr(g.host, g.port) \
+                                for g in gateways ]
+        self._gateway_ids = dict( (g, i) for i, g in \
+                                        enumerate(self._gateways) )
+
+        # For each table: its plan's requests, and for finding which request
+        # a response is to, each request's index by its first address.
+        self._requests = {}
+        self._request_index = {}
+        tables = read_plan.DEVICE_REGISTER_TABLES[device_type]
+        for table_id in xrange(1, len(tables) + 1):
+            requests = [ (request, struct.Struct('>' + request.formats)) \
+                            for request in read_plan.for_tables(
+                                                device_type,
+                                                [table_id]).requests ]
+            self._requests[table_id] = requests
+            self._request_index[table_id] = dict(
+                    (request.addresses[0], i) \
+                        for i, (request, _) in enumerate(requests) )
+
+    def encode(self, msg):
+        '''Returns the encoded message, as a byte string.
+
+        Raises a `ValueError` if the message can't be encoded (eg - it's of
+        a failed read, or of an unknown gateway).
+        '''
+        if msg.error is not None or not msg.values:
+            raise ValueError("Only successful reads can be encoded")
+
+        device_addr = msg.table_addr.device_addr
+        table_id = msg.table_addr.id
+        try:
+            gateway_id = self._gateway_ids[device_addr.gateway_addr]
+            index = self._request_index[table_id][msg.values[0][0]]
+        except (KeyError, TypeError):
+            raise ValueError("Unknown gateway, table or request: %r" % (
+                                msg.table_addr,))
+
+        request, values_struct = self._requests[table_id][index]
+        if len(msg.values) != len(request.addresses):
+            raise ValueError("Unexpected values for request: %r" % (
+                                msg.table_addr,))
+
+        recording_id = (msg.request_info or {}).get('recording_id')
+        if not isinstance(recording_id, basestring):
+            raise ValueError("Invalid recording id: %r" % (recording_id,))
+        recording_id = recording_id.encode('utf-8')
+        if len(recording_id) > 0xFF:
+            raise ValueError("Recording id too long: %r" % recording_id)
+
+        try:
+            return ''.join((
+                    _HEADER.pack(gateway_id,
+                                 device_addr.unit,
+                                 table_id,
+                                 index,
+                                 msg.timing_info.start,
+                                 msg.timing_info.end,
+                                 len(recording_id)),
+                    recording_id,
+                    values_struct.pack(*[ value for _, value in msg.values ])))
+        except struct.error, e:
+            raise ValueError(str(e))
+
+    def decode(self, data):
+        '''Returns the `ResponseMsg` encoded in the byte string.'''
+        (gateway_id, unit, table_id, index,
+         start, end, recording_id_len) = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        recording_id = data[offset:offset + recording_id_len]
+        offset += recording_id_len
+
+        request, values_struct = self._requests[table_id][index]
+        return messages.ResponseMsg(
+                table_addr=domain.TableAddr(
+                    device_addr=domain.DeviceAddr(
+                        gateway_addr=self._gateways[gateway_id],
+                        unit=unit),
+                    id=table_id),
+                values=tuple(zip(request.addresses,
+                                 values_struct.unpack_from(data, offset))),
+                timing_info=domain.TimingInfo(start, end),
+                error=None,
+                request_info={'recording_id': recording_id})
+
+class EncodingQueue(object):
+    '''The writing end of a queue of encoded responses.
+
+    Messages which can't be encoded are put on the queue as they are.
+    '''
+
+    def __init__(self, q, codec):
+        self._q = q
+        self._codec = codec
+
+    def put(self, msg):
+        try:
+            msg = self._codec.encode(msg)
+        except ValueError:
+            pass
+        self._q.put(msg)
+
+class DecodingQueue(object):
+    '''The reading end of a queue of encoded responses.'''
+
+    def __init__(self, q, codec):
+        self._q = q
+        self._codec = codec
+
+    def get(self, block=True, timeout=None):
+        msg = self._q.get(block, timeout)
+        if isinstance(msg, str):
+            msg = self._codec.decode(msg)
+        return msg
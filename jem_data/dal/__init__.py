@@ -1,9 +1,16 @@
+import base64
+import hashlib
+import itertools
+import json
+import threading
 import time
 
 import bson.objectid as objectid
 import pymongo
 
+import jem_data.core.bucketed_archive as bucketed_archive
 import jem_data.core.exceptions as jem_exceptions
+import indexes
 import json_marshalling
 import jem_data.util as util
 
@@ -13,8 +20,13 @@ class DataAccessLayer(object):
         connection = pymongo.MongoClient(config.host, config.port)
         self._db = connection[config.database]
 
-        self.gateways = GatewayRepository(self._db)
+        self.gateways = CachingGatewayRepository(GatewayRepository(self._db))
         self.recordings = RecordingsRepository(self._db)
+        self.archive = ArchiveRepository(self._db)
+
+    def ensure_indexes(self):
+        '''Report, and create, any missing indexes.'''
+        return indexes.ensure_all_indexes(self._db)
 
 class GatewayRepository(object):
 
@@ -30,18 +42,107 @@ class GatewayRepository(object):
     def all(self):
         return [ json_marshalling.unmarshall_gateway(d) for d in self._collection.find() ]
 
+class CachingGatewayRepository(object):
+    '''Wraps a `GatewayRepository`, caching its gateways until they're next
+    changed.
+
+    The cache is local to the process, so it's only invalidated by changes
+    made through it.  That's enough while the api is served by a single
+    (threaded) process, which makes all the changes.
+    '''
+
+    def __init__(self, repository):
+        self._repository = repository
+        self._version = 0
+        self._lock = threading.Lock()
+        self._cached = None     # (version, gateways, etag)
+
+    def delete_all(self):
+        self._repository.delete_all()
+        self._invalidate()
+
+    def insert(self, gateways):
+        self._repository.insert(gateways)
+        self._invalidate()
+
+    def all(self):
+        _, gateways, _ = self._current()
+        return list(gateways)
+
+    def etag(self):
+        '''An entity tag for the current gateways, which changes whenever
+        they do.
+        '''
+        _, _, etag = self._current()
+        return etag
+
+    def _current(self):
+        with self._lock:
+            version = self._version
+            if self._cached is None or self._cached[0] != version:
+                # The version is read before the gateways, so an update
+                # racing with this leaves the cache out of date, not wrong.
+                gateways = tuple(self._repository.all())
+                etag = hashlib.sha1(json.dumps(map(util.deep_asdict, gateways),
+                                               sort_keys=True)).hexdigest()
+                self._cached = (version, gateways, etag)
+            return self._cached
+
+    def _invalidate(self):
+        with self._lock:
+            self._version += 1
+
 class RecordingsRepository(object):
 
     def __init__(self, db):
         self._db = db
         self._collection = db['recordings']
 
-    def all(self):
-        recordings = []
-        for recording_data in self._collection.find():
-            r = json_marshalling.unmarshall_recording(recording_data)
-            recordings.append(r)
-        return recordings
+    def all(self, limit=None, before_start_time=None, before_id=None,
+            summary=False):
+        '''Recordings, most recently started first (and of those started at
+        the same time, the most recently created first).
+
+        :param limit: the maximum number of recordings to return.
+        :param before_start_time: only return recordings started before this
+                                  time.
+        :param before_id: along with `before_start_time`, also return the
+                          recordings started at that time which come after
+                          the recording of this id.  Pass the start time and
+                          id of the last recording of one page to get the
+                          next.
+        :param summary: return `RecordingSummary`s rather than `Recording`s,
+                        which saves reading each recording's gateways.
+
+        Raises a `ValidationException` if `before_id` isn't a valid id.
+        '''
+        spec = {}
+        if before_start_time is not None and before_id is not None:
+            try:
+                before_id = objectid.ObjectId(before_id)
+            except (TypeError, objectid.InvalidId):
+                raise jem_exceptions.ValidationException(
+                        "Invalid recording id: %r" % (before_id,))
+            spec['$or'] = [
+                {'start_time': {'$lt': before_start_time}},
+                {'start_time': before_start_time, '_id': {'$lt': before_id}},
+            ]
+        elif before_start_time is not None:
+            spec['start_time'] = {'$lt': before_start_time}
+
+        if summary:
+            fields = ['status', 'start_time', 'end_time']
+            unmarshall = json_marshalling.unmarshall_recording_summary
+        else:
+            fields = None
+            unmarshall = json_marshalling.unmarshall_recording
+
+        cursor = self._collection.find(spec, fields=fields).sort(
+                [('start_time', pymongo.DESCENDING),
+                 ('_id', pymongo.DESCENDING)])
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return map(unmarshall, cursor)
 
     def by_id(self, recording_id):
         data = self._collection.find_one(objectid.ObjectId(recording_id))
@@ -50,6 +151,24 @@ class RecordingsRepository(object):
 
         return json_marshalling.unmarshall_recording(data)
 
+    def rollups(self, recording_id, resolution,
+                start_time=None, end_time=None):
+        '''The given recording's `RollupBucket`s of the given resolution
+        (eg - 'minute' or 'hour'), ordered by start time.
+
+        If given, only buckets overlapping [start_time, end_time) are
+        returned.
+        '''
+        spec = {}
+        if start_time is not None:
+            spec['end'] = {'$gt': start_time}
+        if end_time is not None:
+            spec['start'] = {'$lt': end_time}
+
+        collection = self._db['rollup-%s-%s' % (resolution, recording_id)]
+        cursor = collection.find(spec).sort('start', pymongo.ASCENDING)
+        return [ json_marshalling.unmarshall_rollup_bucket(d) for d in cursor ]
+
     def create(self, recording):
         '''Inserts a new recording, and creates a collection for its results.
         '''
@@ -57,10 +176,13 @@ class RecordingsRepository(object):
         self._collection.insert(data)
         new_id = str(data['_id'])
 
+        archive_name = 'archive-%s' % new_id
         try:
-            self._db.create_collection('archive-%s' % new_id)
+            self._db.create_collection(archive_name)
         except pymongo.errors.CollectionInvalid, e:
             raise jem_exceptions.PersistenceException(str(e))
+        indexes.ensure_indexes(self._db[archive_name],
+                               indexes.ARCHIVE_INDEXES)
 
         return recording._replace(id=new_id)
 
@@ -93,3 +215,214 @@ class RecordingsRepository(object):
         else:
             raise jem_exceptions.PersistenceException(result['err'])
         
+
+class ArchiveRepository(object):
+    '''Reads back the responses archived during a recording, whichever
+    layout they were stored in.
+
+    The responses can be filtered by:
+
+        - `start_time` and `end_time`: only responses received in
+          [start_time, end_time).
+        - `host`, `port`, `unit` and `table_id`: only responses from the
+          given gateway, device and table.
+        - `registers`: only the values of the given register addresses (and
+          only responses including at least one of them).
+    '''
+
+    def __init__(self, db):
+        self._db = db
+
+    def responses(self, recording_id, **filters):
+        '''Yields the recording's (filtered) `ResponseMsg`s.'''
+        return ( msg for _, msg in self.resumable_responses(recording_id,
+                                                            **filters) )
+
+    def resumable_responses(self, recording_id, resume_token=None, **filters):
+        '''Yields (resume_token, msg) pairs of the recording's (filtered)
+        `ResponseMsg`s.
+
+        Passing a pair's resume token back in resumes the responses
+        immediately after that pair's response.  The responses are read from
+        a mongo cursor as they're consumed.
+
+        Raises a `ValidationException` if given an invalid resume token.
+        '''
+        position = _decode_resume_token(resume_token)
+
+        bucketed_name = bucketed_archive.DEFAULT_COLLECTION_NAME.format(
+                recording_id=recording_id)
+        if bucketed_name in self._db.collection_names():
+            if position is not None and position[0] != 'b':
+                raise jem_exceptions.ValidationException(
+                        "Invalid resume token: %r" % resume_token)
+            return self._bucketed_responses(self._db[bucketed_name],
+                                            recording_id,
+                                            position,
+                                            **filters)
+        else:
+            if position is not None and position[0] != 'd':
+                raise jem_exceptions.ValidationException(
+                        "Invalid resume token: %r" % resume_token)
+            return self._document_responses(
+                    self._db['archive-%s' % recording_id],
+                    position,
+                    **filters)
+
+    def register_values(self, recording_id, register,
+                        start_time=None, end_time=None, **device_filters):
+        '''Yields the (time, value) pairs of a single register, in no
+        particular order.  The time is the end of each read.
+
+        Only the register's values (and their times) are read from mongo,
+        rather than whole responses.
+        '''
+        bucketed_name = bucketed_archive.DEFAULT_COLLECTION_NAME.format(
+                recording_id=recording_id)
+        if bucketed_name in self._db.collection_names():
+            spec = _bucket_spec(start_time, end_time, **device_filters)
+            spec['addresses'] = register
+            column = str(register)
+            cursor = self._db[bucketed_name].find(
+                    spec, fields={'end_times': 1,
+                                  'columns.' + column: 1,
+                                  '_id': 0})
+            for bucket_data in cursor:
+                for t, value in itertools.izip(bucket_data['end_times'],
+                                               bucket_data['columns'][column]):
+                    if _in_range(t, start_time, end_time):
+                        yield (t, value)
+        else:
+            spec = _document_spec(start_time, end_time, **device_filters)
+            # Only the first (and only) value of the register is projected.
+            spec['values'] = {'$elemMatch': {'0': register}}
+            cursor = self._db['archive-%s' % recording_id].find(
+                    spec, fields={'timing_info.end': 1,
+                                  'values.$': 1,
+                                  '_id': 0})
+            for response_data in cursor:
+                for addr, value in response_data['values']:
+                    if addr == register:
+                        yield (response_data['timing_info']['end'], value)
+
+    def _bucketed_responses(self, collection, recording_id, position,
+                            start_time=None, end_time=None, registers=None,
+                            **device_filters):
+        spec = _bucket_spec(start_time, end_time, **device_filters)
+        if registers is not None:
+            spec['addresses'] = {'$in': list(registers)}
+
+        # Buckets are read in order of (start, _id), and samples within a
+        # bucket in the order they were appended.
+        resume_bucket_id, resume_index = None, 0
+        if position is not None:
+            _, resume_start, resume_bucket_id, resume_index = position
+            spec['$or'] = [
+                {'start': {'$gt': resume_start}},
+                {'start': resume_start, '_id': {'$gte': resume_bucket_id}},
+            ]
+
+        cursor = collection.find(spec).sort([('start', pymongo.ASCENDING),
+                                             ('_id', pymongo.ASCENDING)])
+        for bucket_data in cursor:
+            bucket_id = bucket_data['_id']
+            msgs = json_marshalling.unmarshall_archive_bucket(bucket_data,
+                                                              recording_id)
+            first = resume_index if bucket_id == resume_bucket_id else 0
+            for i in xrange(first, len(msgs)):
+                msg = _select_registers(msgs[i], registers)
+                if msg is not None and \
+                        _in_range(msg.timing_info.end, start_time, end_time):
+                    yield (_encode_resume_token(
+                                'b', bucket_data['start'], bucket_id, i + 1),
+                           msg)
+
+    def _document_responses(self, collection, position,
+                            start_time=None, end_time=None, registers=None,
+                            **device_filters):
+        spec = _document_spec(start_time, end_time, **device_filters)
+        if position is not None:
+            _, resume_end, resume_id = position
+            spec['$or'] = [
+                {'timing_info.end': {'$gt': resume_end}},
+                {'timing_info.end': resume_end, '_id': {'$gt': resume_id}},
+            ]
+
+        # Documents are read in order of (timing_info.end, _id), which the
+        # archive's indexes cover (see `indexes.ARCHIVE_INDEXES`).
+        cursor = collection.find(spec).sort([
+                ('timing_info.end', pymongo.ASCENDING),
+                ('_id', pymongo.ASCENDING)])
+        for response_data in cursor:
+            msg = _select_registers(
+                    json_marshalling.unmarshall_response(response_data),
+                    registers)
+            if msg is not None:
+                yield (_encode_resume_token('d',
+                                            response_data['timing_info']['end'],
+                                            str(response_data['_id'])),
+                       msg)
+
+def _device_spec(host=None, port=None, unit=None, table_id=None):
+    spec = {}
+    if host is not None:
+        spec['device.gateway.host'] = host
+    if port is not None:
+        spec['device.gateway.port'] = port
+    if unit is not None:
+        spec['device.unit'] = unit
+    if table_id is not None:
+        spec['table_id'] = table_id
+    return spec
+
+def _bucket_spec(start_time, end_time, **device_filters):
+    '''Selects the buckets overlapping [start_time, end_time).'''
+    spec = _device_spec(**device_filters)
+    if start_time is not None:
+        spec['end'] = {'$gt': start_time}
+    if end_time is not None:
+        spec['start'] = {'$lt': end_time}
+    return spec
+
+def _document_spec(start_time, end_time, **device_filters):
+    spec = _device_spec(**device_filters)
+    if start_time is not None:
+        spec.setdefault('timing_info.end', {})['$gte'] = start_time
+    if end_time is not None:
+        spec.setdefault('timing_info.end', {})['$lt'] = end_time
+    return spec
+
+def _select_registers(msg, registers):
+    '''Returns the message with only the values of the given registers, or
+    None if it has none of them.
+    '''
+    if registers is None:
+        return msg
+    values = tuple( (addr, value) for addr, value in msg.values \
+                        if addr in registers )
+    return msg._replace(values=values) if values else None
+
+def _encode_resume_token(*position):
+    return base64.urlsafe_b64encode(json.dumps(position))
+
+def _decode_resume_token(resume_token):
+    '''Decodes, and validates, a resume token.  Raises a
+    `ValidationException` if it's invalid.
+    '''
+    if resume_token is None:
+        return None
+    try:
+        position = json.loads(base64.urlsafe_b64decode(str(resume_token)))
+        kind = position[0]
+        if kind == 'd' and len(position) == 3:
+            return [kind, position[1], objectid.ObjectId(position[2])]
+        elif kind == 'b' and len(position) == 4:
+            return position
+    except (TypeError, ValueError, IndexError, objectid.InvalidId):
+        pass
+    raise jem_exceptions.ValidationException(
+            "Invalid resume token: %r" % resume_token)
+
+def _in_range(t, start_time, end_time):
+    return ((start_time is None or t >= start_time) and
+            (end_time is None or t < end_time))
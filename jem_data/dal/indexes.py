@@ -0,0 +1,86 @@
+'''
+The indexes each collection is expected to have.
+
+Indexes are created along with their collections, but `missing_indexes`
+checks for (and `ensure_all_indexes` creates) any that don't exist, eg - for
+collections created before the index was introduced.  The recordings
+collection's indexes are only created by `ensure_all_indexes`.
+'''
+
+import logging
+
+import pymongo
+
+import jem_data.core.bucketed_archive as bucketed_archive
+import jem_data.core.rollup as rollup
+
+_log = logging.getLogger(__name__)
+
+# Recordings are listed in order of (start_time, _id), most recent first.
+RECORDINGS_INDEXES = [
+    [('status', pymongo.ASCENDING)],
+    [('start_time', pymongo.DESCENDING),
+     ('_id', pymongo.DESCENDING)],
+]
+
+# Of the one-document-per-response archive-<recording_id> collections.
+# Responses are read back in order of (timing_info.end, _id), so both indexes
+# end with those.
+ARCHIVE_INDEXES = [
+    [('device.unit', pymongo.ASCENDING),
+     ('device.gateway.host', pymongo.ASCENDING),
+     ('device.gateway.port', pymongo.ASCENDING),
+     ('table_id', pymongo.ASCENDING),
+     ('timing_info.end', pymongo.ASCENDING),
+     ('_id', pymongo.ASCENDING)],
+    [('timing_info.end', pymongo.ASCENDING),
+     ('_id', pymongo.ASCENDING)],
+]
+
+def expected_indexes(collection_name):
+    '''The list of indexes the named collection should have.  Each index is
+    a list of (field, direction) pairs.
+    '''
+    if collection_name == 'recordings':
+        return RECORDINGS_INDEXES
+    elif collection_name.startswith('archive-buckets-'):
+        return bucketed_archive.INDEXES
+    elif collection_name.startswith('archive-'):
+        return ARCHIVE_INDEXES
+    elif collection_name.startswith('rollup-'):
+        return rollup.INDEXES
+    else:
+        return []
+
+def ensure_indexes(mongo_collection, indexes):
+    for keys in indexes:
+        mongo_collection.ensure_index(keys, background=True)
+
+def missing_indexes(db):
+    '''Returns a list of (collection name, index) pairs of the indexes
+    missing from the database's collections.
+    '''
+    missing = []
+    # The recordings collection's indexes are expected even before it exists.
+    collection_names = set(db.collection_names()) | set(['recordings'])
+    for collection_name in sorted(collection_names):
+        expected = expected_indexes(collection_name)
+        if not expected:
+            continue
+
+        existing = [ list(map(tuple, info['key'])) for info in \
+                        db[collection_name].index_information().values() ]
+        for keys in expected:
+            if keys not in existing:
+                missing.append((collection_name, keys))
+    return missing
+
+def ensure_all_indexes(db):
+    '''Report, and then create, the indexes missing from the database's
+    collections.  Returns the list of indexes that were missing.
+    '''
+    missing = missing_indexes(db)
+    for collection_name, keys in missing:
+        _log.warn("Creating missing index on %s: %r", collection_name, keys)
+        ensure_indexes(db[collection_name], [keys])
+    return missing
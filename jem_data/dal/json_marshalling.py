@@ -2,8 +2,11 @@
 Marshalling json objects for mongo.
 '''
 
+import itertools
+
 import jem_data.core.domain as domain
 import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.messages as messages
 
 def unmarshall_gateway(gw_data):
     try:
@@ -24,10 +27,17 @@ def unmarshall_device(device_data):
             tables=map(unmarshall_table, device_data['tables']))
 
 def unmarshall_table(table_data):
+    polling_data = table_data.get('polling')
     return domain.Table(
             id=table_data['id'],
             label=table_data['label'],
-            registers=map(unmarshall_register, table_data['registers']))
+            registers=map(unmarshall_register, table_data['registers']),
+            polling=polling_data and unmarshall_polling(polling_data))
+
+def unmarshall_polling(polling_data):
+    return domain.Polling(
+            interval=float(polling_data['interval']),
+            adaptive=bool(polling_data.get('adaptive', False)))
 
 def unmarshall_register(register_data):
     return domain.Register(
@@ -45,6 +55,13 @@ def unmarshall_recording(recording_data):
             start_time=recording_data['start_time'],
             end_time=recording_data['end_time'])
 
+def unmarshall_recording_summary(recording_data):
+    return domain.RecordingSummary(
+            id=str(recording_data['_id']),
+            status=recording_data['status'],
+            start_time=recording_data['start_time'],
+            end_time=recording_data['end_time'])
+
 def unmarshall_gateway_recording_config(config_data):
     return domain.GatewayRecordingConfig(
             host=config_data['host'],
@@ -56,4 +73,70 @@ def unmarshall_gateway_recording_config(config_data):
 def unmarshall_device_recording_config(config_data):
     return domain.DeviceRecordingConfig(
             unit=config_data['unit'],
-            table_ids=config_data['table_ids'])
+            table_ids=config_data['table_ids'],
+            polling=dict(
+                (int(table_id), unmarshall_polling(polling_data)) \
+                    for table_id, polling_data in \
+                        config_data.get('polling', {}).items()))
+
+def unmarshall_rollup_bucket(bucket_data):
+    return domain.RollupBucket(
+            table_addr=unmarshall_table_addr(bucket_data),
+            resolution=bucket_data['resolution'],
+            start=bucket_data['start'],
+            end=bucket_data['end'],
+            registers=dict(
+                (int(addr), unmarshall_register_stats(stats_data)) \
+                    for addr, stats_data in \
+                        bucket_data['registers'].items()))
+
+def unmarshall_register_stats(stats_data):
+    return domain.RegisterStats(
+            min=stats_data['min'],
+            max=stats_data['max'],
+            mean=stats_data['mean'],
+            count=stats_data['count'],
+            last=stats_data['last'])
+
+def unmarshall_table_addr(data):
+    '''Unmarshalls the `TableAddr` of an archived response, or bucket of
+    responses.
+    '''
+    device_data = data['device']
+    return domain.TableAddr(
+            device_addr=domain.DeviceAddr(
+                gateway_addr=domain.GatewayAddr(
+                    host=device_data['gateway']['host'],
+                    port=device_data['gateway']['port']),
+                unit=device_data['unit']),
+            id=data['table_id'])
+
+def unmarshall_response(response_data):
+    return messages.ResponseMsg(
+            table_addr=unmarshall_table_addr(response_data),
+            values=tuple(map(tuple, response_data['values'] or ())),
+            timing_info=domain.TimingInfo(
+                start=response_data['timing_info']['start'],
+                end=response_data['timing_info']['end']),
+            error=response_data['error'],
+            request_info=response_data['request_info'])
+
+def unmarshall_archive_bucket(bucket_data, recording_id):
+    '''Returns the list of `ResponseMsg`s stored in a bucket of a bucketed
+    archive.
+    '''
+    table_addr = unmarshall_table_addr(bucket_data)
+    addresses = bucket_data['addresses']
+    columns = [ bucket_data['columns'][str(addr)] for addr in addresses ]
+    request_info = {'recording_id': recording_id}
+
+    return [ messages.ResponseMsg(
+                    table_addr=table_addr,
+                    values=tuple(itertools.izip(addresses, values)),
+                    timing_info=domain.TimingInfo(start, end),
+                    error=None,
+                    request_info=request_info) \
+                for start, end, values in itertools.izip(
+                                bucket_data['start_times'],
+                                bucket_data['end_times'],
+                                itertools.izip(*columns)) ]
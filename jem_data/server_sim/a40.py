@@ -1,9 +1,12 @@
+import array
+import itertools
 import logging
-import random
-import struct
+import os
+import sys
 import time
 
 import pymodbus.datastore as datastore
+import pymodbus.datastore.store as store
 
 import jem_data.diris.registers as diris_registers
 import jem_data.util as util
@@ -12,9 +15,6 @@ _log = logging.getLogger(__name__)
 
 # Some of the registers that we simulate
 _HOUR_METER = 0xC550
-_FREQUENCY = 0xC55E
-_PHASE_CURRENT_1 = 0xC560
-_NEUTRAL_CURRENT = 0xC566
 
 _INITIAL_REGISTER_VALUES = dict((k,0) for k in diris_registers.ALL)
 
@@ -77,13 +77,17 @@ class A40SlaveContext(datastore.context.ModbusSlaveContext):
         _log.debug("setValues[%d] %d:%d" % (fx, address, len(values)))
         self.store[self.decode(fx)].setValues(address, values)
 
-class A40HoldingRegistersDataBlock(datastore.ModbusSparseDataBlock):
+class A40HoldingRegistersDataBlock(store.BaseModbusDataBlock):
     '''A simulated datablock of registers for the Diris A40.
 
-    A convenient subclass of a sparse data block, this transparantly handles
-    the A40's multi-word registers upon initialization.
+    The registers are held in a flat array of 16-bit words, spanning all the
+    A40's register addresses.  Reads are served as slices of the array, and
+    all the register values are re-encoded into it at once (see
+    `util.RegisterDecoder.encode`), transparently handling the A40's
+    multi-word registers.
 
-    It also dynamically updates its values using the twisted reactor.
+    It also dynamically updates its values using the twisted reactor: each
+    second, every register takes one step of a random walk.
     '''
 
     def __init__(self, values=None, dynamic=True):
@@ -91,66 +95,103 @@ class A40HoldingRegistersDataBlock(datastore.ModbusSparseDataBlock):
             values = {}
         assert set(values.keys()) <= set(_ALL_REGISTERS.keys())
 
-        expanded_values = {}
-        addrs = _ALL_REGISTERS.keys()
-        for d in ( self._expand_register_value(addr, values.get(addr, 0)) \
-                        for addr in addrs ):
-            expanded_values.update(d)
+        self.address = _LAYOUT.start
+        self.default_value = 0
+        self._set_register_values(
+                [ values.get(addr, 0) for addr in _LAYOUT.addresses ])
 
-        super(A40HoldingRegistersDataBlock, self).__init__(expanded_values)
+        # Each register's walk starts from zero.
+        self._walk = [0] * len(_LAYOUT.addresses)
+        self._start_time = time.time()
 
         if dynamic:
-            self._last_values = {}
             _log.debug("A40 Register Block initialised with dynamic updating")
             from twisted.internet import task
-            self._start_time = time.time()
             l = task.LoopingCall(self._step)
             l.start(1.0)     # in seconds.
 
-    def _expand_register_value(self, addr, value):
-        '''Returns a dict of register addresses to register values.
-
-        A40 registers can have register values greater than 2 bytes.  In which
-        case the value is split across contiguous registers.
-
-        This function takes a register address; looks up how wide it expects the
-        value to be; and returns a mapping of register addresses to values.
+    def validate(self, address, count=1):
+        '''Whether each of the `count` addresses from `address` is one of
+        the A40's registers.
         '''
-        assert addr in _ALL_REGISTERS
-        width = _ALL_REGISTERS[addr]
-
-        to_return = {}
-        for i, value in enumerate(util.pack_value(value, width)):
-            to_return[addr + i] = value
-
-        return to_return
+        offset = address - _LAYOUT.start
+        if count <= 0 or offset < 0 or offset + count > len(self._words):
+            return False
+        valid = _LAYOUT.valid_before
+        return valid[offset + count] - valid[offset] == count
+
+    def getValues(self, address, count=1):
+        offset = address - _LAYOUT.start
+        return self._words[offset:offset + count].tolist()
+
+    def setValues(self, address, values):
+        if isinstance(values, dict):
+            for addr, value in values.items():
+                self._words[addr - _LAYOUT.start] = value
+        else:
+            if not isinstance(values, list):
+                values = [values]
+            offset = address - _LAYOUT.start
+            self._words[offset:offset + len(values)] = array.array('H', values)
+
+    def _set_register_values(self, values):
+        '''Encode the given values of every register (in address order).'''
+        words = array.array('H')
+        words.fromstring(_LAYOUT.decoder.encode(values))
+        if sys.byteorder == 'little':
+            words.byteswap()
+        self._words = words
 
     def _step(self):
         '''Step to the next set of values in this simulated datablock'''
         elapsed_time = time.time() - self._start_time
-        
-        # The A40 updates its hour meter every 1/100-th of an hour, ie
-        # every 36 seconds.
-        diris_time = int(elapsed_time / 36)
-        self.setValues(_HOUR_METER, self._expand_register_value(_HOUR_METER, diris_time))
-
-        for k in _INITIAL_REGISTER_VALUES:
-            self._update_varying_register(k)
 
-        ##self._update_varying_register(_PHASE_CURRENT_1)
-        ##self._update_varying_register(_FREQUENCY)
-        ##self._update_varying_register(_NEUTRAL_CURRENT)
+        # Each register moves up with probability 1/4, and down with
+        # probability 1/4, within +/- _WALK_LIMIT.
+        moves = bytearray(os.urandom(len(self._walk)).translate(_MOVES))
+        self._walk = [ _NEXT_WALK_VALUES[value][move] \
+                            for value, move in itertools.izip(self._walk,
+                                                              moves) ]
 
-    def _update_varying_register(self, addr):
-        if addr not in self._last_values:
-            self._last_values[addr] = 0
-        else:
-            p = random.randint(0,100)
-            if p < 25:
-                self._last_values[addr] = min(100, self._last_values[addr]+1)
-            elif p < 50:
-                self._last_values[addr] = max(-100, self._last_values[addr]-1)
+        # The A40 updates its hour meter every 1/100-th of an hour, ie
+        # every 36 seconds.
+        values = list(self._walk)
+        values[_LAYOUT.index[_HOUR_METER]] = int(elapsed_time / 36)
+        self._set_register_values(values)
 
-        self.setValues(addr,
-                       self._expand_register_value(addr, self._last_values[addr]))
+class _RegisterLayout(object):
+    '''Where each of a device's registers lies within a flat array of words
+    spanning all their addresses.
+    '''
 
+    def __init__(self, registers):
+        self.addresses = sorted(registers)
+        self.index = dict( (addr, i) for i, addr in enumerate(self.addresses) )
+        self.start = self.addresses[0]
+        end = max( addr + width for addr, width in registers.items() )
+
+        widths = [ registers[addr] for addr in self.addresses ]
+        offsets = [ addr - self.start for addr in self.addresses ]
+        self.decoder = util.RegisterDecoder(end - self.start, offsets, widths)
+
+        # The number of valid addresses before each offset, so that checking
+        # a range of addresses is a subtraction.
+        valid = [0] * (end - self.start)
+        for offset, width in zip(offsets, widths):
+            valid[offset:offset + width] = [1] * width
+        self.valid_before = [0]
+        for v in valid:
+            self.valid_before.append(self.valid_before[-1] + v)
+
+_LAYOUT = _RegisterLayout(_ALL_REGISTERS)
+
+_WALK_LIMIT = 100
+
+# Maps each random byte to a move: 0 (down), 1 (stay) or 2 (up).
+_MOVES = ''.join(chr(2 if b < 64 else 0 if b < 128 else 1) \
+                    for b in xrange(256))
+
+# For each value of a walk, the value after each move.
+_NEXT_WALK_VALUES = dict(
+        (v, (max(-_WALK_LIMIT, v - 1), v, min(_WALK_LIMIT, v + 1))) \
+            for v in xrange(-_WALK_LIMIT, _WALK_LIMIT + 1) )
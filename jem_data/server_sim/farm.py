@@ -0,0 +1,206 @@
+"""Run a farm of simulated Dirus gateways, described by a fixtures file.
+
+Every gateway of the fixtures file (eg - device-fixtures-with-sim.json) on a
+local host is simulated, on its own port, with an A40 for each of its devices,
+all in a single reactor.  Or, `generate` writes out a fixtures file of any
+number of gateways and units, to simulate (and to configure the system with).
+
+Usage:
+    farm.py [--fixtures=<file>]
+            [--interface=<interface>]
+            [--latency=<latency>]
+            [--serial]
+            [--timeout-rate=<rate>]
+            [--timeout=<timeout>]
+            [--exception-rate=<rate>]
+            [--exception-code=<code>]
+    farm.py generate --gateways=<gateways> --units=<units>
+                     [--host=<host>]
+                     [--base-port=<port>]
+
+Options
+    --fixtures=<file>           the gateways to simulate
+                                [default: device-fixtures-with-sim.json]
+    --interface=<interface>     the interface to listen on, rather than each
+                                gateway's own host.
+    --latency=<latency>         how long each request takes to answer, in
+                                seconds, as one of: constant:<seconds>,
+                                uniform:<min>,<max>, normal:<mean>,<stddev>
+                                or exponential:<mean>
+                                [default: constant:0]
+    --serial                    answer each gateway's requests one at a time,
+                                as over the RS-485 bus of a real gateway.
+    --timeout-rate=<rate>       the fraction of requests left unanswered
+                                [default: 0]
+    --timeout=<timeout>         how long, in seconds, an unanswered request
+                                holds up the bus [default: 1.0]
+    --exception-rate=<rate>     the fraction of requests answered with a
+                                modbus exception [default: 0]
+    --exception-code=<code>     the modbus exception code to answer with
+                                [default: 6]
+    --gateways=<gateways>       the number of gateways to generate
+    --units=<units>             the number of units on each gateway
+    --host=<host>               the generated gateways' host
+                                [default: 127.0.0.1]
+    --base-port=<port>          the first gateway's port, with each other
+                                gateway on the next port along
+                                [default: 5020]
+
+A gateway in the fixtures file may override the command line's options with a
+"simulation" object, of any of "latency", "serial", "timeout_rate", "timeout",
+"exception_rate" and "exception_code".  Eg:
+
+    "simulation": {"latency": "normal:0.02,0.005", "serial": true}
+"""
+import json
+import logging
+import random
+import sys
+
+import docopt
+
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.device import ModbusDeviceIdentification
+
+import jem_data.server_sim.a40 as a40
+import jem_data.server_sim.tcp_gateway as tcp_gateway
+
+logging.basicConfig()
+_log = logging.getLogger()
+_log.setLevel(logging.INFO)
+
+_LOCAL_HOSTS = ('localhost', '0.0.0.0', '')
+
+# The most units the system accepts on a gateway.
+_MAX_UNITS = 31
+
+def latency_distribution(spec):
+    '''Returns a function sampling the latency distribution described by the
+    given spec (see the usage).
+
+    Raises a `ValueError` if the spec can't be understood.
+    '''
+    name, _, params = spec.partition(':')
+    try:
+        params = map(float, params.split(',')) if params else []
+        if name == 'constant':
+            [seconds] = params
+            return None if seconds == 0 else lambda: seconds
+        elif name == 'uniform':
+            low, high = params
+            return lambda: random.uniform(low, high)
+        elif name == 'normal':
+            mean, stddev = params
+            return lambda: max(0.0, random.normalvariate(mean, stddev))
+        elif name == 'exponential':
+            [mean] = params
+            return lambda: random.expovariate(1.0 / mean)
+    except ValueError:
+        pass
+    raise ValueError("Can't understand latency: %r" % spec)
+
+def behaviour(defaults, simulation=None):
+    '''The `GatewayBehaviour` of a gateway, from the given defaults, with any
+    overrides of the fixture's "simulation" object.
+    '''
+    settings = dict(defaults)
+    settings.update(simulation or {})
+    return tcp_gateway.GatewayBehaviour(
+            latency=latency_distribution(settings['latency']),
+            serial=bool(settings['serial']),
+            timeout_rate=float(settings['timeout_rate']),
+            timeout=float(settings['timeout']),
+            exception_rate=float(settings['exception_rate']),
+            exception_code=int(settings['exception_code']))
+
+def generate(gateways, units, host, base_port):
+    '''Returns the fixtures of the given number of gateways, each of the given
+    number of A40 units.
+    '''
+    if not 0 < units <= _MAX_UNITS:
+        raise ValueError("Expected between 1 and %d units" % _MAX_UNITS)
+    return [ {
+                'host': host,
+                'port': base_port + i,
+                'label': 'Simulated Gateway %d' % (i + 1),
+                'devices': [ {
+                                'type': 'diris.a40',
+                                'unit': unit,
+                                'label': None,
+                             } for unit in xrange(1, units + 1) ],
+             } for i in xrange(gateways) ]
+
+def is_local(host):
+    return host in _LOCAL_HOSTS or host.startswith('127.')
+
+def start(fixtures, defaults, interface=None):
+    '''Simulate the local gateways of the given fixtures, and run the reactor.
+    '''
+    from twisted.internet import reactor
+
+    identity = ModbusDeviceIdentification()
+    identity.VendorName  = 'Socomec'
+    identity.ProductName = 'Dirus'
+    identity.ModelName   = 'A40'
+
+    simulated = 0
+    for gateway in fixtures:
+        if interface is None and not is_local(gateway['host']):
+            _log.info("Not simulating %s:%d, as it's not local",
+                      gateway['host'], gateway['port'])
+            continue
+
+        slaves = {}
+        for device in gateway['devices']:
+            if device['type'] != 'diris.a40':
+                _log.warn("Can't simulate %s unit %d of %s:%d",
+                          device['type'], device['unit'],
+                          gateway['host'], gateway['port'])
+                continue
+            slaves[device['unit']] = a40.create()
+
+        tcp_gateway.listen(
+                ModbusServerContext(slaves=slaves, single=False),
+                identity=identity,
+                address=(interface or gateway['host'], gateway['port']),
+                behaviour=behaviour(defaults, gateway.get('simulation')))
+        simulated += 1
+
+    _log.info("Simulating %d gateways", simulated)
+    reactor.run()
+
+def _validate_args(raw_args):
+    args = {}
+    if raw_args['generate']:
+        args['gateways'] = int(raw_args['--gateways'])
+        args['units'] = int(raw_args['--units'])
+        args['host'] = raw_args['--host']
+        args['base_port'] = int(raw_args['--base-port'])
+        return args
+
+    args['fixtures'] = raw_args['--fixtures']
+    args['interface'] = raw_args['--interface']
+    args['defaults'] = {
+        'latency': raw_args['--latency'],
+        'serial': raw_args['--serial'],
+        'timeout_rate': raw_args['--timeout-rate'],
+        'timeout': raw_args['--timeout'],
+        'exception_rate': raw_args['--exception-rate'],
+        'exception_code': raw_args['--exception-code'],
+    }
+    # Fail early on a bad option.
+    behaviour(args['defaults'])
+    return args
+
+def main(raw_args):
+    args = _validate_args(raw_args)
+    if raw_args['generate']:
+        json.dump(generate(**args), sys.stdout, indent=2)
+        print
+    else:
+        with open(args['fixtures']) as f:
+            fixtures = json.load(f)
+        start(fixtures, args['defaults'], args['interface'])
+
+if __name__ == '__main__':
+    main(docopt.docopt(__doc__))
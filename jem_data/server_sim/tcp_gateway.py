@@ -1,34 +1,151 @@
+import collections
 import logging
+import random
 
 import twisted.protocols.policies as policies
 
+import pymodbus.pdu as pdu
 import pymodbus.transaction as transaction
 import pymodbus.server.async as async
 import pymodbus.internal.ptwisted as ptwisted
 
 _log = logging.getLogger(__name__)
 
-def start(context, identity=None, address=None, console=False):
+GatewayBehaviour = collections.namedtuple(
+        'GatewayBehaviour',
+        'latency serial timeout_rate timeout exception_rate exception_code')
+
+## Answers every request straight away, and concurrently.
+IMMEDIATE = GatewayBehaviour(
+        latency=None,
+        serial=False,
+        timeout_rate=0.0,
+        timeout=1.0,
+        exception_rate=0.0,
+        exception_code=pdu.ModbusExceptions.SlaveBusy)
+
+def start(context, identity=None, address=None, console=False,
+          behaviour=IMMEDIATE):
     ''' Helper method to start the Modbus Async TCP server
 
     :param context: The server data context
     :param identify: The server identity to use (default empty)
     :param address: An optional (interface, port) to bind to.
     :param console: A flag indicating if you want the debug console
+    :param behaviour: How the simulated gateway behaves (see `listen`)
+    '''
+    from twisted.internet import reactor
+
+    factory = listen(context, identity, address, behaviour)
+    if console: ptwisted.InstallManagementConsole({'factory': factory})
+    reactor.run()
+
+def listen(context, identity=None, address=None, behaviour=IMMEDIATE):
+    '''Listen for connections to a simulated gateway, without running the
+    reactor.  So that many gateways can share one reactor.
+
+    The `GatewayBehaviour` says how the gateway answers requests:
+
+      - `latency` is a function returning how many seconds to take over each
+        request (or None, to answer immediately).
+      - If `serial`, requests are answered one at a time, as if passed over
+        the single RS-485 bus behind a real gateway.  Otherwise they're
+        answered concurrently.
+      - A fraction `timeout_rate` of requests go unanswered, holding the bus
+        for `timeout` seconds.
+      - A fraction `exception_rate` of requests are answered with the modbus
+        exception `exception_code`.
+
+    Returns the server's factory.
     '''
     from twisted.internet import reactor
 
     address = address or ("", 502)
     framer  = transaction.ModbusSocketFramer
-    factory = _GatewayServerFactory(context, framer, identity)
-    if console: ptwisted.InstallManagementConsole({'factory': factory})
+    factory = _GatewayServerFactory(context, framer, identity, behaviour)
 
     _log.info("Starting Dirus Gateway Server on %s:%s" % address)
     reactor.listenTCP(address[1], factory, interface=address[0])
-    reactor.run()
+    return factory
 
 class _GatewayServerFactory(async.ModbusServerFactory,
                             policies.LimitTotalConnectionsFactory, object):
 
     connectionLimit = 4
 
+    def __init__(self, store, framer=None, identity=None,
+                 behaviour=IMMEDIATE):
+        async.ModbusServerFactory.__init__(self, store, framer, identity)
+        if behaviour != IMMEDIATE:
+            self.protocol = _SimulatedGatewayProtocol
+            self.bus = _Bus(behaviour)
+
+class _SimulatedGatewayProtocol(async.ModbusTcpProtocol):
+    '''Passes requests over the gateway's bus, rather than answering them
+    immediately.
+    '''
+
+    def _execute(self, request):
+        self.factory.bus.submit(self, request)
+
+    def respond(self, request, exception_code=None):
+        if exception_code is None:
+            async.ModbusTcpProtocol._execute(self, request)
+        else:
+            response = request.doException(exception_code)
+            response.transaction_id = request.transaction_id
+            response.unit_id = request.unit_id
+            self._send(response)
+
+class _Bus(object):
+    '''The bus between a gateway and its devices, over which requests take
+    some time to answer, and sometimes fail.
+    '''
+
+    def __init__(self, behaviour, clock=None, random=random.random):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._behaviour = behaviour
+        self._clock = clock
+        self._random = random
+        self._pending = collections.deque()
+        self._busy = False
+
+    def submit(self, protocol, request):
+        if not self._behaviour.serial:
+            self._answer(protocol, request)
+            return
+
+        self._pending.append((protocol, request))
+        if not self._busy:
+            self._answer_next()
+
+    def _answer_next(self):
+        if not self._pending:
+            self._busy = False
+            return
+        self._busy = True
+        protocol, request = self._pending.popleft()
+        self._answer(protocol, request, then=self._answer_next)
+
+    def _answer(self, protocol, request, then=None):
+        behaviour = self._behaviour
+        p = self._random()
+        if p < behaviour.timeout_rate:
+            _log.debug("Timing out request %d", request.transaction_id)
+            respond = None
+            duration = behaviour.timeout
+        else:
+            if p < behaviour.timeout_rate + behaviour.exception_rate:
+                exception_code = behaviour.exception_code
+            else:
+                exception_code = None
+            respond = lambda: protocol.respond(request, exception_code)
+            duration = behaviour.latency() if behaviour.latency else 0.0
+
+        def finish():
+            if respond is not None:
+                respond()
+            if then is not None:
+                then()
+        self._clock.callLater(duration, finish)
@@ -1,14 +1,20 @@
+import collections
 import multiprocessing
+import os
 import threading
 import time
 
-import pymongo
-
+import jem_data.analysis.downsampling as downsampling
+import jem_data.core.bucketed_archive as bucketed_archive
 import jem_data.core.domain as domain
 import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.latest_values as latest_values
 import jem_data.core.mongo_sink as mongo_sink
+import jem_data.core.rollup as rollup
+import jem_data.core.spool as spool
 import jem_data.core.table_reader as table_reader
 import jem_data.core.table_request_manager as table_request_manager
+import jem_data.core.wire as wire
 import jem_data.dal as dal
 import jem_data.diris as diris
 
@@ -20,6 +26,21 @@ mongo_config=mongo_sink.MongoConfig(
         port=27017,
         database='jem-data')
 
+## How each recording's archive is stored: either 'documents' (one per
+## response, in archive-<recording_id>), or 'buckets' (see
+## `bucketed_archive`, in archive-buckets-<recording_id>).
+archive_layout = 'documents'
+
+## Where the mongo sink spools responses whilst mongo is unreachable (see
+## `spool`).  If None, they're dropped instead.
+spool_directory = os.path.expanduser('~/.jem-data/spool')
+
+## The gateways read from, and how many reader processes each has.
+READER_PROCESSES = {
+    domain.GatewayAddr(host="127.0.0.1", port=5020): 2,
+    domain.GatewayAddr(host="192.168.0.101", port=502): 4,
+}
+
 class SystemControlService(object):
     """
     The service level api.
@@ -27,16 +48,49 @@ class SystemControlService(object):
     Use an instance of this class to control the system's behaviour.
     """
 
-    def __init__(self, db=None):
+    def __init__(self, db=None, reader_processes=None,
+                 connect_sink=mongo_sink.connect):
         self._status_lock = threading.RLock()
         self._table_request_manager = None
+        self._system = None
         self._db = db or dal.DataAccessLayer(mongo_config)
+        self._reader_processes = reader_processes
+        self._connect_sink = connect_sink
+        self._latest_values = latest_values.LatestValues()
+        self._sink_stats = mongo_sink.SinkStats()
         self._status = {'running': False,
                         'active_recordings': []}
 
     def setup(self):
-        self._table_request_manager =  _setup_system()
+        self._system = _setup_system(self._latest_values,
+                                     self._sink_stats,
+                                     self._reader_processes,
+                                     self._connect_sink)
+        self._table_request_manager = self._system.manager
         self._db.recordings.cleanup_recordings()
+        self._db.ensure_indexes()
+
+    def shutdown(self):
+        '''Stops all the processes started by `setup()`.'''
+        if self._system is None:
+            return
+        for processes in self._system.processes.values():
+            for p in processes:
+                p.terminate()
+        for processes in self._system.processes.values():
+            for p in processes:
+                p.join()
+        self._system = None
+        self._table_request_manager = None
+
+    @property
+    def stage_processes(self):
+        '''The `Process`es of each stage of the system ('manager', 'readers'
+        and 'sink'), once set up.
+        '''
+        if self._system is None:
+            return {}
+        return self._system.processes
 
     def start_recording(self, recording_config):
         '''Create a new recording, and start running it.
@@ -48,6 +102,8 @@ class SystemControlService(object):
                     "Currently running: %s" % (
                         self._status['active_recordings']))
 
+            self._validate_recording_config(recording_config)
+
             chosen_gateways = dict(
                 ((g.host, g.port), g) \
                         for g in recording_config.gateway_recording_configs)
@@ -73,9 +129,11 @@ class SystemControlService(object):
                             chosen_device = chosen_devices[device.unit]
 
                             chosen_tables = set(chosen_device.table_ids)
-                            active_tables = filter(
-                                lambda t: t.id in chosen_tables,
-                                device.tables)
+                            active_tables = [
+                                t._replace(polling=chosen_device.polling.get(
+                                                        t.id, t.polling)) \
+                                    for t in device.tables \
+                                        if t.id in chosen_tables ]
 
                             new_device = device._replace(tables=active_tables)
                             devices.append(new_device)
@@ -127,22 +185,88 @@ class SystemControlService(object):
         '''
         return self._db.gateways.all()
 
-    def all_recordings(self):
-        '''List of all recordings.  Sorted by start date.'''
-        return sorted(self._db.recordings.all(),
-                      key=lambda r: r.start_time,
-                      reverse=True)
+    def attached_gateways_etag(self):
+        '''An entity tag for the `attached_gateways()`, which changes
+        whenever they do.  This is cached, along with the gateways.
+        '''
+        return self._db.gateways.etag()
+
+    def all_recordings(self, limit=None, before_start_time=None,
+                       before_id=None, summary=False):
+        '''List of recordings, most recently started first.
+
+        See `RecordingsRepository.all` for paging through them.
+        '''
+        return self._db.recordings.all(limit=limit,
+                                       before_start_time=before_start_time,
+                                       before_id=before_id,
+                                       summary=summary)
 
     def get_recording(self, recording_id):
         '''Return the recording if it exists, otherwise None'''
         return self._db.recordings.by_id(recording_id)
 
+    def recording_data(self, recording_id, resume_token=None, **filters):
+        '''Returns an iterator of (resume_token, `ResponseMsg`) pairs of the
+        responses recorded, or None if there's no such recording.
+
+        See `dal.ArchiveRepository.resumable_responses` for the filters, and
+        how to resume.
+        '''
+        if self.get_recording(recording_id) is None:
+            return None
+        return self._db.archive.resumable_responses(recording_id,
+                                                    resume_token=resume_token,
+                                                    **filters)
+
+    def register_series(self, recording_id, register, host, port, unit,
+                        max_points, method='lttb', **filters):
+        '''Returns the recorded (time, value) series of the given device's
+        register, downsampled to at most `max_points`, along with the number
+        of points recorded.  Or None if there's no such recording.
+
+        The series is timed by the end of each read.  See
+        `downsampling.downsample`, and `dal.ArchiveRepository` for the other
+        filters.
+        '''
+        if self.get_recording(recording_id) is None:
+            return None
+
+        points = sorted(self._db.archive.register_values(recording_id,
+                                                         register,
+                                                         host=host,
+                                                         port=port,
+                                                         unit=unit,
+                                                         **filters))
+
+        return (downsampling.downsample(points, max_points, method),
+                len(points))
+
+    def latest_values(self):
+        '''The current sequence number, and the list of the
+        `latest_values.LatestValue` of each register read.
+        '''
+        return self._latest_values.snapshot()
+
+    def latest_value_changes(self, seq, timeout=None):
+        '''Waits up to `timeout` seconds for register values to change after
+        the given sequence number.  See `LatestValues.changes_since`.
+        '''
+        return self._latest_values.changes_since(seq, timeout)
+
     @property
     def status(self):
         '''Return's the system's current status'''
         with self._status_lock:
             d = self._status.copy()
         d.update({'now': time.time()})
+        manager = self._table_request_manager
+        if manager is not None and manager.stats is not None:
+            d.update({'gateways': manager.stats.snapshot()})
+        d.update({'sink': self._sink_stats.snapshot()})
+        if self._system is not None:
+            d.update({'results_queue_depth':
+                            self._system.results_queue.qsize()})
         return d
 
     def update_gateways(self, gateways):
@@ -157,6 +281,14 @@ class SystemControlService(object):
         self._db.gateways.insert(gateways)
         return self.attached_gateways()
 
+    def _validate_recording_config(self, recording_config):
+        for gateway_config in recording_config.gateway_recording_configs:
+            for device_config in gateway_config.device_recording_configs:
+                for polling in device_config.polling.values():
+                    if not polling.interval > 0:
+                        raise ValidationException, \
+                                "Expected polling interval to be positive"
+
     def _validate_device(self, device):
         if not isinstance(device.unit, int):
             raise ValidationException, "Expected unit to be an integer"
@@ -173,56 +305,83 @@ class SystemControlService(object):
         for device in gateway.devices:
             self._validate_device(device)
 
-def _setup_system():
+def _setup_system(latest_value_store, sink_stats,
+                  reader_processes=None, connect=mongo_sink.connect):
+    '''Starts the readers of each gateway in `reader_processes` (the
+    configured ones, by default), the table request manager, and the mongo
+    sink, which connects to mongo with `connect(mongo_config)`.
+
+    Returns a `_System`.
+    '''
+    if reader_processes is None:
+        reader_processes = READER_PROCESSES
+
     ## Where results end up (fed to monog sink)
     results_queue = multiprocessing.Queue()
 
-    local_gateway = domain.GatewayAddr(
-            host="127.0.0.1",
-            port=5020)
-    local_request_queue = multiprocessing.Queue()
+    ## Where the mongo sink sends the latest value of each register
+    latest_queue = multiprocessing.Queue()
+    latest_values.start_consumer(latest_queue, latest_value_store)
 
-    remote_gateway = domain.GatewayAddr(
-            host="192.168.0.101",
-            port=502)
-    remote_request_queue = multiprocessing.Queue()
+    ## Where the readers report back to the table request manager
+    feedback_queue = multiprocessing.Queue()
 
-    table_reader.start_readers(
-            local_gateway,
-            local_request_queue,
-            results_queue,
-            number_processes=2)
+    ## Responses are passed from the readers to the mongo sink encoded
+    codec = wire.ResponseCodec(reader_processes.keys())
 
-    table_reader.start_readers(
-            remote_gateway,
-            remote_request_queue,
-            results_queue,
-            number_processes=4)
+    readers_out_q = wire.EncodingQueue(results_queue, codec)
+    sink_in_q = wire.DecodingQueue(results_queue, codec)
 
-    qs = {
-            local_gateway: local_request_queue,
-            remote_gateway: remote_request_queue
-    }
+    qs = {}
+    for gateway, number_processes in reader_processes.items():
+        qs[gateway] = table_reader.start_readers(
+                gateway,
+                readers_out_q,
+                number_processes=number_processes,
+                feedback_q=feedback_queue)
 
-    manager = table_request_manager.start_manager(qs)
+    manager = table_request_manager.start_manager(qs, feedback_queue)
 
-    _setup_mongo_collections()
+    _setup_mongo_collections(connect(mongo_config))
+
+    if archive_layout == 'buckets':
+        collection_names = ['realtime']
+        bucketed_collection_names = [bucketed_archive.DEFAULT_COLLECTION_NAME]
+    else:
+        collection_names = ['archive-{recording_id}', 'realtime']
+        bucketed_collection_names = []
 
     mongo_writer = multiprocessing.Process(
             target=mongo_sink.mongo_writer,
-            args=(results_queue, ['archive-{recording_id}', 'realtime'], mongo_config))
+            args=(sink_in_q,
+                  collection_names,
+                  mongo_config),
+            kwargs={'rollups': rollup.Rollup(),
+                    'bucketed_collection_names': bucketed_collection_names,
+                    'latest_q': latest_queue,
+                    'spool': spool.Spool(spool_directory) \
+                                if spool_directory is not None else None,
+                    'sink_stats': sink_stats,
+                    'connect': connect})
 
     mongo_writer.start()
 
-    return manager
-    
-def _setup_mongo_collections():
-    connection = pymongo.MongoClient(mongo_config.host, mongo_config.port)
-    db = connection[mongo_config.database]
+    return _System(
+            manager=manager,
+            processes={
+                'manager': [manager],
+                'readers': [ p for q in qs.values() for p in q.processes ],
+                'sink': [mongo_writer],
+            },
+            results_queue=results_queue)
 
+_System = collections.namedtuple(
+        '_System',
+        'manager processes results_queue')
+
+def _setup_mongo_collections(db):
     if 'archive' not in db.collection_names():
         db.create_collection('archive')
 
     if 'realtime' not in db.collection_names():
         db.create_collection('realtime', size=1024*1024*100, capped=True, max=100)
-
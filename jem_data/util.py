@@ -1,3 +1,5 @@
+import collections
+import functools
 import struct
 
 def deep_asdict(o):
@@ -16,6 +18,21 @@ _REGISTER_TYPES = {
     4: 'q',     # Signed long long
 }
 
+def register_format(width):
+    '''The `struct` format character of a register value of the given width
+    (in 16-bit registers).
+    '''
+    try:
+        return _REGISTER_TYPES[width]
+    except KeyError:
+        raise ValueError("Unsupported register width: %d" % width)
+
+_VALUE_STRUCTS = dict( (width, struct.Struct('>' + value_type)) \
+                            for width, value_type in _REGISTER_TYPES.items() )
+
+_WORD_STRUCTS = dict( (width, struct.Struct('>%dH' % width)) \
+                            for width in _REGISTER_TYPES )
+
 def unpack_values(values):
     '''Unpacks the given values into a single value.
 
@@ -24,16 +41,78 @@ def unpack_values(values):
              reading the whole as a big-endian  2's complement value (of the
              approprate width) 
     '''
-    value_bytes = ''.join( struct.pack('>H', v) for v in values )
-    return_type = _REGISTER_TYPES[len(values)]
-
-    return struct.unpack('>' + return_type,
-                         value_bytes)[0]
+    width = len(values)
+    return _VALUE_STRUCTS[width].unpack(_WORD_STRUCTS[width].pack(*values))[0]
 
 def pack_value(value, width):
     '''Pack the given value as a list of 16-bit unsigned shorts.'''
-    value_type = _REGISTER_TYPES[width]
-    byte_string = struct.pack('>' + value_type, value)
+    return list(_WORD_STRUCTS[width].unpack(_VALUE_STRUCTS[width].pack(value)))
+
+class RegisterDecoder(object):
+    '''Decodes a whole response's worth of 16-bit register values at once.
+
+    The layout of the registers within the response is compiled into a single
+    `struct` format up front, skipping over any unrequested registers.  So
+    decoding a response is one pack of its register values, followed by one
+    unpack of every requested value.
+    '''
+
+    __slots__ = ('count', '_words', '_values')
+
+    def __init__(self, count, offsets, widths):
+        layout = ['>']
+        position = 0
+        for offset, width in zip(offsets, widths):
+            if offset < position:
+                raise ValueError("Overlapping registers at offset %d" % offset)
+            if offset > position:
+                layout.append('%dx' % (2 * (offset - position)))
+            layout.append(register_format(width))
+            position = offset + width
+
+        if position > count:
+            raise ValueError("Registers extend beyond %d registers" % count)
+        if position < count:
+            layout.append('%dx' % (2 * (count - position)))
+
+        self.count = count
+        self._words = struct.Struct('>%dH' % count)
+        self._values = struct.Struct(''.join(layout))
+
+    def decode(self, register_values):
+        '''Returns a tuple of the decoded values, in the order given to the
+        constructor.
+
+        :param register_values: the `count` 16-bit unsigned integers of the
+                                response.
+        '''
+        return self._values.unpack(self._words.pack(*register_values))
+
+    def encode(self, values):
+        '''The inverse of `decode`: returns the `count` 16-bit registers
+        holding the given values (with any gaps between them zeroed), packed
+        big-endian, as they'd be sent over the wire.
+        '''
+        return self._values.pack(*values)
+
+def lru_cache(maxsize=128):
+    '''Memoize a function of hashable, positional arguments, keeping at most
+    `maxsize` of the most recently used results.
+    '''
+    def decorator(f):
+        cache = collections.OrderedDict()
+
+        @functools.wraps(f)
+        def wrapper(*args):
+            try:
+                result = cache.pop(args)
+            except KeyError:
+                result = f(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = result
+            return result
 
-    return [ struct.unpack('>H', byte_string[2*i : 2*i+2])[0] \
-                    for i in xrange(width) ]
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
@@ -0,0 +1,37 @@
+import nose.tools as nose
+
+import jem_data.analysis.downsampling as downsampling
+
+def test_short_series_are_left_alone():
+    points = [(0, 1), (1, 2), (2, 3)]
+    for method in downsampling.METHODS:
+        nose.assert_equal(downsampling.downsample(points, 3, method), points)
+
+def test_lttb_keeps_the_end_points_and_the_peaks():
+    points = [ (t, 0) for t in range(100) ]
+    points[37] = (37, 50)
+    points[71] = (71, -50)
+
+    sampled = downsampling.lttb(points, 10)
+
+    nose.assert_equal(len(sampled), 10)
+    nose.assert_equal(sampled[0], (0, 0))
+    nose.assert_equal(sampled[-1], (99, 0))
+    nose.assert_in((37, 50), sampled)
+    nose.assert_in((71, -50), sampled)
+    nose.assert_equal(sampled, sorted(sampled))
+
+def test_min_max_keeps_each_intervals_extremes_in_time_order():
+    points = [(0, 5), (1, 9), (2, 1), (3, 4),
+              (4, 2), (5, 2), (6, 8), (7, 3)]
+
+    nose.assert_equal(downsampling.min_max(points, 4),
+                      [(1, 9), (2, 1), (4, 2), (6, 8)])
+
+def test_min_max_of_a_constant_interval():
+    points = [ (t, 1) for t in range(10) ]
+    nose.assert_equal(downsampling.min_max(points, 4), [(0, 1), (5, 1)])
+
+@nose.raises(ValueError)
+def test_unknown_method():
+    downsampling.downsample([(0, 1)], 10, 'average')
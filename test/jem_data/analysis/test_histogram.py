@@ -0,0 +1,103 @@
+import json
+import pickle
+import random
+
+import nose.tools as nose
+
+from jem_data.analysis.histogram import LatencyHistogram, moods_quantile
+
+def test_percentiles_are_within_the_precision():
+    rng = random.Random(7)
+    values = sorted( rng.expovariate(1 / 0.02) for _ in xrange(10000) )
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    for p in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * p / 100.0) - 1]
+        nose.assert_almost_equal(histogram.percentile(p), exact,
+                                 delta=exact / 1000.0 + 1e-6)
+    nose.assert_equal(histogram.percentile(100), values[-1])
+    nose.assert_equal(histogram.max, values[-1])
+    nose.assert_equal(histogram.count, 10000)
+    nose.assert_almost_equal(histogram.mean, sum(values) / len(values))
+
+def test_memory_depends_on_the_range_not_the_count():
+    histogram = LatencyHistogram()
+    for _ in xrange(100):
+        for i in xrange(1, 1000):
+            histogram.record(i * 0.01)
+    # 3 significant figures over 10ms to 10s.
+    nose.assert_less(len(histogram._counts), 11 * 1024)
+
+def test_merged_histogram_is_the_histogram_of_all_values():
+    values = [ 0.001 * i for i in range(1, 200) ]
+    a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, value in enumerate(values):
+        (a if i % 3 else b).record(value)
+        both.record(value)
+
+    a.merge(b)
+    nose.assert_equal(a.asdict(), both.asdict())
+
+def test_can_only_merge_histograms_of_the_same_precision():
+    with nose.assert_raises(ValueError):
+        LatencyHistogram().merge(LatencyHistogram(significant_figures=2))
+
+def test_empty_histogram_has_no_percentiles():
+    histogram = LatencyHistogram()
+    nose.assert_is_none(histogram.percentile(50))
+    nose.assert_is_none(histogram.mean)
+
+def test_survives_json_and_pickling():
+    histogram = LatencyHistogram()
+    for value in (0.0005, 0.0123, 1.5):
+        histogram.record(value)
+
+    for copy in (
+            LatencyHistogram.fromdict(json.loads(json.dumps(histogram.asdict()))),
+            pickle.loads(pickle.dumps(histogram, pickle.HIGHEST_PROTOCOL))):
+        nose.assert_equal(copy.asdict(), histogram.asdict())
+        nose.assert_equal(copy.percentile(50), histogram.percentile(50))
+
+def test_moods_quantile_tells_apart_shifted_percentiles():
+    rng = random.Random(3)
+    a, b, c = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for _ in xrange(500):
+        a.record(rng.normalvariate(0.050, 0.005))
+        b.record(rng.normalvariate(0.050, 0.005))
+        c.record(rng.normalvariate(0.052, 0.005))
+
+    nose.assert_greater(moods_quantile(a, b, 50), 0.05)
+    nose.assert_less(moods_quantile(a, c, 50), 0.001)
+    nose.assert_equal(moods_quantile(a, a, 50), 1.0)
+    nose.assert_is_none(moods_quantile(a, LatencyHistogram(), 50))
+    # Only about one value of the thousand is expected above the p99.9.
+    nose.assert_is_none(moods_quantile(a, c, 99.9))
+
+def test_moods_quantile_tells_apart_tails_of_the_same_bulk():
+    rng = random.Random(3)
+    a, b = LatencyHistogram(), LatencyHistogram()
+    for i in xrange(2000):
+        a.record(rng.normalvariate(0.050, 0.005))
+        # The same, except one in fifty values is twice as slow.
+        b.record(rng.normalvariate(0.050, 0.005) * (2 if i % 50 == 0 else 1))
+
+    nose.assert_greater(moods_quantile(a, b, 50), 0.05)
+    nose.assert_less(moods_quantile(a, b, 99), 0.001)
+
+def test_moods_quantile_rarely_tells_apart_the_same_distribution():
+    rng = random.Random(3)
+    false_positives = dict( (p, 0) for p in (50, 99, 99.9) )
+    for _ in xrange(100):
+        a, b = LatencyHistogram(), LatencyHistogram()
+        for _ in xrange(2000):
+            a.record(rng.expovariate(100))
+            b.record(rng.expovariate(100))
+        for p in false_positives:
+            p_value = moods_quantile(a, b, p)
+            if p_value is not None and p_value < 0.05:
+                false_positives[p] += 1
+
+    for p, count in false_positives.items():
+        nose.assert_less_equal(count, 10, "p%g" % p)
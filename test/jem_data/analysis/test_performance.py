@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+import nose.tools as nose
+
+import jem_data.analysis.performance as performance
+from jem_data.analysis.histogram import LatencyHistogram
+from jem_data.diris import registers
+
+def test_summary_merges_the_clients_latencies():
+    summary = performance._summarise(_result())
+
+    nose.assert_equal(summary['requests'], 100)
+    nose.assert_equal(summary['errors'], 3)
+    nose.assert_almost_equal(summary['throughput'], 103 / 2.0)
+    percentiles = dict(summary['percentiles'])
+    nose.assert_almost_equal(percentiles[50], 0.050, delta=0.0001)
+    nose.assert_almost_equal(percentiles[99], 0.099, delta=0.0001)
+    nose.assert_equal(summary['max'], 0.1)
+
+def test_writes_the_results_as_json():
+    target_dir = tempfile.mkdtemp()
+    try:
+        performance._write_results([_result()], target_dir)
+        [filename] = os.listdir(target_dir)
+        nose.assert_regexp_matches(filename, r'^performance-\d{8}T\d{6}\.json$')
+        with open(os.path.join(target_dir, filename)) as f:
+            [summary] = json.load(f)['results']
+    finally:
+        shutil.rmtree(target_dir)
+
+    nose.assert_equal(summary['table'], '1')
+    histogram = LatencyHistogram.fromdict(summary['histogram'])
+    nose.assert_equal(histogram.count, 100)
+
+def test_table_groups_are_planned_as_one_union():
+    nose.assert_equal(performance._parse_table_ids('3,1,1'), (1, 3))
+    nose.assert_equal(performance._table_label((1, 3)), '1,3')
+    nose.assert_raises(SystemExit, performance._parse_table_ids, '7')
+
+    with mock.patch('multiprocessing.Process'):
+        with mock.patch('jem_data.core.modbus.plan_requests') as plan_requests:
+            with mock.patch('multiprocessing.Queue'):
+                [result] = performance._benchmark_server(
+                        '127.0.0.1', 5020, [1], requests=1, delays=[0],
+                        warmup=0, tables=[(1, 2)], concurrency=1,
+                        gap_tolerance=4)
+    plan_requests.assert_called_once_with(
+            [registers.TABLES[0], registers.TABLES[1]], gap_tolerance=4)
+    nose.assert_equal(result.table, '1,2')
+
+def test_old_results_of_a_single_table_are_labelled_alike():
+    target_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(target_dir, 'old.json')
+        summary = performance._summarise(_result())
+        summary['table'] = 1
+        with open(path, 'wb') as f:
+            json.dump({'results': [summary]}, f)
+        nose.assert_equal(performance._load_results(path).keys(),
+                          [('1', 2, 0.0)])
+    finally:
+        shutil.rmtree(target_dir)
+
+def test_holm_adjusts_the_tested_p_values():
+    nose.assert_equal(performance._holm([0.01, None, 0.04, 0.03]),
+                      [0.03, None, 0.06, 0.06])
+    nose.assert_equal(performance._holm([0.5, 0.9]), [1.0, 1.0])
+
+class TestCompare(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_loads_old_csv_results(self):
+        path = self._write('response_times 2013-03-06 17:58:46.csv',
+                           'delay,concurrency level,response time\n'
+                           '0,1,0.04\n0,1,0.05\n0,2,0.08\n')
+        self._write('throughput 2013-03-06 17:58:46.csv',
+                    'delay,concurrency level,throughput\n'
+                    '0,1,21.5\n0,2,22.5\n')
+
+        results = performance._load_results(path)
+        nose.assert_equal(results.keys(), [('1', 1, 0.0), ('1', 2, 0.0)])
+        throughput, latencies = results[('1', 1, 0.0)]
+        nose.assert_equal(throughput, 21.5)
+        nose.assert_equal(latencies.count, 2)
+        nose.assert_equal(latencies.max, 0.05)
+
+    def test_passes_results_within_the_threshold(self):
+        baseline = self._write_json('baseline.json', _result())
+        same = self._write_json('same.json', _result())
+        faster = self._write_json('faster.json', _result(scale=0.5))
+        nose.assert_equal(
+                performance.compare(baseline, [same, faster],
+                                    threshold=10, significance=0.05), 0)
+
+    def test_fails_significantly_slower_results(self):
+        baseline = self._write_json('baseline.json', _result())
+        slower = self._write_json('slower.json', _result(scale=1.5))
+        nose.assert_equal(
+                performance.compare(baseline, [slower],
+                                    threshold=10, significance=0.05), 1)
+
+        [(key, comparison, regressions)] = performance._compare_results(
+                performance._load_results(baseline),
+                performance._load_results(slower),
+                threshold=10, significance=0.05)
+        nose.assert_equal(key, ('1', 2, 0.0))
+        nose.assert_in('throughput', regressions)
+        nose.assert_in('p50', regressions)
+        nose.assert_almost_equal(comparison['p50'][2], 50, delta=0.5)
+
+    def test_ignores_insignificant_differences(self):
+        baseline = self._write_json('baseline.json', _result())
+        slower = self._write_json('slower.json', _result(scale=1.5))
+        [(_, _, regressions)] = performance._compare_results(
+                performance._load_results(baseline),
+                performance._load_results(slower),
+                threshold=10, significance=1e-12)
+        nose.assert_equal(regressions, ['throughput'])
+
+    def test_fails_results_with_only_a_slower_tail(self):
+        baseline = self._write_json('baseline.json', _result(samples=1000))
+        slower = self._write_json('slower.json',
+                                  _result(samples=1000, tail_scale=2.0))
+        [(_, comparison, regressions)] = performance._compare_results(
+                performance._load_results(baseline),
+                performance._load_results(slower),
+                threshold=10, significance=0.05)
+        nose.assert_equal(regressions, ['p99'])
+        nose.assert_almost_equal(comparison['p50'][2], 0, delta=0.5)
+        nose.assert_greater(comparison['p50'][3], 0.05)
+        nose.assert_less(comparison['p99'][3], 0.05)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def _write_json(self, filename, result):
+        return self._write(filename, json.dumps(
+                {'results': [performance._summarise(result)]}))
+
+def _result(scale=1.0, samples=100, tail_scale=1.0):
+    '''Response times of 1ms to `samples`ms (scaled), with those of the
+    slowest 2% scaled again by `tail_scale`.
+    '''
+    clients = []
+    for client_id in range(2):
+        latencies = LatencyHistogram()
+        for i in range(client_id + 1, samples + 1, 2):
+            if i > samples * 0.98:
+                i *= tail_scale
+            latencies.record(i * 0.001 * scale)
+        clients.append(performance.ClientMeasurements(
+                client_id=client_id, latencies=latencies, errors=client_id + 1))
+    return performance.BenchmarkResult(
+            concurrency=2, delay=0.0, table='1',
+            client_measurements=clients, total_time=2.0 * scale)
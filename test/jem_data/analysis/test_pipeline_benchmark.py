@@ -0,0 +1,27 @@
+import nose.tools as nose
+
+import jem_data.analysis.pipeline_benchmark as pipeline_benchmark
+import jem_data.core.mongo_sink as mongo_sink
+
+def test_fixtures_fill_each_gateway_in_turn():
+    fixtures = pipeline_benchmark._fixtures(device_count=25,
+                                            units_per_gateway=10,
+                                            base_port=6000)
+    nose.assert_equal([ len(g['devices']) for g in fixtures ], [10, 10, 5])
+    nose.assert_equal([ g['port'] for g in fixtures ], [6000, 6001, 6002])
+
+def test_histogram_percentile_is_the_bound_of_its_bucket():
+    bounds = mongo_sink.SinkStats.LATENCY_BOUNDS
+    histogram = [0] * (len(bounds) + 1)
+    histogram[bounds.index(0.01)] = 90
+    histogram[bounds.index(0.5)] = 9
+    histogram[-1] = 1
+
+    nose.assert_equal(
+            pipeline_benchmark._histogram_percentile(histogram, 50), 0.01)
+    nose.assert_equal(
+            pipeline_benchmark._histogram_percentile(histogram, 99), 0.5)
+    nose.assert_is_none(
+            pipeline_benchmark._histogram_percentile(histogram, 100))
+    nose.assert_is_none(
+            pipeline_benchmark._histogram_percentile([0] * len(histogram), 50))
@@ -4,6 +4,9 @@ import nose.tools as nose
 
 import jem_data.api as api
 import jem_data.core.domain as domain
+import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.latest_values as latest_values
+import jem_data.core.messages as messages
 import jem_data.diris.devices as devices
 import test.jem_data.fixtures as fixtures
 
@@ -19,14 +22,25 @@ def test_retrieving_list_of_attached_gateways():
 
     system_control_service = mock.Mock()
     system_control_service.attached_gateways.return_value = gateways
+    system_control_service.attached_gateways_etag.return_value = 'abc'
     app = api.app_factory(system_control_service).test_client()
     response = app.get('/system-control/attached-devices')
     nose.assert_equal(200, response.status_code)
+    nose.assert_equal(response.headers['ETag'], '"abc"')
     data = json.loads(response.data)
     nose.assert_equal(2, len(data['gateways']))
     nose.assert_equal(len(data['gateways'][0]['devices']), 2)
     nose.assert_equal(len(data['gateways'][1]['devices']), 3)
 
+def test_retrieving_unchanged_list_of_attached_gateways():
+    system_control_service = mock.Mock()
+    system_control_service.attached_gateways_etag.return_value = 'abc'
+    app = api.app_factory(system_control_service).test_client()
+    response = app.get('/system-control/attached-devices',
+                       headers={'If-None-Match': '"abc"'})
+    nose.assert_equal(304, response.status_code)
+    nose.assert_false(system_control_service.attached_gateways.called)
+
 def test_updating_list_of_attached_gateways():
     gateways = fixtures.stub_gateways()
 
@@ -246,6 +260,37 @@ def test_retrieving_list_of_recordings():
     nose.assert_equal(200, response.status_code)
     data = json.loads(response.data)
     nose.assert_equal(10, len(data['recordings']))
+    nose.assert_is_none(data['before'])
+    nose.assert_is_none(data['before_id'])
+
+def test_paging_through_recording_summaries():
+    recordings = [ domain.RecordingSummary(id=str(i), status='ended',
+                                           start_time=i, end_time=i + 1) \
+                        for i in xrange(5, 3, -1) ]
+
+    system_control_service = mock.Mock()
+    system_control_service.all_recordings.return_value = recordings
+    app = api.app_factory(system_control_service).test_client()
+    response = app.get('/system-control/recordings'
+                       '?limit=2&before=6&before_id=6&summary=true')
+    nose.assert_equal(200, response.status_code)
+
+    system_control_service.all_recordings.assert_called_once_with(
+            limit=2, before_start_time=6.0, before_id='6', summary=True)
+    data = json.loads(response.data)
+    nose.assert_equal(data['recordings'][0],
+                      {'id': '5', 'status': 'ended',
+                       'start_time': 5, 'end_time': 6})
+    nose.assert_equal(data['before'], 4)
+    nose.assert_equal(data['before_id'], '4')
+
+def test_paging_before_an_invalid_recording_id():
+    system_control_service = mock.Mock()
+    system_control_service.all_recordings.side_effect = \
+            jem_exceptions.ValidationException("Invalid recording id")
+    app = api.app_factory(system_control_service).test_client()
+    response = app.get('/system-control/recordings?before=6&before_id=x')
+    nose.assert_equal(400, response.status_code)
 
 def _empty_recording(i):
     return domain.Recording(
@@ -254,3 +299,152 @@ def _empty_recording(i):
             gateways=fixtures.stub_gateways(),
             end_time=None,
             start_time=i)
+
+def test_streaming_recording_data():
+    system_control_service = mock.Mock()
+    system_control_service.recording_data.return_value = iter(
+            [ ('token-%d' % i, _response_msg(i)) for i in range(3) ])
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/recordings/abc/data'
+                       '?unit=2&register=50512&start=1.5&limit=2')
+    nose.assert_equal(200, response.status_code)
+
+    system_control_service.recording_data.assert_called_once_with(
+            'abc', resume_token=None, start_time=1.5, end_time=None,
+            host=None, port=None, unit=2, table_id=None,
+            registers=set([50512]))
+
+    lines = map(json.loads, response.data.splitlines())
+    nose.assert_equal(len(lines), 3)
+    nose.assert_equal(lines[0]['resume_token'], 'token-0')
+    nose.assert_equal(lines[0]['response'], {
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'timing_info': {'start': 0, 'end': 1},
+        'values': [[50512, 0]],
+    })
+    nose.assert_equal(lines[-1], {'resume_token': 'token-1',
+                                  'complete': False})
+
+def test_streaming_recording_data_to_the_end():
+    system_control_service = mock.Mock()
+    system_control_service.recording_data.return_value = iter([])
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/recordings/abc/data?resume=xyz')
+    nose.assert_equal(json.loads(response.data), {'resume_token': 'xyz',
+                                                  'complete': True})
+
+def test_streaming_data_of_unknown_recording():
+    system_control_service = mock.Mock()
+    system_control_service.recording_data.return_value = None
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/recordings/abc/data')
+    nose.assert_equal(404, response.status_code)
+
+def test_streaming_data_with_invalid_parameters():
+    system_control_service = mock.Mock()
+    system_control_service.recording_data.side_effect = \
+            jem_exceptions.ValidationException('Invalid resume token')
+    app = api.app_factory(system_control_service).test_client()
+
+    for query in ['resume=junk', 'unit=two', 'limit=0']:
+        response = app.get('/system-control/recordings/abc/data?' + query)
+        nose.assert_equal(400, response.status_code)
+
+def _response_msg(i):
+    return messages.ResponseMsg(
+            table_addr=domain.TableAddr(
+                domain.DeviceAddr(domain.GatewayAddr('127.0.0.1', 502), 2),
+                3),
+            values=((50512, i),),
+            timing_info=domain.TimingInfo(i, i + 1),
+            error=None,
+            request_info={'recording_id': 'abc'})
+
+def test_downsampled_register_series():
+    system_control_service = mock.Mock()
+    system_control_service.register_series.return_value = (
+            [(1.0, 5), (2.0, 7)], 500)
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/recordings/abc/series'
+                       '?register=50512&host=127.0.0.1&port=502&unit=2'
+                       '&points=100&method=min_max')
+    nose.assert_equal(200, response.status_code)
+
+    system_control_service.register_series.assert_called_once_with(
+            'abc', register=50512, host='127.0.0.1', port=502, unit=2,
+            max_points=100, method='min_max', start_time=None, end_time=None,
+            table_id=None)
+    nose.assert_equal(json.loads(response.data), {
+        'register': 50512,
+        'host': '127.0.0.1',
+        'port': 502,
+        'unit': 2,
+        'method': 'min_max',
+        'recorded_points': 500,
+        'points': [[1.0, 5], [2.0, 7]],
+    })
+
+def test_downsampled_register_series_with_invalid_parameters():
+    system_control_service = mock.Mock()
+    app = api.app_factory(system_control_service).test_client()
+
+    device = 'host=127.0.0.1&port=502&unit=2'
+    for query in [device, 'register=50512',
+                  'register=50512&unit=2',
+                  'register=50512&host=127.0.0.1&unit=2',
+                  'register=50512&%s&method=average' % device,
+                  'register=50512&%s&points=2' % device]:
+        response = app.get('/system-control/recordings/abc/series?' + query)
+        nose.assert_equal(400, response.status_code)
+
+def test_realtime_values_snapshot():
+    system_control_service = mock.Mock()
+    system_control_service.latest_values.return_value = (5, [
+        latest_values.LatestValue(
+            latest_values.ValueKey('127.0.0.1', 502, 2, 3, 50512),
+            value=7, timestamp=100.0, seq=5)])
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/realtime')
+    nose.assert_equal(json.loads(response.data), {
+        'seq': 5,
+        'values': [{
+            'device': {'gateway': {'host': '127.0.0.1', 'port': 502},
+                       'unit': 2},
+            'table_id': 3,
+            'register': 50512,
+            'value': 7,
+            'timestamp': 100.0,
+        }]
+    })
+
+def test_realtime_stream_sends_changes_from_the_last_event_id():
+    changes = [
+        (6, [latest_values.LatestValue(
+                latest_values.ValueKey('127.0.0.1', 502, 2, 3, 50512),
+                value=7, timestamp=100.0, seq=6)]),
+        (6, []),
+    ]
+    system_control_service = mock.Mock()
+    system_control_service.latest_value_changes.side_effect = changes
+    app = api.app_factory(system_control_service).test_client()
+
+    response = app.get('/system-control/realtime/stream',
+                       headers={'Last-Event-ID': '4'})
+    nose.assert_equal(response.mimetype, 'text/event-stream')
+
+    events = iter(response.response)
+    event = next(events)
+    nose.assert_true(event.startswith('id: 6\ndata: '))
+    nose.assert_equal(json.loads(event.split('data: ')[1])[0]['value'], 7)
+    nose.assert_equal(next(events), ': keepalive\n\n')
+
+    nose.assert_equal(
+        [ c[0][0] for c in
+            system_control_service.latest_value_changes.call_args_list ],
+        [4, 6])
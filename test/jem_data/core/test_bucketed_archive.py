@@ -0,0 +1,83 @@
+import mock
+import nose.tools as nose
+
+import jem_data.core.bucketed_archive as bucketed_archive
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.dal.json_marshalling as json_marshalling
+
+def test_responses_are_grouped_into_one_upsert_per_bucket():
+    collection = _stub_collection()
+    bucketed_archive.insert([_response_msg(61, [(0xC550, 1), (0xC552, 2)]),
+                             _response_msg(62, [(0xC550, 3), (0xC552, 4)]),
+                             _response_msg(62, [(0xC560, 5)]),
+                             _response_msg(121, [(0xC550, 6), (0xC552, 7)])],
+                            collection)
+
+    nose.assert_equal(collection.update.call_count, 3)
+    nose.assert_equal(len(collection.docs), 3)
+
+    bucket = collection.docs['127.0.0.1:502/2/3/50512-50514/60']
+    nose.assert_equal(bucket['device'], {
+        'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2})
+    nose.assert_equal(bucket['table_id'], 3)
+    nose.assert_equal((bucket['start'], bucket['end']), (60, 120))
+    nose.assert_equal(bucket['addresses'], [0xC550, 0xC552])
+    nose.assert_equal(bucket['count'], 2)
+    nose.assert_equal(bucket['end_times'], [61, 62])
+    nose.assert_equal(bucket['columns'], {'50512': [1, 3], '50514': [2, 4]})
+
+def test_failed_reads_are_not_stored():
+    collection = _stub_collection()
+    bucketed_archive.insert([_response_msg(61, None)], collection)
+    nose.assert_false(collection.update.called)
+
+def test_responses_can_be_read_back_from_their_buckets():
+    msgs = [_response_msg(61, [(0xC550, 1), (0xC552, 2)]),
+            _response_msg(62, [(0xC550, 3), (0xC552, 4)])]
+
+    collection = _stub_collection()
+    bucketed_archive.insert(msgs[:1], collection)
+    bucketed_archive.insert(msgs[1:], collection)
+
+    bucket, = collection.docs.values()
+    nose.assert_equal(
+            json_marshalling.unmarshall_archive_bucket(bucket, 'abc'),
+            [ msg._replace(values=tuple(msg.values)) for msg in msgs ])
+
+#---------------------------------------------------------------------------#
+# Fixture data and functions
+#---------------------------------------------------------------------------#
+
+def _stub_collection():
+    '''A collection applying the subset of upserts used by
+    `bucketed_archive`.
+    '''
+    docs = {}
+
+    def update(spec, doc, upsert):
+        stored = docs.setdefault(spec['_id'], {'_id': spec['_id']})
+        stored.update(doc['$set'])
+        for field, n in doc['$inc'].items():
+            stored[field] = stored.get(field, 0) + n
+        for field, push in doc['$push'].items():
+            d = stored
+            path = field.split('.')
+            for key in path[:-1]:
+                d = d.setdefault(key, {})
+            d.setdefault(path[-1], []).extend(push['$each'])
+
+    collection = mock.Mock()
+    collection.docs = docs
+    collection.update.side_effect = update
+    return collection
+
+def _response_msg(timestamp, values):
+    gateway_addr = domain.GatewayAddr(host="127.0.0.1", port=502)
+    device_addr = domain.DeviceAddr(gateway_addr, 2)
+    return messages.ResponseMsg(
+            table_addr = domain.TableAddr(device_addr, 3),
+            values = values,
+            timing_info = domain.TimingInfo(timestamp - 0.5, timestamp),
+            error = None,
+            request_info = {'recording_id': 'abc'})
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import socket
+import time
+
+import mock
+import nose.tools as nose
+import pymodbus.exceptions
+
+import jem_data.core.connection_pool as connection_pool
+
+def test_connections_are_reused():
+    factory = _StubClientFactory()
+    pool = _pool(factory)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    nose.assert_true(first is second)
+    nose.assert_equal(len(factory.clients), 1)
+
+def test_connections_raising_connection_errors_are_discarded():
+    factory = _StubClientFactory()
+    pool = _pool(factory)
+
+    try:
+        with pool.connection() as first:
+            raise pymodbus.exceptions.ConnectionException('Uh oh')
+    except pymodbus.exceptions.ConnectionException:
+        pass
+
+    with pool.connection() as second:
+        pass
+
+    nose.assert_false(first is second)
+    nose.assert_true(first.closed)
+
+def test_closed_idle_connections_are_replaced():
+    factory = _StubClientFactory()
+    pool = _pool(factory)
+
+    with pool.connection() as first:
+        pass
+    first.peer.close()
+
+    with pool.connection() as second:
+        pass
+
+    nose.assert_false(first is second)
+    nose.assert_true(first.closed)
+
+def test_connection_limit_is_respected():
+    factory = _StubClientFactory()
+    pool = _pool(factory, max_connections=1, max_backoff=0.01)
+
+    with pool.connection():
+        with nose.assert_raises(pymodbus.exceptions.ConnectionException):
+            with pool.connection():
+                pass
+
+    nose.assert_equal(len(factory.clients), 1)
+
+def test_failed_connections_back_off_exponentially():
+    factory = _StubClientFactory(reachable=False)
+    pool = _pool(factory, min_backoff=1.0, max_backoff=3.0)
+
+    backoffs = []
+    with mock.patch('time.sleep') as sleep:
+        for _ in range(4):
+            with nose.assert_raises(pymodbus.exceptions.ConnectionException):
+                with pool.connection():
+                    pass
+            backoffs.append(pool._backoff)
+
+    nose.assert_equal(backoffs, [1.0, 2.0, 3.0, 3.0])
+    nose.assert_equal(sleep.call_count, 3)
+
+def test_a_successful_connection_resets_the_backoff():
+    factory = _StubClientFactory(reachable=False)
+    pool = _pool(factory, min_backoff=0.01)
+
+    with nose.assert_raises(pymodbus.exceptions.ConnectionException):
+        with pool.connection():
+            pass
+
+    factory.reachable = True
+    with pool.connection():
+        pass
+    nose.assert_equal(pool._backoff, 0)
+
+def test_connections_of_dead_processes_are_reclaimed():
+    factory = _StubClientFactory()
+    pool = _pool(factory, max_connections=1, max_backoff=0.01)
+
+    reader = multiprocessing.Process(target=pool.reserve_connection)
+    reader.start()
+    reader.join()
+
+    with pool.connection():
+        pass
+    nose.assert_equal(len(factory.clients), 1)
+
+def test_zombie_processes_are_dead():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+
+    try:
+        deadline = time.time() + 5
+        while connection_pool._is_alive(pid) and time.time() < deadline:
+            time.sleep(0.01)
+        nose.assert_false(connection_pool._is_alive(pid))
+    finally:
+        os.waitpid(pid, 0)
+
+    nose.assert_true(connection_pool._is_alive(os.getpid()))
+
+#---------------------------------------------------------------------------#
+# Fixture data and functions
+#---------------------------------------------------------------------------#
+
+class _StubClient(object):
+    '''Connects to one end of a socket pair, the other end being the
+    "gateway".
+    '''
+
+    def __init__(self, reachable):
+        self.reachable = reachable
+        self.socket = None
+        self.peer = None
+        self.closed = False
+
+    def connect(self):
+        if self.reachable:
+            self.socket, self.peer = socket.socketpair()
+        return self.reachable
+
+    def close(self):
+        self.closed = True
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+class _StubClientFactory(object):
+
+    def __init__(self, reachable=True):
+        self.reachable = reachable
+        self.clients = []
+
+    def __call__(self, host, port):
+        client = _StubClient(self.reachable)
+        self.clients.append(client)
+        return client
+
+def _pool(factory, **kwargs):
+    return connection_pool.ConnectionPool('127.0.0.1', 5020,
+                                          client_factory=factory,
+                                          **kwargs)
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import nose.tools as nose
+
+import jem_data.core.domain as domain
+import jem_data.core.latest_values as latest_values
+import jem_data.core.messages as messages
+
+def test_coalescing_keeps_the_latest_value_of_each_register():
+    updates = latest_values.coalesce([
+        _response_msg(2, [(0xC550, 2), (0xC552, 7)]),
+        _response_msg(1, [(0xC550, 1)]),
+        _response_msg(3, None),
+    ])
+
+    nose.assert_equal(sorted(updates), [
+        (_key(0xC550), 2, 2),
+        (_key(0xC552), 7, 2),
+    ])
+
+def test_only_changed_values_are_sequenced():
+    store = latest_values.LatestValues()
+    store.update([(_key(0xC550), 1, 1), (_key(0xC552), 5, 1)])
+    store.update([(_key(0xC550), 1, 2), (_key(0xC552), 6, 2)])
+
+    seq, values = store.snapshot()
+    nose.assert_equal(seq, 3)
+    nose.assert_equal(sorted(values), [
+        latest_values.LatestValue(_key(0xC550), 1, 2, 1),
+        latest_values.LatestValue(_key(0xC552), 6, 2, 3),
+    ])
+
+    seq, changes = store.changes_since(2)
+    nose.assert_equal(changes, [
+        latest_values.LatestValue(_key(0xC552), 6, 2, 3)])
+
+def test_repeated_values_refresh_when_they_were_last_read():
+    store = latest_values.LatestValues()
+    store.update([(_key(0xC550), 1, 1)])
+    store.update([(_key(0xC550), 1, 5)])
+    # An older read, arriving late, is no news.
+    store.update([(_key(0xC550), 1, 3)])
+
+    seq, [latest] = store.snapshot()
+    nose.assert_equal(seq, 1)
+    nose.assert_equal(latest.timestamp, 5)
+    nose.assert_equal(latest.seq, 1)
+    nose.assert_equal(store.changes_since(1, timeout=0.01), (1, []))
+
+def test_changes_since_times_out_without_changes():
+    store = latest_values.LatestValues()
+    store.update([(_key(0xC550), 1, 1)])
+
+    nose.assert_equal(store.changes_since(1, timeout=0.01), (1, []))
+
+def test_changes_since_wakes_on_change():
+    store = latest_values.LatestValues()
+    t = threading.Timer(0.01, store.update, [[(_key(0xC550), 1, 1)]])
+    t.start()
+
+    seq, changes = store.changes_since(0, timeout=5)
+    t.join()
+    nose.assert_equal(seq, 1)
+    nose.assert_equal(len(changes), 1)
+
+def test_changes_since_a_sequence_number_from_before_a_restart():
+    store = latest_values.LatestValues()
+    store.update([(_key(0xC550), 1, 1), (_key(0xC552), 5, 1)])
+
+    start = time.time()
+    seq, changes = store.changes_since(1000, timeout=5)
+    nose.assert_less(time.time() - start, 1)
+    nose.assert_equal(seq, 2)
+    nose.assert_equal(len(changes), 2)
+
+def _key(register):
+    return latest_values.ValueKey('127.0.0.1', 502, 2, 3, register)
+
+def _response_msg(timestamp, values):
+    gateway_addr = domain.GatewayAddr(host="127.0.0.1", port=502)
+    device_addr = domain.DeviceAddr(gateway_addr, 2)
+    return messages.ResponseMsg(
+            table_addr = domain.TableAddr(device_addr, 3),
+            values = values,
+            timing_info = domain.TimingInfo(timestamp - 0.5, timestamp),
+            error = None,
+            request_info = {'recording_id': 'abc'})
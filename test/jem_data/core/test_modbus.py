@@ -147,6 +147,49 @@ def test_split_registers_invalid_widths():
     nose.assert_raises(ValueError,
                        modbus.split_registers,
                        registers)
+
+def test_split_registers_splits_on_gaps_larger_than_the_tolerance():
+    registers = {
+            0xC550: 2,
+            0xC552: 2,
+            0xC560: 1,
+            0xC563: 1,
+    }
+
+    result = modbus.split_registers(registers, gap_tolerance=2)
+    expected = [{0xC550: 2, 0xC552: 2},
+                {0xC560: 1, 0xC563: 1}]
+    nose.assert_equal(result, expected)
+
+def test_split_registers_zero_gap_tolerance():
+    registers = {
+            0xC550: 2,
+            0xC552: 1,
+            0xC554: 1,
+    }
+
+    result = modbus.split_registers(registers, gap_tolerance=0)
+    expected = [{0xC550: 2, 0xC552: 1},
+                {0xC554: 1}]
+    nose.assert_equal(result, expected)
+
+def test_split_registers_makes_the_fewest_requests():
+    registers = dict( (addr, 1) for addr in range(0, 1000, 3) )
+
+    result = modbus.split_registers(registers)
+    nose.assert_equal(len(result), 8)
+    nose.assert_equal(sorted(a for r in result for a in r),
+                      sorted(registers))
+
+def test_plan_requests_merges_nearby_tables():
+    tables = [
+        {0xC900: 1, 0xC907: 1},
+        {0xC950: 1, 0xC960: 1},
+    ]
+
+    nose.assert_equal(len(modbus.plan_requests(tables)), 1)
+    nose.assert_equal(len(modbus.plan_requests(tables, gap_tolerance=20)), 2)
+
 #---------------------------------------------------------------------------# 
 # Fixture data and functions
 #---------------------------------------------------------------------------# 
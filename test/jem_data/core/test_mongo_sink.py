@@ -1,10 +1,15 @@
 import mock
 import nose.tools as nose
+import pymongo
+import Queue
+import shutil
+import tempfile
 import time
 
 import jem_data.core.domain as domain
 import jem_data.core.messages as messages
 import jem_data.core.mongo_sink as mongo_sink
+import jem_data.core.spool as spool
 
 def test_writing_response_messages():
     '''Regression test for ensuring the results written to mongo stay
@@ -42,3 +47,237 @@ def test_writing_response_messages():
             "table_id": 3
         }
     ])
+
+def test_drain_stops_at_batch_size():
+    q = Queue.Queue()
+    for i in range(5):
+        q.put(i)
+
+    nose.assert_equal(mongo_sink._drain(q, batch_size=3, max_wait=1.0),
+                      [0, 1, 2])
+    nose.assert_equal(q.qsize(), 2)
+
+def test_drain_does_not_wait_longer_than_max_wait():
+    q = Queue.Queue()
+    q.put(0)
+
+    start = time.time()
+    nose.assert_equal(mongo_sink._drain(q, batch_size=10, max_wait=0.05), [0])
+    nose.assert_less(time.time() - start, 0.5)
+
+def test_drain_returns_nothing_if_idle_for_longer_than_timeout():
+    q = Queue.Queue()
+    nose.assert_equal(mongo_sink._drain(q, batch_size=10, max_wait=0.05,
+                                        timeout=0.01),
+                      [])
+
+def test_writing_a_batch_inserts_once_per_collection():
+    msgs = [_response_msg('abc'), _response_msg('def'), _response_msg('abc')]
+
+    db = mock.MagicMock()
+    mongo_sink._write_batch(msgs,
+                            ['archive-{recording_id}', 'realtime'],
+                            db)
+
+    nose.assert_equal(sorted(c[0][0] for c in db.__getitem__.call_args_list),
+                      ['archive-abc', 'archive-def', 'realtime'])
+
+    inserted = [ c[0][0] for c in db.__getitem__.return_value.insert.call_args_list ]
+    nose.assert_equal(sorted(map(len, inserted)), [1, 2, 3])
+
+def _response_msg(recording_id):
+    gateway_addr = domain.GatewayAddr(host="127.0.0.1", port=502)
+    device_addr = domain.DeviceAddr(gateway_addr, 2)
+    return messages.ResponseMsg(
+            table_addr = domain.TableAddr(device_addr, 3),
+            values = [(0xC550, 5001)],
+            timing_info = domain.TimingInfo(10000, 10001),
+            error = None,
+            request_info = {'recording_id': recording_id})
+
+def test_sink_stats_count_written_messages_by_latency():
+    stats = mongo_sink.SinkStats()
+    msgs = [_response_msg('abc')._replace(
+                    timing_info=domain.TimingInfo(start, start + 0.001)) \
+                for start in (99.9995, 99.95, 30.0) ]
+    stats.written(msgs, 100.0)
+    stats.increment('spooled', 2)
+
+    snapshot = stats.snapshot()
+    nose.assert_equal(snapshot['written'], 3)
+    nose.assert_equal(snapshot['spooled'], 2)
+    nose.assert_equal(snapshot['dropped'], 0)
+
+    bounds = mongo_sink.SinkStats.LATENCY_BOUNDS
+    nose.assert_equal(snapshot['latency'][0], 1)
+    nose.assert_equal(snapshot['latency'][bounds.index(0.05)], 1)
+    nose.assert_equal(snapshot['latency'][-1], 1)
+
+class _Stop(BaseException):
+    '''Raised to stop the (otherwise endless) mongo writer.'''
+
+class _FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class _ScriptedQueue(object):
+    '''Hands out the batches of messages one after the other, a second
+    apart.  Once they've all been handed out, time passes by each `get`'s
+    timeout, until the writer would block forever.
+    '''
+
+    def __init__(self, batches, clock):
+        self._batches = [ list(batch) for batch in batches ]
+        self._clock = clock
+
+    def get(self, timeout=None):
+        if self._batches and self._batches[0]:
+            return self._batches[0].pop(0)
+        if self._batches:
+            self._batches.pop(0)
+            self._clock.now += 1.0
+            raise Queue.Empty
+        if timeout is None:
+            raise _Stop
+        self._clock.now += timeout
+        raise Queue.Empty
+
+class _FlakyDatabase(object):
+    '''Fails the first `failures` inserts (and `ping_failures` pings), and
+    records the ids of the messages inserted after that.
+    '''
+
+    def __init__(self, failures, ping_failures=0):
+        self.failures = failures
+        self.ping_failures = ping_failures
+        self.pings = 0
+        self.inserted = []
+
+    def __getitem__(self, collection_name):
+        return self
+
+    def insert(self, documents):
+        if self.failures:
+            self.failures -= 1
+            raise pymongo.errors.AutoReconnect("Connection refused")
+        self.inserted.extend(d['timing_info']['start'] for d in documents)
+
+    def command(self, command):
+        self.pings += 1
+        if self.ping_failures:
+            self.ping_failures -= 1
+            raise pymongo.errors.AutoReconnect("Connection refused")
+
+class _RecordingSpool(spool.Spool):
+    '''Records when each batch is replayed.'''
+
+    def __init__(self, directory, clock):
+        super(_RecordingSpool, self).__init__(directory, clock=clock)
+        self.replay_times = []
+
+    def replay(self, write, limit):
+        replayed = super(_RecordingSpool, self).replay(write, limit)
+        if replayed:
+            self.replay_times.append(self._clock())
+        return replayed
+
+class TestMongoWriterOutages(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = _FakeClock()
+        self.time_patch = mock.patch('jem_data.core.mongo_sink.time')
+        self.time_patch.start().time = self.clock
+
+    def teardown(self):
+        self.time_patch.stop()
+        shutil.rmtree(self.directory)
+
+    def test_messages_are_spooled_and_replayed_until_mongo_is_back(self):
+        msgs = [ _response_msg('abc')._replace(
+                        timing_info=domain.TimingInfo(float(i), i + 0.001)) \
+                    for i in range(60) ]
+        batches = [ msgs[i:i + 5] for i in range(0, len(msgs), 5) ]
+
+        # The first connection attempt fails, and then the first two batches
+        # written after each retry.
+        db = _FlakyDatabase(failures=2)
+        connect = mock.Mock(side_effect=[
+                pymongo.errors.ConnectionFailure("Connection refused"), db])
+        s = _RecordingSpool(self.directory, self.clock)
+        sink_stats = mongo_sink.SinkStats()
+
+        nose.assert_raises(_Stop, mongo_sink.mongo_writer,
+                           _ScriptedQueue(batches, self.clock),
+                           ['archive-{recording_id}'],
+                           mongo_config=None,
+                           batch_size=5,
+                           max_wait=1.0,
+                           spool=s,
+                           replay_rate=2.5,
+                           retry_interval=3.0,
+                           sink_stats=sink_stats,
+                           connect=connect)
+
+        # Everything's written exactly once, with the spool emptied.
+        nose.assert_equal(sorted(db.inserted),
+                          [ float(i) for i in range(60) ])
+        nose.assert_false(s.pending)
+
+        snapshot = sink_stats.snapshot()
+        nose.assert_equal(snapshot['written'], 60)
+        nose.assert_equal(snapshot['dropped'], 0)
+        # Three outages, each spooling the batches of the 3s until the retry.
+        nose.assert_equal(snapshot['spooled'], 45)
+
+        # Replayed 5 messages at a time, at no more than 2.5 messages a
+        # second.
+        nose.assert_equal(len(s.replay_times), 9)
+        for earlier, later in zip(s.replay_times, s.replay_times[1:]):
+            nose.assert_greater_equal(later - earlier, 2.0)
+
+    def test_an_idle_writer_checks_mongo_is_back_before_reconnecting(self):
+        msgs = [ _response_msg('abc')._replace(
+                        timing_info=domain.TimingInfo(float(i), i + 0.001)) \
+                    for i in range(5) ]
+        db = _FlakyDatabase(failures=1, ping_failures=3)
+        s = _RecordingSpool(self.directory, self.clock)
+
+        with mock.patch('jem_data.core.mongo_sink._log') as log:
+            nose.assert_raises(_Stop, mongo_sink.mongo_writer,
+                               _ScriptedQueue([msgs], self.clock),
+                               ['archive-{recording_id}'],
+                               mongo_config=None,
+                               batch_size=5,
+                               max_wait=1.0,
+                               spool=s,
+                               retry_interval=3.0,
+                               connect=lambda mongo_config: db)
+
+        nose.assert_equal(db.pings, 4)
+        nose.assert_equal(
+                [ c for c in log.info.call_args_list \
+                    if c[0][0] == "Reconnected to mongo" ],
+                [mock.call("Reconnected to mongo")])
+        nose.assert_equal(sorted(db.inserted), [ float(i) for i in range(5) ])
+
+    def test_messages_which_fail_to_be_written_are_counted_as_dropped(self):
+        db = mock.MagicMock()
+        db.__getitem__.return_value.insert.side_effect = ValueError("Oops")
+        sink_stats = mongo_sink.SinkStats()
+
+        nose.assert_raises(_Stop, mongo_sink.mongo_writer,
+                           _ScriptedQueue([[_response_msg('abc')] * 3],
+                                          self.clock),
+                           ['archive-{recording_id}'],
+                           mongo_config=None,
+                           sink_stats=sink_stats,
+                           connect=lambda mongo_config: db)
+
+        snapshot = sink_stats.snapshot()
+        nose.assert_equal(snapshot['written'], 0)
+        nose.assert_equal(snapshot['dropped'], 3)
@@ -0,0 +1,114 @@
+import mock
+import nose.tools as nose
+
+from twisted.internet import defer, task
+import pymodbus.transaction as transaction
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.pipelined_reader as pipelined_reader
+
+def test_keeps_no_more_than_pipeline_depth_requests_in_flight():
+    client = _StubClient()
+    out_q = mock.Mock()
+    reader = _reader(out_q, [_read_table_msg(1) for _ in range(3)],
+                     pipeline_depth=2)
+
+    reader.connected(client)
+    nose.assert_equal(len(client.pending), 2)
+
+    client.respond()
+    nose.assert_equal(len(client.pending), 2)
+    nose.assert_equal(out_q.put.call_count, 1)
+
+    client.respond()
+    client.respond()
+    nose.assert_equal(len(client.pending), 0)
+    nose.assert_equal(out_q.put.call_count, 3)
+
+def test_issues_every_request_of_a_large_table():
+    client = _StubClient()
+    out_q = mock.Mock()
+    reader = _reader(out_q, [_read_table_msg(6)], pipeline_depth=4)
+
+    reader.connected(client)
+    nose.assert_greater(len(client.pending), 1)
+
+    while client.pending:
+        client.respond()
+    nose.assert_greater(out_q.put.call_count, 1)
+
+def test_timed_out_requests_release_their_slot():
+    client = _StubClient()
+    clock = task.Clock()
+    out_q = mock.Mock()
+    reader = _reader(out_q, [_read_table_msg(1) for _ in range(2)],
+                     pipeline_depth=1, clock=clock)
+
+    reader.connected(client)
+    nose.assert_equal(len(client.pending), 1)
+
+    clock.advance(pipelined_reader.DEFAULT_REQUEST_TIMEOUT)
+    nose.assert_equal(len(client.pending), 2)
+    nose.assert_equal(out_q.put.call_count, 0)
+
+def test_timed_out_requests_are_forgotten_by_the_client():
+    client = _StubClient()
+    clock = task.Clock()
+    reader = _reader(mock.Mock(), [_read_table_msg(1) for _ in range(3)],
+                     pipeline_depth=1, clock=clock)
+
+    reader.connected(client)
+    clock.advance(pipelined_reader.DEFAULT_REQUEST_TIMEOUT)
+    clock.advance(pipelined_reader.DEFAULT_REQUEST_TIMEOUT)
+    nose.assert_equal(list(client.transaction), [3])
+
+#---------------------------------------------------------------------------#
+# Fixture data and functions
+#---------------------------------------------------------------------------#
+
+class _StubClient(object):
+    '''Answers requests only when told to, every register holding 0.'''
+
+    def __init__(self):
+        self.pending = []
+        self.framer = transaction.ModbusSocketFramer(decoder=None)
+        self.transaction = transaction.DictTransactionManager(self)
+
+    def read_holding_registers(self, address, count, unit):
+        d = defer.Deferred()
+        self.transaction.addTransaction(d, self.transaction.getNextTID())
+        self.pending.append((d, count))
+        return d
+
+    def respond(self):
+        d, count = self.pending.pop(0)
+        response = mock.Mock()
+        response.registers = [0] * count
+        d.callback(response)
+
+def _reader(out_q, msgs, pipeline_depth, clock=None):
+    reader = pipelined_reader.PipelinedReader(
+            in_q=None,
+            out_q=out_q,
+            pipeline_depth=pipeline_depth,
+            request_timeout=pipelined_reader.DEFAULT_REQUEST_TIMEOUT,
+            clock=clock or task.Clock())
+
+    msgs = list(msgs)
+    def fetch_msg():
+        if msgs:
+            return defer.succeed(msgs.pop(0))
+        return defer.Deferred()
+    reader._fetch_msg = fetch_msg
+    return reader
+
+def _read_table_msg(table_id):
+    return messages.ReadTableMsg(
+            table_addr = domain.TableAddr(
+                device_addr = domain.DeviceAddr(
+                    gateway_addr=domain.GatewayAddr('127.0.0.1', 5020),
+                    unit=0x01),
+                id = table_id),
+            recording_id="unique-id",
+            sent_at=1000.0)
@@ -0,0 +1,59 @@
+import mock
+import nose.tools as nose
+
+import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.read_plan as read_plan
+import jem_data.diris.registers as diris_registers
+
+def test_plans_are_cached():
+    plan = read_plan.for_tables('diris.a40', [1, 2])
+    nose.assert_true(plan is read_plan.for_tables('diris.a40', [2, 1, 2]))
+
+def test_plan_covers_every_register_of_every_table():
+    plan = read_plan.for_tables('diris.a40', [3, 6])
+
+    addresses = [ a for r in plan.requests for a in r.addresses ]
+    expected = sorted(diris_registers.TABLES[2].keys() +
+                      diris_registers.TABLES[5].keys())
+    nose.assert_equal(addresses, expected)
+
+def test_planned_request_layout():
+    plan = read_plan.for_tables('diris.a40', [3])
+    request = plan.requests[0]
+
+    nose.assert_equal(request.start, 0xC750)
+    nose.assert_equal(request.offsets[:3], (0, 2, 4))
+    nose.assert_equal(request.widths[:3], (2, 2, 2))
+    nose.assert_equal(request.formats[-1], 'h')
+    nose.assert_equal(set(request.table_ids), set([3]))
+    nose.assert_equal(request.count,
+                      request.offsets[-1] + request.widths[-1])
+
+def test_planned_request_decodes_a_response():
+    request = read_plan.for_tables('diris.a40', [3]).requests[0]
+
+    response = mock.Mock()
+    response.registers = [0] * request.count
+    response.registers[0:2] = [0x0BCD, 0x1234]
+    response.registers[-1] = 0xFFFF
+
+    values = request.decode(response)
+    nose.assert_equal(values[0], (0xC750, 0x0BCD1234))
+    nose.assert_equal(values[-1], (request.addresses[-1], -1))
+
+def test_planned_request_rejects_a_short_response():
+    request = read_plan.for_tables('diris.a40', [3]).requests[0]
+
+    response = mock.Mock()
+    response.registers = [0] * (request.count - 1)
+
+    nose.assert_raises(jem_exceptions.ModbusInvalidResponse,
+                       request.decode, response)
+
+def test_unknown_device_type():
+    nose.assert_raises(ValueError,
+                       read_plan.for_tables, 'unknown', [1])
+
+def test_unknown_table():
+    nose.assert_raises(ValueError,
+                       read_plan.for_tables, 'diris.a40', [7])
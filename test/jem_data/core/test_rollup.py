@@ -0,0 +1,133 @@
+import mock
+import nose.tools as nose
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.rollup as rollup
+
+def test_values_are_summarised_per_interval():
+    r = rollup.Rollup(resolutions=[rollup.MINUTE])
+    r.add([_response_msg(60, 5), _response_msg(90, 1), _response_msg(119, 3),
+           _response_msg(120, 7)])
+
+    db = _StubDb()
+    r.flush(db, force=True)
+
+    buckets = db.buckets('rollup-minute-abc')
+    nose.assert_equal(len(buckets), 2)
+
+    first, second = buckets
+    nose.assert_equal((first['start'], first['end']), (60, 120))
+    nose.assert_equal(first['registers'][str(0xC550)], {
+        'min': 1, 'max': 5, 'sum': 9, 'count': 3, 'mean': 3.0,
+        'last': 3, 'last_time': 119 })
+    nose.assert_equal(second['registers'][str(0xC550)]['count'], 1)
+
+def test_each_resolution_has_its_own_collection():
+    r = rollup.Rollup()
+    r.add([_response_msg(60, 5)])
+
+    db = _StubDb()
+    r.flush(db, force=True)
+
+    nose.assert_equal(sorted(db.collections),
+                      ['rollup-hour-abc', 'rollup-minute-abc'])
+    nose.assert_equal(db.buckets('rollup-hour-abc')[0]['start'], 0)
+
+def test_failed_reads_are_ignored():
+    r = rollup.Rollup()
+    r.add([_response_msg(60, None)])
+
+    db = _StubDb()
+    r.flush(db, force=True)
+    nose.assert_equal(db.collections, {})
+
+def test_flushes_no_more_often_than_the_flush_interval():
+    clock = mock.Mock(return_value=0)
+    r = rollup.Rollup(flush_interval=5, clock=clock)
+    r.add([_response_msg(60, 5)])
+
+    db = _StubDb()
+    clock.return_value = 4
+    r.flush(db)
+    nose.assert_equal(db.collections, {})
+
+    clock.return_value = 5
+    r.flush(db)
+    nose.assert_equal(len(db.collections), 2)
+
+def test_only_updated_buckets_are_rewritten():
+    r = rollup.Rollup(resolutions=[rollup.MINUTE], clock=lambda: 0)
+    r.add([_response_msg(60, 5)])
+
+    db = _StubDb()
+    r.flush(db, force=True)
+    r.flush(db, force=True)
+
+    nose.assert_equal(db['rollup-minute-abc'].update.call_count, 1)
+
+def test_buckets_are_merged_with_those_stored_by_a_previous_writer():
+    previous = rollup.Rollup(resolutions=[rollup.MINUTE])
+    previous.add([_response_msg(60, 5), _response_msg(70, 1)])
+    db = _StubDb()
+    previous.flush(db, force=True)
+
+    r = rollup.Rollup(resolutions=[rollup.MINUTE])
+    r.add([_response_msg(80, 3)])
+    r.flush(db, force=True)
+
+    bucket, = db.buckets('rollup-minute-abc')
+    nose.assert_equal(bucket['registers'][str(0xC550)], {
+        'min': 1, 'max': 5, 'sum': 9, 'count': 3, 'mean': 3.0,
+        'last': 3, 'last_time': 80 })
+
+def test_closed_buckets_are_dropped_once_written():
+    clock = mock.Mock(return_value=0)
+    r = rollup.Rollup(resolutions=[rollup.MINUTE], clock=clock)
+    r.add([_response_msg(60, 5)])
+
+    clock.return_value = 119
+    r.flush(_StubDb(), force=True)
+    nose.assert_equal(len(r._buckets), 1)
+
+    clock.return_value = 120
+    r.flush(_StubDb(), force=True)
+    nose.assert_equal(len(r._buckets), 0)
+
+#---------------------------------------------------------------------------#
+# Fixture data and functions
+#---------------------------------------------------------------------------#
+
+class _StubDb(object):
+    '''Collections supporting just enough of find_one/update(upsert=True) to
+    store rollup buckets by id.
+    '''
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            docs = {}
+            collection = mock.Mock()
+            collection.docs = docs
+            collection.find_one.side_effect = docs.get
+            collection.update.side_effect = \
+                    lambda spec, doc, upsert: docs.__setitem__(
+                            spec['_id'], dict(doc['$set'], _id=spec['_id']))
+            self.collections[name] = collection
+        return self.collections[name]
+
+    def buckets(self, name):
+        return sorted(self.collections[name].docs.values(),
+                      key=lambda d: d['start'])
+
+def _response_msg(timestamp, value):
+    gateway_addr = domain.GatewayAddr(host="127.0.0.1", port=502)
+    device_addr = domain.DeviceAddr(gateway_addr, 2)
+    return messages.ResponseMsg(
+            table_addr = domain.TableAddr(device_addr, 3),
+            values = None if value is None else [(0xC550, value)],
+            timing_info = domain.TimingInfo(timestamp - 1, timestamp),
+            error = None,
+            request_info = {'recording_id': 'abc'})
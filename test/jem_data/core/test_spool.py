@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+
+import nose.tools as nose
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.spool as spool
+
+class TestSpool(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replays_the_messages_appended(self):
+        s = spool.Spool(self.directory)
+        msgs = [ _response_msg(i) for i in range(5) ]
+        s.append(msgs[:2])
+        s.append(msgs[2:])
+        nose.assert_true(s.pending)
+
+        replayed = []
+        nose.assert_equal(s.replay(replayed.extend, limit=10), 5)
+        nose.assert_equal(replayed, msgs)
+        nose.assert_false(s.pending)
+        nose.assert_equal(s.replay(replayed.extend, limit=10), 0)
+
+    def test_replays_from_where_the_last_spool_left_off(self):
+        s = spool.Spool(self.directory)
+        msgs = [ _response_msg(i) for i in range(5) ]
+        s.append(msgs)
+        s.close()
+
+        replayed = []
+        nose.assert_equal(s.replay(replayed.extend, limit=2), 2)
+
+        s = spool.Spool(self.directory)
+        nose.assert_true(s.pending)
+        while s.replay(replayed.extend, limit=2):
+            pass
+        nose.assert_equal(replayed, msgs)
+        nose.assert_false(s.pending)
+
+    def test_keeps_messages_which_fail_to_be_written(self):
+        s = spool.Spool(self.directory)
+        s.append([_response_msg(0)])
+
+        def fail(msgs):
+            raise IOError("Uh oh")
+        with nose.assert_raises(IOError):
+            s.replay(fail, limit=10)
+
+        replayed = []
+        s.replay(replayed.extend, limit=10)
+        nose.assert_equal(replayed, [_response_msg(0)])
+
+    def test_rolls_over_to_new_segments(self):
+        s = spool.Spool(self.directory, segment_bytes=1)
+        msgs = [ _response_msg(i) for i in range(3) ]
+        for msg in msgs:
+            s.append([msg])
+        nose.assert_equal(len(os.listdir(self.directory)), 3)
+
+        replayed = []
+        while s.replay(replayed.extend, limit=10):
+            pass
+        nose.assert_equal(replayed, msgs)
+        nose.assert_equal(os.listdir(self.directory), [])
+
+    def test_ignores_a_truncated_last_line(self):
+        s = spool.Spool(self.directory)
+        s.append([_response_msg(0), _response_msg(1)])
+        s.close()
+
+        [segment] = os.listdir(self.directory)
+        path = os.path.join(self.directory, segment)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 10)
+
+        replayed = []
+        nose.assert_equal(s.replay(replayed.extend, limit=10), 1)
+        nose.assert_equal(replayed, [_response_msg(0)])
+        nose.assert_false(s.pending)
+
+def _response_msg(i):
+    gateway_addr = domain.GatewayAddr(host="127.0.0.1", port=502)
+    device_addr = domain.DeviceAddr(gateway_addr, 2)
+    return messages.ResponseMsg(
+            table_addr = domain.TableAddr(device_addr, 3),
+            values = ((0xC550, 5001 + i), (0xC552, 5005)),
+            timing_info = domain.TimingInfo(10000.5 + i, 10001.5 + i),
+            error = None,
+            request_info = {'recording_id': 'abc'})
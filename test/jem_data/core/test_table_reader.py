@@ -1,5 +1,6 @@
 import mock
 import nose.tools as nose
+import Queue
 
 import jem_data.core.domain as domain
 import jem_data.core.messages as messages
@@ -12,13 +13,14 @@ def test_read_small_table():
                 device_addr = domain.DeviceAddr(
                     gateway_addr=mock.Mock(), unit=0xFF),
                 id = 1),
-            recording_id="unique-id")
+            recording_id="unique-id",
+            sent_at=1000.0)
 
     out_q = mock.Mock()
     conn = mock.Mock()
 
-    with mock.patch('jem_data.core.modbus.read_registers'):
-        table_reader._read_table(in_q, out_q, conn)
+    with mock.patch('jem_data.core.modbus.read_planned'):
+        table_reader._read_table(in_q.get(), out_q, conn)
 
     out_q.put.assert_called_once_with(mock.ANY)
 
@@ -29,14 +31,93 @@ def test_read_large_table():
                 device_addr = domain.DeviceAddr(
                     gateway_addr=mock.Mock(), unit=0xFF),
                 id = 6),
-            recording_id="unique_id")
+            recording_id="unique_id",
+            sent_at=1000.0)
 
     out_q = mock.Mock()
     conn = mock.Mock()
 
-    with mock.patch('jem_data.core.modbus.read_registers'):
-        table_reader._read_table(in_q, out_q, conn)
+    with mock.patch('jem_data.core.modbus.read_planned'):
+        table_reader._read_table(in_q.get(), out_q, conn)
 
     ## Table 6 is large, and requires more than 1 call.
     ## Check that more than 1 sub-result is being pushed on the queue.
     nose.assert_greater(len(out_q.put.mock_calls), 1)
+
+def test_reports_which_request_was_read():
+    feedback_q = Queue.Queue()
+    table_reader._report_read(feedback_q, _read_table_msg(5), values=(1, 2))
+
+    msg = feedback_q.get_nowait()
+    nose.assert_equal(msg.sent_at, 1000.0)
+    nose.assert_equal(msg.values_digest, hash((1, 2)))
+
+def test_dispatcher_balances_units_across_queues():
+    queues = [mock.Mock() for _ in range(2)]
+    dispatcher = table_reader.UnitDispatcher(queues)
+
+    for unit in [2, 4, 6, 8, 2, 4]:
+        dispatcher.put(_read_table_msg(unit))
+
+    nose.assert_equal([q.put.call_count for q in queues], [3, 3])
+
+def test_dispatcher_pins_each_unit_to_one_queue():
+    queues = [mock.Mock() for _ in range(3)]
+    dispatcher = table_reader.UnitDispatcher(queues)
+
+    for _ in range(3):
+        dispatcher.put(_read_table_msg(5))
+
+    nose.assert_equal(sorted(q.put.call_count for q in queues), [0, 0, 3])
+
+def test_dispatcher_keeps_the_readers_connection_pool():
+    gateway = domain.GatewayAddr('127.0.0.1', 5020)
+    with mock.patch('multiprocessing.Process'):
+        dispatcher = table_reader.start_readers(gateway, mock.Mock(),
+                                                number_processes=2)
+
+    nose.assert_equal(len(dispatcher.processes), 2)
+    nose.assert_equal((dispatcher.pool.host, dispatcher.pool.port),
+                      ('127.0.0.1', 5020))
+
+def test_readers_plan_with_the_given_gap_tolerance():
+    gateway = domain.GatewayAddr('127.0.0.1', 5020)
+    with mock.patch('multiprocessing.Process') as process:
+        table_reader.start_readers(gateway, mock.Mock(), number_processes=2,
+                                   gap_tolerance=3)
+
+    nose.assert_equal(
+            [ c[1]['kwargs']['gap_tolerance'] for c in process.call_args_list ],
+            [3, 3])
+
+    conn = mock.Mock()
+    with mock.patch('jem_data.core.modbus.read_planned'):
+        with mock.patch('jem_data.core.read_plan.for_tables') as for_tables:
+            for_tables.return_value.requests = ()
+            table_reader._read_table(_read_table_msg(5), mock.Mock(), conn,
+                                     gap_tolerance=3)
+    for_tables.assert_called_once_with('diris.a40', [1], gap_tolerance=3)
+
+def test_work_queue_takes_work_from_siblings_when_idle():
+    own_q, sibling_q = Queue.Queue(), Queue.Queue()
+    sibling_q.put('msg')
+    work_q = table_reader._WorkQueue(own_q, [sibling_q], steal_interval=0.01)
+
+    nose.assert_equal(work_q.get(), 'msg')
+
+def test_work_queue_prefers_its_own_work():
+    own_q, sibling_q = Queue.Queue(), Queue.Queue()
+    own_q.put('own')
+    sibling_q.put('sibling')
+    work_q = table_reader._WorkQueue(own_q, [sibling_q], steal_interval=0.01)
+
+    nose.assert_equal(work_q.get(), 'own')
+
+def _read_table_msg(unit):
+    return messages.ReadTableMsg(
+            table_addr = domain.TableAddr(
+                device_addr = domain.DeviceAddr(
+                    gateway_addr=mock.Mock(), unit=unit),
+                id = 1),
+            recording_id="unique-id",
+            sent_at=1000.0)
@@ -1,9 +1,11 @@
 import mock
 import nose.tools as nose
+import Queue
 import time
 
 import jem_data.core.table_request_manager as trm
 import jem_data.core.domain as domain
+import jem_data.core.messages as messages
 
 def test_start_recording():
     queues, instructions = mock.Mock(), mock.Mock()
@@ -21,10 +23,173 @@ def test_start_recording():
     ]
 
     expected_instruction = trm._ResetRequests(tables=expected_tables,
-                                              recording_id="abc")
+                                              recording_id="abc",
+                                              polling={})
     manager.start_recording(recording)
     instructions.put.assert_called_once_with(expected_instruction)
 
+def test_start_recording_passes_on_configured_polling():
+    queues, instructions = mock.Mock(), mock.Mock()
+    manager = trm.TableRequestManager(queues, instructions)
+
+    polling = domain.Polling(interval=60.0, adaptive=True)
+    recording = _stub_recording()
+    device = recording.gateways[0].devices[0]
+    tables = [device.tables[0]._replace(polling=polling)] + device.tables[1:]
+    recording.gateways[0].devices[0] = device._replace(tables=tables)
+
+    manager.start_recording(recording)
+
+    instruction = instructions.put.call_args[0][0]
+    expected_table = domain.TableAddr(
+            domain.DeviceAddr(domain.GatewayAddr("127.0.0.1", 5020), 10), 1)
+    nose.assert_equal(instruction.polling, {expected_table: polling})
+
+def test_tables_are_read_at_their_configured_interval():
+    table_1, table_2 = _table_addr(1), _table_addr(2)
+    manager = _reset_manager([table_1, table_2],
+                             {table_2: domain.Polling(60.0, False)})
+
+    delays = _scheduled_delays(manager)
+    nose.assert_almost_equal(delays[table_1], trm.DEFAULT_POLL_INTERVAL,
+                             places=2)
+    nose.assert_almost_equal(delays[table_2], 60.0, places=2)
+
+def test_adaptive_polling_backs_off_whilst_values_are_unchanged():
+    table = _table_addr(1)
+    feedback = Queue.Queue()
+    manager = _reset_manager([table], {table: domain.Polling(1.0, True)},
+                             feedback=feedback)
+    schedule = manager._config[table]
+
+    for _ in range(10):
+        feedback.put(messages.TableReadMsg(table, 1234, None, None))
+    manager._read_feedback()
+    nose.assert_equal(schedule.interval, 1.0 * trm.MAX_BACKOFF)
+
+    feedback.put(messages.TableReadMsg(table, 5678, None, None))
+    manager._read_feedback()
+    nose.assert_equal(schedule.interval, 1.0)
+
+def test_non_adaptive_polling_ignores_unchanged_values():
+    table = _table_addr(1)
+    feedback = Queue.Queue()
+    manager = _reset_manager([table], {table: domain.Polling(1.0, False)},
+                             feedback=feedback)
+
+    for _ in range(3):
+        feedback.put(messages.TableReadMsg(table, 1234, None, None))
+    manager._read_feedback()
+    nose.assert_equal(manager._config[table].interval, 1.0)
+
+def test_polls_are_skipped_whilst_the_previous_request_is_in_flight():
+    table = _table_addr(1)
+    gateway = table.device_addr.gateway_addr
+    feedback = Queue.Queue()
+    manager = _reset_manager([table], {}, feedback=feedback)
+    q = manager._queues[gateway]
+
+    for _ in range(3):
+        _push(manager, table)
+    nose.assert_equal(q.put.call_count, 1)
+    nose.assert_equal(manager.stats.snapshot()['127.0.0.1:5020']['skipped'], 2)
+
+    _feed_back(feedback, q.put.call_args[0][0])
+    _push(manager, table)
+    nose.assert_equal(q.put.call_count, 2)
+
+def test_lost_requests_expire():
+    table = _table_addr(1)
+    manager = _reset_manager([table], {}, feedback=Queue.Queue())
+    q = manager._queues[table.device_addr.gateway_addr]
+
+    _push(manager, table)
+    manager._in_flight[table] -= trm.IN_FLIGHT_TIMEOUT + 1
+    _push(manager, table)
+
+    nose.assert_equal(q.put.call_count, 2)
+    counters = manager.stats.snapshot()['127.0.0.1:5020']
+    nose.assert_equal(counters['expired'], 1)
+    nose.assert_equal(counters['in_flight'], 1)
+
+def test_tasks_from_before_a_reset_are_dropped():
+    table = _table_addr(1)
+    manager = _reset_manager([table], {})
+    q = manager._queues[table.device_addr.gateway_addr]
+
+    stale_task = trm._PushTableRequestTask(table, manager._generation)
+    manager._run_reset_instruction(trm._ResetRequests(tables=[table],
+                                                      recording_id="def",
+                                                      polling={}))
+    manager._run_task(stale_task)
+
+    nose.assert_equal(q.put.call_count, 0)
+
+def test_late_feedback_from_an_expired_request_is_not_mistaken_for_the_next():
+    table = _table_addr(1)
+    feedback = Queue.Queue()
+    manager = _reset_manager([table], {}, feedback=feedback)
+    q = manager._queues[table.device_addr.gateway_addr]
+
+    _push(manager, table)
+    expired = q.put.call_args[0][0]
+    manager._in_flight[table] -= trm.IN_FLIGHT_TIMEOUT + 1
+    _push(manager, table)
+    nose.assert_equal(q.put.call_count, 2)
+
+    _feed_back(feedback, expired)
+    _push(manager, table)
+    nose.assert_equal(q.put.call_count, 2)
+    counters = manager.stats.snapshot()['127.0.0.1:5020']
+    nose.assert_equal(counters['in_flight'], 1)
+
+    _feed_back(feedback, q.put.call_args[0][0])
+    _push(manager, table)
+    nose.assert_equal(q.put.call_count, 3)
+
+def test_requests_in_flight_for_dropped_tables_are_forgotten():
+    table_1, table_2 = _table_addr(1), _table_addr(2)
+    manager = _reset_manager([table_1, table_2], {}, feedback=Queue.Queue())
+    _push(manager, table_1)
+    _push(manager, table_2)
+
+    manager._run_reset_instruction(trm._ResetRequests(tables=[table_2],
+                                                      recording_id="def",
+                                                      polling={}))
+
+    nose.assert_equal(manager._in_flight.keys(), [table_2])
+    counters = manager.stats.snapshot()['127.0.0.1:5020']
+    nose.assert_equal(counters['in_flight'], 1)
+
+def _feed_back(feedback, req):
+    '''Report the request's table as read.'''
+    feedback.put(messages.TableReadMsg(req.table_addr, 1234, None,
+                                       req.sent_at))
+
+def _push(manager, table):
+    manager._run_task(trm._PushTableRequestTask(table, manager._generation))
+
+def _reset_manager(tables, polling, feedback=None):
+    gateway = tables[0].device_addr.gateway_addr
+    q = mock.Mock()
+    q.qsize.return_value = 0
+    manager = trm.TableRequestManager({gateway: q},
+                                      mock.Mock(),
+                                      feedback,
+                                      trm.SchedulingStats([gateway]))
+    manager._run_reset_instruction(trm._ResetRequests(tables=tables,
+                                                      recording_id="abc",
+                                                      polling=polling))
+    return manager
+
+def _scheduled_delays(manager):
+    now = time.time()
+    return dict( (task.table, t - now) for (t, task) in manager._tasks )
+
+def _table_addr(table_id):
+    gateway = domain.GatewayAddr("127.0.0.1", 5020)
+    return domain.TableAddr(domain.DeviceAddr(gateway, 10), table_id)
+
 def _stub_recording():
     return domain.Recording(
             id='abc',
@@ -0,0 +1,61 @@
+import Queue
+
+import nose.tools as nose
+
+import jem_data.core.domain as domain
+import jem_data.core.messages as messages
+import jem_data.core.read_plan as read_plan
+import jem_data.core.wire as wire
+
+_GATEWAYS = [domain.GatewayAddr('127.0.0.1', 5020),
+             domain.GatewayAddr('192.168.0.101', 502)]
+
+def test_responses_survive_encoding():
+    codec = wire.ResponseCodec(_GATEWAYS)
+    for table_id in [1, 3, 6]:
+        for request in read_plan.for_tables('diris.a40', [table_id]).requests:
+            msg = _response_msg(table_id, request)
+            encoded = codec.encode(msg)
+            nose.assert_true(isinstance(encoded, str))
+            nose.assert_equal(codec.decode(encoded), msg)
+
+def test_unencodable_responses():
+    codec = wire.ResponseCodec(_GATEWAYS)
+    request = read_plan.for_tables('diris.a40', [1]).requests[0]
+    msg = _response_msg(1, request)
+
+    unknown_gateway = msg._replace(table_addr=domain.TableAddr(
+            domain.DeviceAddr(domain.GatewayAddr('10.0.0.1', 502), 2), 1))
+    for unencodable in [msg._replace(error='Uh oh', values=None),
+                        msg._replace(values=msg.values[1:]),
+                        msg._replace(values=msg.values[:-1]),
+                        msg._replace(request_info={'recording_id': None}),
+                        msg._replace(request_info=None),
+                        unknown_gateway]:
+        with nose.assert_raises(ValueError):
+            codec.encode(unencodable)
+
+def test_queues_pass_unencodable_responses_through_as_they_are():
+    codec = wire.ResponseCodec(_GATEWAYS)
+    request = read_plan.for_tables('diris.a40', [1]).requests[0]
+    msg = _response_msg(1, request)
+    failed = msg._replace(error='Uh oh', values=None)
+
+    q = Queue.Queue()
+    encoding_q = wire.EncodingQueue(q, codec)
+    encoding_q.put(msg)
+    encoding_q.put(failed)
+
+    decoding_q = wire.DecodingQueue(q, codec)
+    nose.assert_equal(decoding_q.get(), msg)
+    nose.assert_equal(decoding_q.get(timeout=1), failed)
+
+def _response_msg(table_id, request):
+    return messages.ResponseMsg(
+            table_addr=domain.TableAddr(
+                domain.DeviceAddr(_GATEWAYS[1], 2), table_id),
+            values=tuple( (addr, -i) for i, addr in \
+                                enumerate(request.addresses) ),
+            timing_info=domain.TimingInfo(1370000000.25, 1370000000.5),
+            error=None,
+            request_info={'recording_id': '51a0f2a3e138230d28c4c5a1'})
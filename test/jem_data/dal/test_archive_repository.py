@@ -0,0 +1,198 @@
+import bson.objectid as objectid
+import mock
+import nose.tools as nose
+
+import jem_data.core.domain as domain
+import jem_data.core.exceptions as jem_exceptions
+import jem_data.core.messages as messages
+import jem_data.dal as dal
+
+def test_reads_responses_from_bucketed_archive_if_present():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc', 'archive-buckets-abc']
+    collection = db['archive-buckets-abc']
+    collection.find.return_value.sort.return_value = iter([{
+        '_id': '127.0.0.1:502/2/3/50512-50514/60',
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'start': 60,
+        'end': 120,
+        'addresses': [50512, 50514],
+        'count': 3,
+        'start_times': [60.5, 69.5, 79.5],
+        'end_times': [61, 70, 80],
+        'columns': {'50512': [1, 3, 5], '50514': [2, 4, 6]},
+    }])
+    repo = dal.ArchiveRepository(db)
+
+    responses = list(repo.responses('abc', start_time=65, end_time=80))
+
+    collection.find.assert_called_once_with({'end': {'$gt': 65},
+                                             'start': {'$lt': 80}})
+    nose.assert_equal(responses, [
+        messages.ResponseMsg(
+            table_addr=_table_addr(),
+            values=((50512, 3), (50514, 4)),
+            timing_info=domain.TimingInfo(69.5, 70),
+            error=None,
+            request_info={'recording_id': 'abc'})
+    ])
+
+def test_reads_responses_from_document_archive_otherwise():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    collection = db['archive-abc']
+    collection.find.return_value.sort.return_value = iter([{
+        '_id': objectid.ObjectId('51a0f2a3e138230d28c4c5a1'),
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'values': [[50512, 3], [50514, 4]],
+        'timing_info': {'start': 69.5, 'end': 70},
+        'error': None,
+        'request_info': {'recording_id': 'abc'},
+    }])
+    repo = dal.ArchiveRepository(db)
+
+    responses = list(repo.responses('abc', start_time=65))
+
+    collection.find.assert_called_once_with({'timing_info.end': {'$gte': 65}})
+    nose.assert_equal(responses, [
+        messages.ResponseMsg(
+            table_addr=_table_addr(),
+            values=((50512, 3), (50514, 4)),
+            timing_info=domain.TimingInfo(69.5, 70),
+            error=None,
+            request_info={'recording_id': 'abc'})
+    ])
+
+def test_resuming_bucketed_responses():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-buckets-abc']
+    collection = db['archive-buckets-abc']
+    repo = dal.ArchiveRepository(db)
+
+    collection.find.return_value.sort.return_value = iter([_bucket()])
+    tokens, msgs = zip(*repo.resumable_responses('abc'))
+    nose.assert_equal([ m.timing_info.end for m in msgs ], [61, 70, 80])
+
+    collection.find.return_value.sort.return_value = iter([_bucket()])
+    resumed = list(repo.resumable_responses('abc', resume_token=tokens[0]))
+
+    nose.assert_equal(collection.find.call_args[0][0], {
+        '$or': [
+            {'start': {'$gt': 60}},
+            {'start': 60, '_id': {'$gte': '127.0.0.1:502/2/3/50512-50514/60'}},
+        ]
+    })
+    nose.assert_equal(resumed, zip(tokens[1:], msgs[1:]))
+
+def test_resuming_document_responses():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    collection = db['archive-abc']
+    collection.find.return_value.sort.return_value = iter([
+        _document('51a0f2a3e138230d28c4c5a1')])
+    repo = dal.ArchiveRepository(db)
+
+    (token, _), = repo.resumable_responses('abc')
+    list(repo.resumable_responses('abc', resume_token=token))
+
+    collection.find.assert_called_with({
+        '$or': [
+            {'timing_info.end': {'$gt': 70}},
+            {'timing_info.end': 70,
+             '_id': {'$gt': objectid.ObjectId('51a0f2a3e138230d28c4c5a1')}},
+        ]
+    })
+    collection.find.return_value.sort.assert_called_with(
+            [('timing_info.end', 1), ('_id', 1)])
+
+def test_filtering_by_register():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    collection = db['archive-abc']
+    collection.find.return_value.sort.return_value = iter([
+        _document('51a0f2a3e138230d28c4c5a1')])
+    repo = dal.ArchiveRepository(db)
+
+    msg, = repo.responses('abc', unit=2, table_id=3, registers=set([50514]))
+
+    collection.find.assert_called_with({'device.unit': 2, 'table_id': 3})
+    nose.assert_equal(msg.values, ((50514, 4),))
+
+def test_register_values_projects_the_register_from_documents():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    collection = db['archive-abc']
+    collection.find.return_value = iter([
+        {'timing_info': {'end': 70}, 'values': [[50514, 4]]}])
+    repo = dal.ArchiveRepository(db)
+
+    values = list(repo.register_values('abc', 50514, host='127.0.0.1',
+                                       port=502, unit=2, start_time=65))
+
+    collection.find.assert_called_once_with(
+            {'device.gateway.host': '127.0.0.1',
+             'device.gateway.port': 502,
+             'device.unit': 2,
+             'timing_info.end': {'$gte': 65},
+             'values': {'$elemMatch': {'0': 50514}}},
+            fields={'timing_info.end': 1, 'values.$': 1, '_id': 0})
+    nose.assert_equal(values, [(70, 4)])
+
+def test_register_values_projects_the_register_from_buckets():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-buckets-abc']
+    collection = db['archive-buckets-abc']
+    collection.find.return_value = iter([
+        {'end_times': [61, 70, 80], 'columns': {'50514': [2, 4, 6]}}])
+    repo = dal.ArchiveRepository(db)
+
+    values = list(repo.register_values('abc', 50514, unit=2, start_time=65))
+
+    collection.find.assert_called_once_with(
+            {'device.unit': 2, 'end': {'$gt': 65}, 'addresses': 50514},
+            fields={'end_times': 1, 'columns.50514': 1, '_id': 0})
+    nose.assert_equal(values, [(70, 4), (80, 6)])
+
+@nose.raises(jem_exceptions.ValidationException)
+def test_invalid_resume_token():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    dal.ArchiveRepository(db).resumable_responses('abc', resume_token='junk')
+
+@nose.raises(jem_exceptions.ValidationException)
+def test_resume_token_with_an_invalid_id_is_rejected_before_reading():
+    db = mock.MagicMock()
+    db.collection_names.return_value = ['archive-abc']
+    token = dal._encode_resume_token('d', 70, 'not-an-object-id')
+    dal.ArchiveRepository(db).resumable_responses('abc', resume_token=token)
+
+def _bucket():
+    return {
+        '_id': '127.0.0.1:502/2/3/50512-50514/60',
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'start': 60,
+        'end': 120,
+        'addresses': [50512, 50514],
+        'count': 3,
+        'start_times': [60.5, 69.5, 79.5],
+        'end_times': [61, 70, 80],
+        'columns': {'50512': [1, 3, 5], '50514': [2, 4, 6]},
+    }
+
+def _document(id):
+    return {
+        '_id': objectid.ObjectId(id),
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 502}, 'unit': 2},
+        'table_id': 3,
+        'values': [[50512, 3], [50514, 4]],
+        'timing_info': {'start': 69.5, 'end': 70},
+        'error': None,
+        'request_info': {'recording_id': 'abc'},
+    }
+
+def _table_addr():
+    return domain.TableAddr(
+            domain.DeviceAddr(domain.GatewayAddr('127.0.0.1', 502), 2), 3)
@@ -1,4 +1,5 @@
 import mock
+import nose.tools as nose
 
 import jem_data.dal as dal
 import test.jem_data.fixtures as fixtures
@@ -25,3 +26,28 @@ def test_all():
 
     repo.insert(gateways)
     db['gateways'].insert.assert_called_once_with(mock.ANY)
+
+def test_caching_repository_reads_gateways_once():
+    repo = mock.Mock()
+    repo.all.return_value = fixtures.stub_gateways()
+    cache = dal.CachingGatewayRepository(repo)
+
+    nose.assert_equal(cache.all(), fixtures.stub_gateways())
+    etag = cache.etag()
+    nose.assert_equal(cache.all(), fixtures.stub_gateways())
+    nose.assert_equal(repo.all.call_count, 1)
+    nose.assert_equal(cache.etag(), etag)
+
+def test_caching_repository_is_invalidated_by_changes():
+    repo = mock.Mock()
+    repo.all.return_value = fixtures.stub_gateways()
+    cache = dal.CachingGatewayRepository(repo)
+    etag = cache.etag()
+
+    repo.all.return_value = fixtures.stub_gateways()[:1]
+    cache.delete_all()
+    cache.insert(fixtures.stub_gateways()[:1])
+
+    nose.assert_equal(cache.all(), fixtures.stub_gateways()[:1])
+    nose.assert_not_equal(cache.etag(), etag)
+    repo.insert.assert_called_once_with(fixtures.stub_gateways()[:1])
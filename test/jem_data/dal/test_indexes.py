@@ -0,0 +1,53 @@
+import mock
+import nose.tools as nose
+
+import jem_data.dal.indexes as indexes
+
+def test_expected_indexes_by_collection():
+    nose.assert_equal(indexes.expected_indexes('recordings'),
+                      indexes.RECORDINGS_INDEXES)
+    nose.assert_equal(indexes.expected_indexes('archive-abc'),
+                      indexes.ARCHIVE_INDEXES)
+    nose.assert_not_equal(indexes.expected_indexes('archive-buckets-abc'),
+                          indexes.ARCHIVE_INDEXES)
+    nose.assert_equal(indexes.expected_indexes('realtime'), [])
+
+def test_missing_indexes():
+    db = _stub_db({
+        'recordings': [[('_id', 1)], [('status', 1)]],
+        'archive-abc': [[('_id', 1)]] + indexes.ARCHIVE_INDEXES,
+        'realtime': [[('_id', 1)]],
+    })
+
+    nose.assert_equal(indexes.missing_indexes(db),
+                      [('recordings', [('start_time', -1), ('_id', -1)])])
+
+def test_ensure_all_indexes_creates_the_missing_indexes():
+    db = _stub_db({
+        'recordings': [[('_id', 1)], [('status', 1)]],
+    })
+
+    indexes.ensure_all_indexes(db)
+    db['recordings'].ensure_index.assert_called_once_with(
+            [('start_time', -1), ('_id', -1)], background=True)
+
+def test_recordings_indexes_are_missing_before_it_exists():
+    db = _stub_db({'recordings': []})
+    db.collection_names.return_value = []
+
+    nose.assert_equal(indexes.missing_indexes(db),
+                      [ ('recordings', keys) \
+                            for keys in indexes.RECORDINGS_INDEXES ])
+
+def _stub_db(collection_indexes):
+    collections = {}
+    for name, keys in collection_indexes.items():
+        collection = mock.Mock()
+        collection.index_information.return_value = dict(
+                ('index_%d' % i, {'key': k}) for i, k in enumerate(keys))
+        collections[name] = collection
+
+    db = mock.MagicMock()
+    db.collection_names.return_value = collections.keys()
+    db.__getitem__.side_effect = collections.__getitem__
+    return db
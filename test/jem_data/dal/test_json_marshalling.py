@@ -1,5 +1,6 @@
 import nose.tools as nose
 
+import jem_data.core.domain as domain
 import jem_data.dal.json_marshalling as json_marshalling
 import jem_data.util as util
 import test.jem_data.fixtures as fixtures
@@ -12,3 +13,19 @@ def test_marshalling_and_unmarshalling_gateways():
                       map(json_marshalling.unmarshall_gateway,
                           fixtures.raw_gateway_data()))
 
+def test_unmarshalling_device_recording_config_with_polling():
+    config = json_marshalling.unmarshall_device_recording_config({
+        'unit': 1,
+        'table_ids': [1, 2],
+        'polling': {'2': {'interval': 60, 'adaptive': True}}
+    })
+
+    nose.assert_equal(config.polling, {2: domain.Polling(60.0, True)})
+
+def test_unmarshalling_device_recording_config_without_polling():
+    config = json_marshalling.unmarshall_device_recording_config({
+        'unit': 1,
+        'table_ids': [1, 2],
+    })
+
+    nose.assert_equal(config.polling, {})
@@ -1,10 +1,13 @@
+import bson.objectid as objectid
 import mock
+import pymongo
 import nose.tools as nose
 import time
 
 import jem_data.core.domain as domain
 import jem_data.core.exceptions as jem_exceptions
 import jem_data.dal as dal
+import jem_data.dal.indexes as indexes
 import test.jem_data.fixtures as fixtures
 
 def test_create():
@@ -25,8 +28,16 @@ def test_create():
 
     db['recordings'].insert.assert_called_once_with(mock.ANY)
     db.create_collection.assert_called_once_with('archive-abcdefg')
+    for keys in indexes.ARCHIVE_INDEXES:
+        db['archive-abcdefg'].ensure_index.assert_any_call(keys,
+                                                           background=True)
     nose.assert_equal(updated_value.id, 'abcdefg')
 
+def test_creating_the_repository_leaves_the_indexes_alone():
+    db = mock.MagicMock()
+    dal.RecordingsRepository(db)
+    nose.assert_false(db['recordings'].ensure_index.called)
+
 def test_all():
     raw_data = {
         '_id': 'abcde',
@@ -75,12 +86,63 @@ def test_all():
     }
     
     db = {'recordings': mock.Mock()}
-    db['recordings'].find.return_value = [raw_data]
+    db['recordings'].find.return_value.sort.return_value = [raw_data]
     repo = dal.RecordingsRepository(db)
     result = repo.all()
     nose.assert_true(result)
     nose.assert_true(isinstance(result[0], domain.Recording))
+    db['recordings'].find.assert_called_once_with({}, fields=None)
+    db['recordings'].find.return_value.sort.assert_called_once_with(
+            [('start_time', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+
+def test_all_paged_summaries():
+    raw_data = {
+        '_id': 'abcde',
+        'status': 'ended',
+        'start_time': 1000,
+        'end_time': 2000,
+    }
+
+    db = {'recordings': mock.Mock()}
+    cursor = db['recordings'].find.return_value.sort.return_value
+    cursor.limit.return_value = [raw_data]
+    repo = dal.RecordingsRepository(db)
+    result = repo.all(limit=10, before_start_time=3000, summary=True)
+
+    db['recordings'].find.assert_called_once_with(
+            {'start_time': {'$lt': 3000}},
+            fields=['status', 'start_time', 'end_time'])
+    cursor.limit.assert_called_once_with(10)
+    nose.assert_equal(result, [
+        domain.RecordingSummary(id='abcde', status='ended',
+                                start_time=1000, end_time=2000)])
+
+def test_paging_past_recordings_started_at_the_same_time():
+    before_id = '5123f0aa1f8e1d2a3c000002'
 
+    db = {'recordings': mock.Mock()}
+    cursor = db['recordings'].find.return_value.sort.return_value
+    cursor.limit.return_value = []
+    repo = dal.RecordingsRepository(db)
+    repo.all(limit=10, before_start_time=3000, before_id=before_id)
+
+    # The rest of the recordings started at 3000 are on the next page.
+    db['recordings'].find.assert_called_once_with(
+            {'$or': [
+                {'start_time': {'$lt': 3000}},
+                {'start_time': 3000,
+                 '_id': {'$lt': objectid.ObjectId(before_id)}},
+            ]},
+            fields=None)
+    db['recordings'].find.return_value.sort.assert_called_once_with(
+            [('start_time', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+
+def test_paging_before_an_invalid_id_is_rejected():
+    db = {'recordings': mock.Mock()}
+    repo = dal.RecordingsRepository(db)
+    nose.assert_raises(jem_exceptions.ValidationException, repo.all,
+                       before_start_time=3000, before_id='not-an-id')
+    nose.assert_false(db['recordings'].find.called)
 
 def test_cleanup_recordings():
     db = {'recordings': mock.Mock()}
@@ -95,3 +157,38 @@ def test_cleanup_recordings_raise_exceptions_on_error():
     repo = dal.RecordingsRepository(db)
     nose.assert_raises(jem_exceptions.PersistenceException,
                        repo.cleanup_recordings)
+
+def test_rollups():
+    db = mock.MagicMock()
+    cursor = db['rollup-minute-abcde'].find.return_value.sort.return_value
+    cursor.__iter__.return_value = iter([{
+        '_id': '127.0.0.1:5020/1/3/60',
+        'device': {'gateway': {'host': '127.0.0.1', 'port': 5020}, 'unit': 1},
+        'table_id': 3,
+        'resolution': 'minute',
+        'start': 60,
+        'end': 120,
+        'registers': {
+            '50512': {'min': 1, 'max': 5, 'sum': 9, 'count': 3, 'mean': 3.0,
+                      'last': 3, 'last_time': 119},
+        },
+    }])
+    repo = dal.RecordingsRepository(db)
+
+    buckets = repo.rollups('abcde', 'minute', start_time=100)
+
+    db['rollup-minute-abcde'].find.assert_called_once_with(
+            {'end': {'$gt': 100}})
+    nose.assert_equal(buckets, [
+        domain.RollupBucket(
+            table_addr=domain.TableAddr(
+                domain.DeviceAddr(domain.GatewayAddr('127.0.0.1', 5020), 1),
+                3),
+            resolution='minute',
+            start=60,
+            end=120,
+            registers={
+                50512: domain.RegisterStats(min=1, max=5, mean=3.0, count=3,
+                                            last=3),
+            })
+    ])
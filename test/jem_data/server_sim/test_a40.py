@@ -1,6 +1,7 @@
 from nose.tools import assert_equal
 
 import jem_data.server_sim.a40 as a40
+import jem_data.util as util
 
 def test_a40_input_registers_are_initialized_to_zero_by_default():
     datablock = a40.A40HoldingRegistersDataBlock(dynamic=False)
@@ -36,3 +37,18 @@ def test_a40_fails_on_registers_below_the_lowest_address():
     value = datablock.validate(0, 2)
     assert_equal(value, False)
 
+
+def test_a40_fails_on_ranges_including_unknown_registers():
+    datablock = a40.A40HoldingRegistersDataBlock(dynamic=False)
+    assert_equal(datablock.validate(0xC550, 2), True)
+    assert_equal(datablock.validate(0xC54F, 2), False)
+    assert_equal(datablock.validate(0xC550, 0), False)
+
+def test_a40_steps_every_register_by_at_most_one():
+    datablock = a40.A40HoldingRegistersDataBlock(dynamic=False)
+    for _ in range(10):
+        before = datablock.getValues(0xC652, 2)
+        datablock._step()
+        after = datablock.getValues(0xC652, 2)
+        assert abs(util.unpack_values(after) -
+                   util.unpack_values(before)) <= 1
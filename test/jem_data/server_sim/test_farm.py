@@ -0,0 +1,30 @@
+import nose.tools as nose
+
+import jem_data.server_sim.farm as farm
+
+def test_constant_zero_latency_is_immediate():
+    nose.assert_is_none(farm.latency_distribution('constant:0'))
+
+def test_latencies_are_never_negative():
+    latency = farm.latency_distribution('normal:0.001,1')
+    nose.assert_true(all(latency() >= 0 for _ in range(100)))
+
+def test_rejects_unknown_latencies():
+    for spec in ['gamma:1', 'uniform:1', 'constant:x', 'constant']:
+        nose.assert_raises(ValueError, farm.latency_distribution, spec)
+
+def test_fixture_simulation_overrides_defaults():
+    defaults = {'latency': 'constant:0', 'serial': False,
+                'timeout_rate': '0', 'timeout': '1.0',
+                'exception_rate': '0', 'exception_code': '6'}
+    behaviour = farm.behaviour(defaults, {'serial': True,
+                                          'latency': 'constant:0.5'})
+    nose.assert_true(behaviour.serial)
+    nose.assert_equal(behaviour.latency(), 0.5)
+    nose.assert_equal(behaviour.exception_code, 6)
+
+def test_generates_gateways_on_consecutive_ports():
+    fixtures = farm.generate(gateways=3, units=2,
+                             host='127.0.0.1', base_port=6000)
+    nose.assert_equal([ g['port'] for g in fixtures ], [6000, 6001, 6002])
+    nose.assert_equal([ d['unit'] for d in fixtures[0]['devices'] ], [1, 2])
@@ -0,0 +1,75 @@
+import itertools
+
+import nose.tools as nose
+from twisted.internet import task
+
+import jem_data.server_sim.tcp_gateway as tcp_gateway
+
+class _StubProtocol(object):
+
+    def __init__(self):
+        self.responses = []
+
+    def respond(self, request, exception_code=None):
+        self.responses.append((request, exception_code))
+
+class _StubRequest(object):
+    transaction_id = 0
+
+def test_serial_bus_answers_one_request_at_a_time():
+    clock = task.Clock()
+    bus = tcp_gateway._Bus(_behaviour(latency=lambda: 0.5, serial=True),
+                           clock=clock)
+    protocol = _StubProtocol()
+    requests = [_StubRequest(), _StubRequest()]
+    for request in requests:
+        bus.submit(protocol, request)
+
+    clock.advance(0.5)
+    nose.assert_equal(protocol.responses, [(requests[0], None)])
+    clock.advance(0.5)
+    nose.assert_equal(protocol.responses,
+                      [(requests[0], None), (requests[1], None)])
+
+def test_concurrent_bus_answers_requests_together():
+    clock = task.Clock()
+    bus = tcp_gateway._Bus(_behaviour(latency=lambda: 0.5, serial=False),
+                           clock=clock)
+    protocol = _StubProtocol()
+    bus.submit(protocol, _StubRequest())
+    bus.submit(protocol, _StubRequest())
+
+    clock.advance(0.5)
+    nose.assert_equal(len(protocol.responses), 2)
+
+def test_timed_out_requests_hold_up_the_bus():
+    clock = task.Clock()
+    randoms = itertools.chain([0.05], itertools.repeat(0.5))
+    bus = tcp_gateway._Bus(_behaviour(timeout_rate=0.1, timeout=2.0,
+                                      serial=True),
+                           clock=clock,
+                           random=lambda: next(randoms))
+    protocol = _StubProtocol()
+    timed_out, answered = _StubRequest(), _StubRequest()
+    bus.submit(protocol, timed_out)
+    bus.submit(protocol, answered)
+
+    clock.advance(1.9)
+    nose.assert_equal(protocol.responses, [])
+    clock.advance(0.1)
+    nose.assert_equal(protocol.responses, [(answered, None)])
+
+def test_injects_exceptions():
+    clock = task.Clock()
+    bus = tcp_gateway._Bus(_behaviour(exception_rate=0.1, exception_code=4),
+                           clock=clock,
+                           random=lambda: 0.05)
+    protocol = _StubProtocol()
+    request = _StubRequest()
+    bus.submit(protocol, request)
+
+    clock.advance(0)
+    nose.assert_equal(protocol.responses, [(request, 4)])
+
+def _behaviour(**kwargs):
+    return tcp_gateway.IMMEDIATE._replace(**kwargs)
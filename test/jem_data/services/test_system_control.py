@@ -3,6 +3,7 @@ import nose as nose_core
 import nose.tools as nose
 
 import jem_data.core.domain as domain
+import jem_data.core.messages as messages
 import jem_data.services.system_control as services
 import jem_data.core.exceptions as jem_exceptions
 
@@ -90,14 +91,91 @@ def test_attached_gateways():
     system_control.attached_gateways()
     db.gateways.all.assert_called_once_with()
 
-def tesgatewaysecordings():
+def test_all_recordings():
     db = mock.Mock()
     system_control = services.SystemControlService(db)
-    db.recordings.all.return_value = [
-        domain.Recording(
-            id=None, status=None, gateways=[], end_time=None,
-            start_time=i) for i in xrange(10) ]
-    result = system_control.all_recordings()
-
-    nose.assert_equal(len(result), 10)
-    nose.assert_equal(result[0].start_time, 9)
+    result = system_control.all_recordings(limit=10, before_start_time=9,
+                                           before_id='abc')
+
+    db.recordings.all.assert_called_once_with(
+            limit=10, before_start_time=9, before_id='abc', summary=False)
+    nose.assert_equal(result, db.recordings.all.return_value)
+
+def test_start_recording_applies_configured_polling():
+    db = mock.Mock()
+    db.gateways.all.return_value = [
+        domain.Gateway(host="127.0.0.1", port=502, label=None, devices=[
+            domain.Device(unit=1, label=None, type='diris.a40', tables=[
+                domain.Table(id=1, label=None, registers=[]),
+                domain.Table(id=2, label=None, registers=[]),
+            ])
+        ])
+    ]
+    db.recordings.create.side_effect = lambda r: r._replace(id='abc')
+    system_control = services.SystemControlService(db)
+    system_control._table_request_manager = mock.Mock()
+
+    polling = domain.Polling(interval=60.0, adaptive=True)
+    recording = system_control.start_recording(domain.RecordingConfig([
+        domain.GatewayRecordingConfig("127.0.0.1", 502, [
+            domain.DeviceRecordingConfig(1, [1, 2], {2: polling})
+        ])
+    ]))
+
+    tables = recording.gateways[0].devices[0].tables
+    nose.assert_equal([t.polling for t in tables], [None, polling])
+
+def test_start_recording_validates_polling_interval():
+    system_control = services.SystemControlService(mock.Mock())
+
+    nose.assert_raises(ValidationException,
+                       system_control.start_recording,
+                       domain.RecordingConfig([
+                           domain.GatewayRecordingConfig("127.0.0.1", 502, [
+                               domain.DeviceRecordingConfig(
+                                   1, [1], {1: domain.Polling(0, False)})
+                           ])
+                       ]))
+
+def test_recording_data_of_unknown_recording():
+    db = mock.Mock()
+    db.recordings.by_id.return_value = None
+    system_control = services.SystemControlService(db)
+
+    nose.assert_is_none(system_control.recording_data('abc'))
+    nose.assert_false(db.archive.resumable_responses.called)
+
+def test_recording_data():
+    db = mock.Mock()
+    system_control = services.SystemControlService(db)
+
+    responses = system_control.recording_data('abc', resume_token='xyz',
+                                              unit=2)
+    db.archive.resumable_responses.assert_called_once_with(
+            'abc', resume_token='xyz', unit=2)
+    nose.assert_equal(responses, db.archive.resumable_responses.return_value)
+
+def test_register_series():
+    db = mock.Mock()
+    db.archive.register_values.return_value = iter([
+        (2.0, 7), (1.0, 5), (3.0, 6)])
+    system_control = services.SystemControlService(db)
+
+    points, recorded = system_control.register_series(
+            'abc', register=50512, host='127.0.0.1', port=502, unit=2,
+            max_points=10, start_time=1.0)
+
+    db.archive.register_values.assert_called_once_with(
+            'abc', 50512, host='127.0.0.1', port=502, unit=2, start_time=1.0)
+    nose.assert_equal(points, [(1.0, 5), (2.0, 7), (3.0, 6)])
+    nose.assert_equal(recorded, 3)
+
+def _response_msg(timestamp, value):
+    return messages.ResponseMsg(
+            table_addr=domain.TableAddr(
+                domain.DeviceAddr(domain.GatewayAddr('127.0.0.1', 502), 2),
+                3),
+            values=((50512, value),),
+            timing_info=domain.TimingInfo(timestamp - 0.5, timestamp),
+            error=None,
+            request_info={'recording_id': 'abc'})
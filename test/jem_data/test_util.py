@@ -1,5 +1,6 @@
 import itertools
 import random
+import struct
 
 import nose.tools as nose
 
@@ -15,3 +16,36 @@ def test_packing_and_unpacking():
             packed = util.pack_value(i, width)
             unpacked = util.unpack_values(packed)
             nose.assert_equal(i, unpacked)
+
+def test_lru_cache_evicts_least_recently_used():
+    calls = []
+
+    @util.lru_cache(maxsize=2)
+    def f(x):
+        calls.append(x)
+        return x
+
+    f(1); f(2); f(1); f(3); f(1); f(2)
+    nose.assert_equal(calls, [1, 2, 3, 2])
+
+def test_register_decoder_skips_unrequested_registers():
+    decoder = util.RegisterDecoder(count=7,
+                                   offsets=[0, 3, 4],
+                                   widths=[2, 1, 2])
+    values = [0x0BCD, 0x1234, 0xAAAA, 0xFFFF, 0x8000, 0x0000, 0xBBBB]
+
+    nose.assert_equal(decoder.decode(values),
+                      (0x0BCD1234, -1, -2147483648))
+
+def test_register_decoder_encodes_values_with_gaps_zeroed():
+    decoder = util.RegisterDecoder(count=7,
+                                   offsets=[0, 3, 4],
+                                   widths=[2, 1, 2])
+
+    nose.assert_equal(decoder.encode([0x0BCD1234, -1, -2147483648]),
+                      struct.pack('>7H',
+                                  0x0BCD, 0x1234, 0, 0xFFFF, 0x8000, 0, 0))
+
+def test_register_decoder_rejects_overlapping_registers():
+    nose.assert_raises(ValueError,
+                       util.RegisterDecoder, 4, [0, 1], [2, 1])